@@ -1,5 +1,41 @@
 # coding : utf-8
-from algom.makegrid import full_interp, sd2uv, v_interp, std_sh, \
-                           multi_v_interp
-from algom.io import load_js, parse, parse_data, parse_info, save_as_nc, \
-                     save_as_json
+'''
+包级接口采用惰性导入：`import algom`本身不会加载pandas、scipy、netCDF4，
+只有在首次访问对应函数（或子模块）时才导入其所在模块。
+'''
+import importlib
+
+_exports = {
+    'full_interp': 'algom.makegrid',
+    'sd2uv': 'algom.makegrid',
+    'v_interp': 'algom.makegrid',
+    'std_sh': 'algom.makegrid',
+    'multi_v_interp': 'algom.makegrid',
+    'load_js': 'algom.io',
+    'parse': 'algom.io',
+    'parse_data': 'algom.io',
+    'parse_info': 'algom.io',
+    'save_as_nc': 'algom.io',
+    'save_as_json': 'algom.io',
+    'station_series': 'algom.series',
+    'StationProfile': 'algom.profile',
+    'ProfileBatch': 'algom.profile',
+    'LevelSet': 'algom.levels',
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name):
+    try:
+        module_name = _exports[name]
+    except KeyError:
+        raise AttributeError('module \'algom\' has no attribute '
+                             '\'{}\''.format(name))
+    value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + __all__)
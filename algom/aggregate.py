@@ -0,0 +1,163 @@
+# coding:utf-8
+'''
+--------------------------------------------------------------------
+项目名：rwp
+模块名：algom.aggregate
+本模块用于由逐6分钟格点产品滚动累计生成半小时（HOBS）和一小时（OOBS）平均产品
+
+每个累计器只保存未结束时段的累加和与计数（U、V、HWS、VWS的累加和及水平、垂直
+两个计数），每加入一个时次只做一次累加，时段结束时直接由累加量生成平均产品，
+无需重新读取历史文件。U、V为矢量平均，HWD由平均U、V得到，HWS为标量平均。
+输入与输出的缺测均为np.nan（保存文件时转换为缺省值）。
+--------------------------------------------------------------------
+python = 3.6
+依赖库：
+    numpy         $ conda install numpy
+--------------------------------------------------------------------
+'''
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from algom.wind import uv2sd
+
+
+class SlotAggregator(object):
+    '''按固定时段（整点对齐）滚动累计格点产品
+
+    各时段的累加量按时段起始时间分别保存。新时段的时次到达时，更早的时段即使
+    缺少时次也结束；已结束（已输出）时段的迟到时次直接忽略，不会重新打开该时段，
+    也不会提前结束当前时段。
+
+    输入参数
+    -------
+    window : `int`
+        时段长度（分钟），须能整除60，例如30或60
+    '''
+    def __init__(self, window=30):
+        if 60 % window:
+            raise ValueError('window must divide 60 minutes.')
+        self.window = window
+        self.coords = None
+        # 时段起始时间 -> (累加量字典, 时次数)
+        self._windows = {}
+        # 最近一个已结束时段的起始时间
+        self.flushed = None
+
+    def window_start(self, timestr):
+        '''时次所属时段的起始时间'''
+        dt = datetime.strptime(timestr, '%Y%m%d%H%M')
+        return dt.replace(minute=dt.minute // self.window * self.window)
+
+    def add(self, data_dict, timestr):
+        '''加入一个时次的格点产品
+
+        输入参数
+        -------
+        data_dict : `dict`
+            `full_interp`返回的数据字典
+        timestr : `str`
+            时次字符串，例如'201810011206'
+
+        返回值
+        -----
+        `list` : 本次加入后完成的时段产品列表，每项为(时段结束时间字符串, 数据字典)，
+                 若时段尚未结束或该时次属于已结束的时段则为空列表
+        '''
+        start = self.window_start(timestr)
+        if self.flushed is not None and start <= self.flushed:
+            # 迟到时次所属时段已输出，不再重复输出
+            return []
+
+        products = []
+        # 新时段的时次已到达，更早的时段即使缺少时次也结束
+        for older in sorted(key for key in self._windows if key < start):
+            products.extend(self._flush(older))
+
+        u = np.asarray(data_dict['U'], dtype=np.float64)
+        if start not in self._windows:
+            self.coords = {key: data_dict[key] for key in
+                           ('lon', 'lat', 'level')}
+            self._windows[start] = ({key: np.zeros(u.shape) for key in
+                                     ('U', 'V', 'HWS', 'VWS', 'NH', 'NV')}, 0)
+        sums, nslot = self._windows[start]
+
+        v = np.asarray(data_dict['V'], dtype=np.float64)
+        hws = np.asarray(data_dict['HWS'], dtype=np.float64)
+        vws = np.asarray(data_dict['VWS'], dtype=np.float64)
+        h_valid = np.isfinite(u) & np.isfinite(v) & np.isfinite(hws)
+        v_valid = np.isfinite(vws)
+        sums['U'] += np.where(h_valid, u, 0.)
+        sums['V'] += np.where(h_valid, v, 0.)
+        sums['HWS'] += np.where(h_valid, hws, 0.)
+        sums['VWS'] += np.where(v_valid, vws, 0.)
+        sums['NH'] += h_valid
+        sums['NV'] += v_valid
+        self._windows[start] = (sums, nslot + 1)
+
+        # 时段的最后一个时次已到达，直接结束该时段
+        dt = datetime.strptime(timestr, '%Y%m%d%H%M')
+        if dt + timedelta(minutes=6) >= start + timedelta(minutes=self.window):
+            products.extend(self._flush(start))
+
+        return products
+
+    def flush(self):
+        '''结束全部未结束的时段并生成平均产品
+
+        返回值
+        -----
+        `list` : [(时段结束时间字符串, 数据字典), ...]，若无累计数据则为空列表
+        '''
+        products = []
+        for start in sorted(self._windows):
+            products.extend(self._flush(start))
+        return products
+
+    def _flush(self, start):
+        '''结束起始时间为start的时段'''
+        sums, nslot = self._windows.pop(start)
+        if self.flushed is None or start > self.flushed:
+            self.flushed = start
+        if not nslot:
+            return []
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            u = sums['U'] / sums['NH']
+            v = sums['V'] / sums['NH']
+            hws = sums['HWS'] / sums['NH']
+            vws = sums['VWS'] / sums['NV']
+        # U、V为风的去向，风向为来向
+        _, hwd = uv2sd(u, v, convention='to')
+
+        h_missing = sums['NH'] == 0
+        for arr in (u, v, hws, hwd):
+            arr[h_missing] = np.nan
+        vws[sums['NV'] == 0] = np.nan
+
+        end = start + timedelta(minutes=self.window)
+        endstr = end.strftime('%Y%m%d%H%M')
+        data_dict = {'U': u, 'V': v, 'HWS': hws, 'HWD': hwd, 'VWS': vws,
+                     'time': endstr}
+        data_dict.update(self.coords)
+
+        return [(endstr, data_dict)]
+
+
+def get_attr_dict(window):
+    '''时段平均产品的属性字典'''
+    from algom.makegrid import get_attr_dict as grid_attr_dict
+
+    attr_dict = grid_attr_dict()
+    for key in ('U', 'V', 'HWS', 'HWD', 'VWS'):
+        attr_dict[key] = dict(attr_dict[key])
+        attr_dict[key]['cell_methods'] = 'time: mean ({} minutes)'.format(
+                                                                      window)
+    attr_dict['U']['long_name'] = 'Vector mean U component of wind.'
+    attr_dict['V']['long_name'] = 'Vector mean V component of wind.'
+    attr_dict['HWD']['note'] = 'Direction of the vector mean wind. ' + \
+                               attr_dict['HWD']['note']
+    attr_dict['time'] = dict(attr_dict['time'])
+    attr_dict['time']['note'] = 'End of the averaging period.'
+
+    return attr_dict
@@ -0,0 +1,167 @@
+# coding:utf-8
+'''
+--------------------------------------------------------------------
+项目名：rwp
+模块名：algom.config
+本模块提供配置对象：首次使用时才读取配置文件，读取后缓存并校验，
+文件发生修改时可快速重载（仅比较文件的修改时间与大小）。
+--------------------------------------------------------------------
+python = 3.6
+--------------------------------------------------------------------
+'''
+import os
+import json as js
+import logging
+
+from algom.errors import ConfigError
+
+
+DEFAULT_PATH = '../config.json'
+
+logger = logging.getLogger('root')
+
+
+# 'log'项可用的选项，对应opr.log.setup_custom_logger的关键字参数
+LOG_OPTIONS = ('async_mode', 'console', 'sample_rate', 'batch')
+
+# 算法参数各项可用的选项，与各模块的DEFAULTS一致（此处不导入这些模块，
+# 以免读取配置时加载scipy等依赖）
+SECTION_OPTIONS = {
+    'log': LOG_OPTIONS,
+    'qc': ('hdr_min', 'vdr_min', 'hws_max', 'vws_max', 'hws_spike',
+           'vws_spike', 'shear_max', 'buddy_radius', 'buddy_count',
+           'buddy_min', 'buddy_max'),
+    'hinterp': ('k', 'radius', 'power', 'kappa', 'gamma', 'passes'),
+    'stnstat': ('alpha', 'min_slots', 'min_avail', 'max_dup', 'max_innov'),
+    'arrival': ('samples', 'min_samples', 'recent', 'quantile', 'min_wait',
+                'max_wait', 'default_wait'),
+    'levels': ('heights', 'reference'),
+    'diagnose': ('bottom', 'top', 'min_coverage', 'jet_top', 'falloff_top',
+                 'min_speed', 'min_falloff'),
+    'stnprod': ('blh_bottom', 'blh_top', 'min_depth', 'jet_top',
+                'falloff_top', 'min_speed', 'min_falloff'),
+}
+
+
+def validate(content):
+    '''校验配置内容
+
+    输入参数
+    -------
+    content : `dict`
+        从配置文件读取的内容
+
+    错误
+    ---
+    ConfigError : 当配置内容不合法时抛出
+    '''
+    if not isinstance(content, dict):
+        raise ConfigError('Config content must be a json object.')
+    exclude = content.get('exclude', [])
+    if not isinstance(exclude, list):
+        raise ConfigError('Config item "exclude" must be a list.')
+    for key in ('parse', 'mkgrd', 'shear', 'remove', 'email', 'pool',
+                'retention', 'query') + tuple(SECTION_OPTIONS):
+        if key in content and not isinstance(content[key], dict):
+            raise ConfigError('Config item "{}" must be a json '
+                              'object.'.format(key))
+    for key, options in SECTION_OPTIONS.items():
+        unknown = set(content.get(key, {})) - set(options)
+        if unknown:
+            raise ConfigError('Unknown "{0}" options: {1}'.format(
+                                            key, ', '.join(sorted(unknown))))
+    levels = content.get('levels', {})
+    if levels:
+        if not isinstance(levels.get('heights'), list):
+            raise ConfigError('Config item "levels" must give a "heights" '
+                              'list.')
+        if levels.get('reference', 'agl') not in ('agl', 'asl'):
+            raise ConfigError('Config item "levels" has an unknown '
+                              'reference: {}'.format(levels['reference']))
+
+
+class Config(object):
+    '''惰性加载的配置对象
+
+    用法与字典一致（`config['exclude']`, `config.get('pool')`），
+    只有在第一次取值时才会读取文件。
+    '''
+    def __init__(self, path=DEFAULT_PATH, content=None):
+        self.path = path
+        self._content = None
+        self._stamp = None
+        if content is not None:
+            validate(content)
+            self._content = content
+
+    def _read(self):
+        stat = os.stat(self.path)
+        with open(self.path) as f:
+            try:
+                content = js.load(f)
+            except ValueError as e:
+                raise ConfigError('Failed to decode {0}: {1}'.format(
+                                                              self.path, e))
+        validate(content)
+        self._content = content
+        self._stamp = (stat.st_mtime_ns, stat.st_size)
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._read()
+        return self._content
+
+    def reload(self):
+        '''若配置文件发生变化则重新加载
+
+        若新文件不合法，则保留原有配置并记录日志。
+
+        返回值
+        -----
+        `bool` : 是否发生了重载
+        '''
+        if self._stamp is None and self._content is not None:
+            # 由内容直接构建的配置对象没有对应文件
+            return False
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        if (stat.st_mtime_ns, stat.st_size) == self._stamp:
+            return False
+        try:
+            self._read()
+        except ConfigError as e:
+            logger.error(' config not reloaded: {}'.format(e.message))
+            return False
+        logger.info(' config reloaded: {}'.format(self.path))
+        return True
+
+    @property
+    def exclude(self):
+        '''剔除站点集合'''
+        return set(self.content.get('exclude', []))
+
+    def get(self, key, default=None):
+        return self.content.get(key, default)
+
+    def __getitem__(self, key):
+        return self.content[key]
+
+    def __contains__(self, key):
+        return key in self.content
+
+
+_configs = {}
+
+
+def get_config(path=DEFAULT_PATH):
+    '''获取（进程内缓存的）配置对象，同一路径只会构建一个对象'''
+    path = os.path.abspath(path)
+    try:
+        config = _configs[path]
+    except KeyError:
+        config = _configs[path] = Config(path)
+
+    return config
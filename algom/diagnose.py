@@ -0,0 +1,196 @@
+# coding:utf-8
+'''
+--------------------------------------------------------------------
+项目名：rwp
+模块名：algom.diagnose
+本模块由单时次格点产品计算垂直积分诊断量
+
+    CDIV  : 0~3km气柱积分散度（不计密度权重），m s-1，负值为辐合
+    LLJ   : 低空急流标识，1为急流，0为无急流
+    LLJS  : 急流核风速（3km以下最大风速），m s-1
+    LLJH  : 急流核高度，m
+    LLJF  : 急流核以上至3km风速的最大减小量，m s-1
+低空急流判据：3km以下的最大风速（急流核）位于1.5km以下且不小于min_speed，
+且其上至3km之间风速的最大减小量不小于min_falloff（切变判据）。急流核取整个
+气柱的最大值，1.5km以上有更强风速时不判为低空急流。
+CDIV的有效厚度按积分气层厚度（top - bottom）折算，高度层未覆盖的部分视为
+缺测。
+各高度阈值均为离地高度，格点产品没有逐格点的地形高度，无法由海拔高度换算，
+因此格点诊断只支持离地高度参考面的高度层。
+全部计算均为沿高度层维的向量化规约，对(level, lat, lon)数据立方体一次完成，
+逐时次运行的开销与格点化相比可以忽略。
+--------------------------------------------------------------------
+python = 3.6
+依赖库：
+    numpy         $ conda install numpy
+--------------------------------------------------------------------
+'''
+import numpy as np
+
+from algom.errors import InputError
+from algom.kinematics import divergence
+
+
+VARIABLES = ('CDIV', 'LLJ', 'LLJS', 'LLJH', 'LLJF')
+DEFAULTS = {'bottom': 0., 'top': 3000., 'min_coverage': 0.5,
+            'jet_top': 1500., 'falloff_top': 3000., 'min_speed': 12.,
+            'min_falloff': 6.}
+
+
+def get_attr_dict():
+    attr_dict = {'CDIV':{'long_name':'Column integrated divergence 0-3km',
+                        'units':'m s-1',
+                        'fill_value':-9999.,
+                        'note':'Not density weighted, negative values are '\
+                        'convergence.'},
+                 'LLJ':{'long_name':'Low level jet flag',
+                        'units':'1',
+                        'fill_value':-9999.},
+                 'LLJS':{'long_name':'Low level jet core speed',
+                        'units':'m s-1',
+                        'fill_value':-9999.},
+                 'LLJH':{'long_name':'Low level jet core height',
+                        'units':'m',
+                        'fill_value':-9999.},
+                 'LLJF':{'long_name':'Wind speed falloff above jet core',
+                        'units':'m s-1',
+                        'fill_value':-9999.},
+                 'lon':{'long_name':'longitudes','units':'degree_east'},
+                 'lat':{'long_name':'latitudes','units':'degree_north'},
+                 'time':{'long_name':'datetime'}}
+    return attr_dict
+
+
+def column_integral(cube, level, bottom=0., top=3000., min_coverage=0.5):
+    '''沿高度层对数据立方体做梯形积分
+
+    只累加上下两端均有效的层间梯形；有效层间的总厚度不足气层厚度
+    （top - bottom）的min_coverage时为缺测，否则按有效厚度折算到整个气层。
+    高度层未覆盖的部分与缺测同样处理，不会按已有高度层的跨度放大。
+
+    输入参数
+    -------
+    cube : `ndarray`
+        (level, lat, lon)数组，缺测为np.nan
+    level : `ndarray`
+        高度层（m），升序
+    bottom, top : `float`
+        积分气层的下、上界（m），取二者之间的高度层
+    min_coverage : `float`
+        有效厚度占气层厚度的最小比例
+
+    返回值
+    -----
+    `ndarray` : (lat, lon)数组，缺测为np.nan
+    '''
+    level = np.asarray(level, dtype=np.float64)
+    index = np.flatnonzero((level >= bottom) & (level <= top))
+    if len(index) < 2:
+        raise ValueError('At least two levels are required within '
+                         '[{0}, {1}].'.format(bottom, top))
+    layer = cube[index]
+    depth = np.diff(level[index])[:, None, None]
+    pair = np.isfinite(layer[1:]) & np.isfinite(layer[:-1])
+    segment = np.where(pair, (layer[1:] + layer[:-1]) * 0.5 * depth, 0.)
+    covered = np.where(pair, depth, 0.).sum(axis=0)
+    total = float(top - bottom)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result = segment.sum(axis=0) * total / covered
+    result[covered < min_coverage * total] = np.nan
+    return result
+
+
+def low_level_jet(hws, level, jet_top=1500., falloff_top=3000., min_speed=12.,
+                  min_falloff=6.):
+    '''低空急流识别
+
+    输入参数
+    -------
+    hws : `ndarray`
+        水平风速，第一维为高度层，例如(level, lat, lon)格点或(level, 站点)，
+        缺测为np.nan
+    level : `ndarray`
+        高度层（m），升序；一维，或与hws形状相同（各站离地高度不同时）
+    jet_top : `float`
+        急流核所在高度的上限（m）
+    falloff_top : `float`
+        气柱上限（m），急流核取该高度以下的最大风速，并计算急流核以上至该
+        高度的风速减小量
+    min_speed, min_falloff : `float`
+        急流核风速与其上风速减小量的阈值（m s-1）
+
+    返回值
+    -----
+    `tuple` : (flag, speed, height, falloff)，形状为hws去掉高度层维；
+              气柱内全部缺测的格点为np.nan
+    '''
+    level = np.asarray(level, dtype=np.float64)
+    if level.ndim == 1:
+        level = level.reshape((-1,) + (1,) * (hws.ndim - 1))
+    if not (level <= jet_top).any():
+        raise ValueError('No level below {} m.'.format(jet_top))
+    level = np.broadcast_to(level, hws.shape)
+
+    # 急流核为整个气柱的最大风速，核以上不会再有更大的风速
+    column = (level <= falloff_top) & np.isfinite(hws)
+    valid = column.any(axis=0)
+    nose = np.argmax(np.where(column, hws, -np.inf), axis=0)[None]
+    speed = np.take_along_axis(hws, nose, axis=0)[0]
+    height = np.take_along_axis(level, nose, axis=0)[0]
+
+    # 急流核以上至falloff_top的最小风速
+    above = column & (level > height[None])
+    upper = np.where(above, hws, np.inf)
+    falloff = speed - upper.min(axis=0)
+    falloff[~np.isfinite(falloff)] = np.nan
+
+    flag = ((height <= jet_top) & (speed >= min_speed) &
+            (falloff >= min_falloff)).astype(np.float64)
+    for arr in (flag, speed, height, falloff):
+        arr[~valid] = np.nan
+    return flag, speed, height, falloff
+
+
+def slot_diagnostics(data_dict, diag_config=None, reference='agl'):
+    '''由单时次格点产品计算全部诊断量
+
+    输入参数
+    -------
+    data_dict : `dict`
+        full_interp输出的数据字典，须包含'U','V','HWS','level','lon','lat',
+        'time'，缺测为np.nan
+    diag_config : `dict`
+        配置中的'diagnose'项，可覆盖DEFAULTS中的阈值
+    reference : `str`
+        高度层的参考面（`LevelSet.reference`），须为'agl'
+
+    返回值
+    -----
+    `tuple` : (数据字典, 属性字典)，数据变量为(lat, lon)二维数组，缺测为np.nan，
+              可直接用save_as_nc保存
+
+    错误
+    ---
+    InputError : 高度层以海拔高度为参考面时抛出
+    '''
+    if reference != 'agl':
+        raise InputError('Gridded diagnostics need AGL levels, got {} '
+                         'levels.'.format(reference))
+    options = dict(DEFAULTS)
+    options.update(diag_config or {})
+    lon = data_dict['lon']
+    lat = data_dict['lat']
+    level = data_dict['level']
+
+    div = divergence(np.asarray(data_dict['U']), np.asarray(data_dict['V']),
+                     lon, lat)
+    cdiv = column_integral(div, level, options['bottom'], options['top'],
+                           options['min_coverage'])
+    jet = low_level_jet(np.asarray(data_dict['HWS']), level, options['jet_top'],
+                        options['falloff_top'], options['min_speed'],
+                        options['min_falloff'])
+
+    out = np.stack((cdiv,) + jet)
+    result = dict(zip(VARIABLES, out))
+    result.update({'lon':lon, 'lat':lat, 'time':data_dict['time']})
+    return result, get_attr_dict()
@@ -4,6 +4,9 @@
 项目名：rwp
 模块名：algom.diverge
 本模块用于进行矢量的散度计算
+
+`divgs`按经纬度网格的米制格距一次计算所有层次，结果为float32，单位s-1；
+`grid_divgs`与`full_uv_divgs`保留为兼容旧调用的封装。
 --------------------------------------------------------------------
 python = 3.6
 依赖库：
@@ -19,6 +22,8 @@ import numpy as np
 import netCDF4 as nc
 
 from algom.io import save_as_nc
+from algom.missing import to_nan
+from algom.kinematics import divergence
 
 
 def point_divg(ny,nx,u,v,interval=0.5,fill_value=-9999.):
@@ -60,8 +65,46 @@ def point_divg(ny,nx,u,v,interval=0.5,fill_value=-9999.):
     return A
 
 
-def grid_divgs(u,v):
-    '''计算多格点散度值
+def divgs(u, v, lon, lat, fill_value=-9999., out=None):
+    '''计算所有层次的格点散度
+
+    按纬度换算的米制格距做中心差分，并计入球面度量项-v*tan(lat)/R，
+    与`algom.kinematics`共用差分模板，所有层次一次完成。
+
+    输入参数
+    -------
+    u : `ndarray`
+        风场U分量（去向），形状为(level, lat, lon)或(lat, lon)，可以是掩码数组，
+        等于fill_value的数据视为缺测
+    v : `ndarray`
+        风场V分量（去向），形状与u相同
+    lon : `ndarray`
+        一维等间隔经度
+    lat : `ndarray`
+        一维等间隔纬度
+    fill_value : `float`
+        输入数据的缺省值
+    out : `ndarray`
+        预先分配的float32输出数组，形状须与u相同，默认为None，即新建数组
+
+    返回值
+    -----
+    `ndarray` : float32格点散度，单位为s-1，边界格点及相邻格点缺测的格点为
+                np.nan（保存文件时由save_as_nc转换为缺省值）
+    '''
+    u = to_nan(u, fill_value)
+    v = to_nan(v, fill_value)
+    if out is None:
+        out = np.empty(u.shape, dtype=np.float32)
+    elif out.shape != u.shape:
+        raise ValueError('out must have shape {}'.format(u.shape))
+    np.copyto(out, divergence(u, v, lon, lat), casting='same_kind')
+
+    return out
+
+
+def grid_divgs(u, v, lon=None, lat=None):
+    '''计算单层格点散度值（兼容旧接口，见`divgs`）
 
     输入参数
     -------
@@ -69,89 +112,68 @@ def grid_divgs(u,v):
         风场U分量，或其他矢量的X轴分量，须为二维数组
     v : `numpy.ndarray`
         风场V分量，或其他矢量的Y轴分量，须为二维数组
+    lon, lat : `numpy.ndarray`
+        一维经纬度，默认为None，即拼图产品的网格（`makegrid.grid_geometry`）
 
     返回值
     -----
-    `numpy.ndarray` : 格点散度，单位为
-                      [原始量纲]/[interval*invterval量纲]
-                      例如：[u] = m/s, [v] = m/s, interval = 0.5°
-                      则输出值量纲为：(m/s)/(0.5°)
+    `numpy.ndarray` : float32格点散度，单位为s-1，缺测为np.nan
     '''
-    shape = u.shape
-    divs = np.full(shape,-9999)
-    for ny in range(shape[0]):
-        for nx in range(shape[1]):
-            try:
-                divs[ny,nx] = point_divg(ny,nx,u,v)
-            except IndexError:
-                continue
-
-    return divs
-
-
-def full_uv_divgs(pfn,savepath=None):
+    if lon is None or lat is None:
+        from algom.makegrid import grid_geometry
+        lon, lat = grid_geometry()[:2]
+    return divgs(u, v, lon, lat)
+
+
+def get_attr_dict():
+    attr_dict = {'divs':{'long_name':'wind divergence.',
+                        'units':'s-1',
+                        'fill_value':-9999.,
+                        'note':'Negative means convergence, positive means '\
+                        'divergence'},
+                 'level':{'long_name':'Sampling height level',
+                        'units':'m'},
+                 'lon':{'long_name':'longitudes','units':'degree_east'},
+                 'lat':{'long_name':'latitudes','units':'degree_north'},
+                 'time':{'long_name':'datetime'}}
+    return attr_dict
+
+
+def uv_divgs(source, savepath=None):
     '''对一个时次的拼图产品做完整的散度处理
 
     输入参数
     -------
-    pfn : `str`
-        输入文件路径，须包含文件名，且文件格式只支持nc
+    source : `str` | `dict`
+        输入文件路径（nc格式），或内存中的数据字典（如`full_interp`的返回值，
+        须包含'U','V','lon','lat','level','time'）
     savepath : `str`
         文件保存路径，须包含文件名，文件格式只支持nc
 
     返回值
     -----
-    `None` | `dict` : 若savepath不存在，则返回两个字典（数据字典和属性字典），
-                      否则保存文件并返回None
+    `None` | `tuple` : 若savepath不存在，则返回两个字典（数据字典和属性字典），
+                       否则保存文件并返回None
     '''
-    def get_attr_dict(var_obj):
-        '''从源数据获取属性字典'''
-        attr_keys = var_obj.ncattrs()
-        attr_dict = {}
-        for key in attr_keys:
-            attr_dict[key] = var_obj.getncattr(key)
-        return attr_dict
-
-    file_obj = nc.Dataset(pfn)
-    u = file_obj.variables['U'][:]
-    v = file_obj.variables['V'][:]
-    lon = file_obj.variables['lon']
-    lat = file_obj.variables['lat']
-    time = file_obj.variables['time']
-    level = file_obj.variables['level']
-
-    attr_dict = \
-    {
-    'lon':get_attr_dict(lon),
-    'lat':get_attr_dict(lat),
-    'time':get_attr_dict(time),
-    'level':get_attr_dict(level),
-    'divs':{
-        'long_name':'wind divergence.',
-        'units':'(m/s)/(0.5°)',
-        'fill_value':-9999.,
-        'note':'Negative means convergence, positive means divergence'
-          }
-    }
-
-    lon = lon[:]
-    lat = lat[:]
-    time = time[:]
-    level = level[:]
-
-    divs = []
-    for n in range(len(level)):
-        divs.append(grid_divgs(u[n],v[n]))
-
-    divs = np.array(divs,dtype=np.float64)
-
+    attr_dict = get_attr_dict()
+    if isinstance(source, str):
+        with nc.Dataset(source) as file_obj:
+            source = {key:file_obj.variables[key][:]
+                      for key in ('U','V','lon','lat','level','time')}
+            for key in ('lon','lat','level','time'):
+                var_obj = file_obj.variables[key]
+                attr_dict[key] = {attr:var_obj.getncattr(attr)
+                                  for attr in var_obj.ncattrs()}
+
+    lon = np.asarray(source['lon'])
+    lat = np.asarray(source['lat'])
     data_dict = \
     {
-    'divs':divs,
+    'divs':divgs(source['U'],source['V'],lon,lat),
     'lat':lat,
     'lon':lon,
-    'time':time,
-    'level':level
+    'time':np.asarray(source['time']),
+    'level':np.asarray(source['level'])
     }
 
     if savepath:
@@ -160,6 +182,24 @@ def full_uv_divgs(pfn,savepath=None):
         return data_dict, attr_dict
 
 
+def full_uv_divgs(pfn,savepath=None):
+    '''对一个时次的拼图产品做完整的散度处理（兼容旧接口，见`uv_divgs`）
+
+    输入参数
+    -------
+    pfn : `str`
+        输入文件路径，须包含文件名，且文件格式只支持nc
+    savepath : `str`
+        文件保存路径，须包含文件名，文件格式只支持nc
+
+    返回值
+    -----
+    `None` | `tuple` : 若savepath不存在，则返回两个字典（数据字典和属性字典），
+                       否则保存文件并返回None
+    '''
+    return uv_divgs(pfn, savepath)
+
+
 def main():
     pass
 
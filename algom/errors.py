@@ -18,3 +18,9 @@ class InputError(Exception):
     '''输入错误'''
     def __init__(self, message):
         self.message = message
+
+
+class ConfigError(Exception):
+    '''配置错误'''
+    def __init__(self, message):
+        self.message = message
@@ -0,0 +1,124 @@
+# coding:utf-8
+'''
+--------------------------------------------------------------------
+项目名：rwp
+模块名：algom.gapfill
+本模块用于对缺失时次的格点产品做时间插补
+
+业务程序在内存中保留最近若干时次的格点产品（环形缓存），当新时次到达并确认
+其与上一时次之间存在缺失时，直接由缓存中的前后两个时次线性插补出缺失时次，
+无需重新读取归档文件。插补结果须以全局属性标记为合成数据。
+--------------------------------------------------------------------
+python = 3.6
+依赖库：
+    numpy         $ conda install numpy
+--------------------------------------------------------------------
+'''
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from algom.wind import uv2sd
+
+
+# 插补生成文件的全局属性
+SYNTHETIC_ATTR = {'synthetic': 'true',
+                  'note': 'Time-interpolated from neighbouring slots because '
+                          'the real-time slot is missing.'}
+
+
+def to_datetime(timestr):
+    return datetime.strptime(timestr, '%Y%m%d%H%M')
+
+
+def interp_slot(before, after, weight):
+    '''由前后两个时次线性插补格点产品
+
+    任一时次缺测（np.nan）的格点插补结果也为缺测。
+
+    输入参数
+    -------
+    before : `dict`
+        前一时次的数据字典（`full_interp`返回的格式）
+    after : `dict`
+        后一时次的数据字典
+    weight : `float`
+        后一时次的权重，介于0和1之间
+
+    返回值
+    -----
+    `dict` : 插补后的数据字典，不含'time'项
+    '''
+    result = {key: before[key] for key in ('lon', 'lat', 'level')}
+    for key in ('U', 'V', 'VWS'):
+        a = np.asarray(before[key])
+        b = np.asarray(after[key])
+        result[key] = (1 - weight) * a + weight * b
+
+    # U、V为风的去向，风向为来向
+    hws, hwd = uv2sd(result['U'], result['V'], convention='to')
+    result['HWS'] = hws
+    result['HWD'] = hwd
+
+    return result
+
+
+class SlotBuffer(object):
+    '''最近若干时次格点产品的环形缓存
+
+    输入参数
+    -------
+    maxlen : `int`
+        缓存的时次数
+    max_gap : `int`
+        允许插补的最大缺失时长（分钟），超过该时长的缺失不做插补
+    interval : `int`
+        时次间隔（分钟）
+    '''
+    def __init__(self, maxlen=10, max_gap=30, interval=6):
+        self.maxlen = maxlen
+        self.max_gap = max_gap
+        self.interval = interval
+        self.slots = OrderedDict()
+
+    def add(self, timestr, data_dict):
+        '''加入一个时次，若与缓存中的上一时次之间存在缺失，则返回插补结果
+
+        输入参数
+        -------
+        timestr : `str`
+            时次字符串，例如'201810011206'
+        data_dict : `dict`
+            该时次的数据字典
+
+        返回值
+        -----
+        `list` : 按时间顺序排列的插补结果[(时次字符串, 数据字典)]，无缺失时为空列表
+        '''
+        filled = []
+        if self.slots:
+            last = next(reversed(self.slots))
+            t0 = to_datetime(last)
+            t1 = to_datetime(timestr)
+            span = (t1 - t0).total_seconds() / 60
+            if self.interval < span <= self.max_gap + self.interval:
+                before = self.slots[last]
+                step = timedelta(minutes=self.interval)
+                t = t0 + step
+                while t < t1:
+                    weight = (t - t0).total_seconds() / 60 / span
+                    slot = interp_slot(before, data_dict, weight)
+                    slot['time'] = t.strftime('%Y%m%d%H%M')
+                    filled.append((slot['time'], slot))
+                    t += step
+
+        out_of_order = self.slots and timestr < next(reversed(self.slots))
+        self.slots[timestr] = data_dict
+        if out_of_order:
+            # 补报的早期时次也按时间顺序保存
+            self.slots = OrderedDict(sorted(self.slots.items()))
+        while len(self.slots) > self.maxlen:
+            self.slots.popitem(last=False)
+
+        return filled
@@ -0,0 +1,294 @@
+# coding:utf-8
+'''
+--------------------------------------------------------------------
+项目名：rwp
+模块名：algom.hinterp
+本模块提供基于KD树邻近站点搜索的水平插值方法
+
+与`griddata`的三角剖分插值不同，以下方法在站点凸包之外（搜索半径以内）同样
+可以给出插值结果：
+    idw : 反距离加权，取最近k个站点，超出搜索半径的站点不参与
+    barnes : 多遍Barnes客观分析
+邻近站点的索引与距离（格点到站点、站点到站点）按站点组合缓存，同一站点组合
+的所有高度层、所有变量共用一次搜索，各层缺测以权重置零的方式处理。
+--------------------------------------------------------------------
+python = 3.6
+依赖库：
+    numpy         $ conda install numpy
+    scipy         $ conda install scipy
+--------------------------------------------------------------------
+'''
+from functools import lru_cache
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+# 默认参数，可通过配置文件中的'hinterp'项覆盖
+DEFAULTS = {
+    'k': 8,             # 最多邻近站点数
+    'radius': 5.,       # 搜索半径（°）
+    'power': 2.,        # 反距离加权幂次
+    'kappa': None,      # Barnes首遍权重参数（°²），None表示按站点平均间距估算
+    'gamma': 0.3,       # Barnes后续各遍的权重参数缩放系数
+    'passes': 2,        # Barnes遍数
+}
+
+
+class NeighbourPlan(object):
+    '''一组站点对应的邻近站点搜索结果
+
+    属性
+    ---
+    nstation : `int`
+        站点数
+    grid_dist, grid_idx : `ndarray`
+        各格点最近k个站点的距离和索引，形状为(格点数, k)，
+        超出搜索半径的位置距离为inf、索引为nstation
+    stn_dist, stn_idx : `ndarray`
+        各站点最近k个站点（含自身）的距离和索引，形状为(站点数, k)
+    spacing : `float`
+        站点平均间距（°），即各站与最近邻站距离的均值
+    '''
+    __slots__ = ('nstation', 'grid_dist', 'grid_idx', 'stn_dist', 'stn_idx',
+                 'spacing')
+
+    def __init__(self, points, grid_points, k, radius):
+        self.nstation = len(points)
+        k = min(k, self.nstation)
+        tree = cKDTree(points)
+        self.grid_dist, self.grid_idx = self._query(tree, grid_points, k,
+                                                    radius)
+        self.stn_dist, self.stn_idx = self._query(tree, points, k, radius)
+        if self.nstation > 1:
+            nearest, _ = tree.query(points, k=2)
+            self.spacing = float(np.mean(nearest[:, 1]))
+        else:
+            self.spacing = radius
+
+    @staticmethod
+    def _query(tree, points, k, radius):
+        dist, idx = tree.query(points, k=k, distance_upper_bound=radius)
+        if k == 1:
+            dist = dist[:, np.newaxis]
+            idx = idx[:, np.newaxis]
+        return dist, idx
+
+
+@lru_cache(maxsize=32)
+def _plan(points_key, grid_key, grid_shape, k, radius):
+    points = np.frombuffer(points_key, dtype=np.float64).reshape(-1, 2)
+    grid_points = np.frombuffer(grid_key, dtype=np.float64).reshape(-1, 2)
+    return NeighbourPlan(points, grid_points, k, radius)
+
+
+def neighbour_plan(lon, lat, grd_lons, grd_lats, k=8, radius=5.):
+    '''获取（按站点组合与网格缓存的）邻近站点搜索结果
+
+    输入参数
+    -------
+    lon : `ndarray`
+        站点经度
+    lat : `ndarray`
+        站点纬度
+    grd_lons : `ndarray`
+        二维格点经度
+    grd_lats : `ndarray`
+        二维格点纬度
+    k : `int`
+        最多邻近站点数
+    radius : `float`
+        搜索半径（°）
+
+    返回值
+    -----
+    `NeighbourPlan`
+    '''
+    points = np.column_stack((lon, lat)).astype(np.float64)
+    grid_points = np.column_stack((np.ravel(grd_lons),
+                                   np.ravel(grd_lats))).astype(np.float64)
+    return _plan(points.tobytes(), grid_points.tobytes(),
+                 np.shape(grd_lons), int(k), float(radius))
+
+
+def _weighted_mean(idx, weights, values):
+    '''以邻近站点加权平均，values中的nan不参与计算
+
+    idx, weights : (n, k)；values : (nstation, m)；返回 (n, m)
+    '''
+    pad = np.full((1, values.shape[1]), np.nan)
+    neighbours = np.concatenate((values, pad))[idx]
+    valid = np.isfinite(neighbours)
+    w = np.where(valid, weights[:, :, np.newaxis], 0.)
+    num = (w * np.where(valid, neighbours, 0.)).sum(axis=1)
+    den = w.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result = num / den
+    result[den == 0] = np.nan
+
+    return result
+
+
+def idw(values, plan, power=2.):
+    '''反距离加权插值
+
+    输入参数
+    -------
+    values : `ndarray`
+        站点数据，形状为(nstation, m)，可将多个层次、多个变量排在第二维一次插值
+    plan : `NeighbourPlan`
+        邻近站点搜索结果
+    power : `float`
+        反距离加权幂次
+
+    返回值
+    -----
+    `ndarray` : 格点数据，形状为(格点数, m)
+    '''
+    dist = plan.grid_dist
+    with np.errstate(divide='ignore'):
+        weights = 1. / dist**power
+    # 格点与站点重合时直接取站点值
+    weights[dist == 0] = 1e12
+
+    return _weighted_mean(plan.grid_idx, weights, values)
+
+
+def barnes(values, plan, kappa=None, gamma=0.3, passes=2):
+    '''多遍Barnes客观分析
+
+    输入参数
+    -------
+    values : `ndarray`
+        站点数据，形状为(nstation, m)
+    plan : `NeighbourPlan`
+        邻近站点搜索结果
+    kappa : `float`
+        首遍权重参数（°²），None表示按Koch等(1983)的方法由站点平均间距估算
+    gamma : `float`
+        后续各遍的权重参数缩放系数
+    passes : `int`
+        分析遍数
+
+    返回值
+    -----
+    `ndarray` : 格点数据，形状为(格点数, m)
+    '''
+    if kappa is None:
+        kappa = 5.052 * (2 * plan.spacing / np.pi)**2
+
+    grid = _weighted_mean(plan.grid_idx, np.exp(-plan.grid_dist**2 / kappa),
+                          values)
+    stn = _weighted_mean(plan.stn_idx, np.exp(-plan.stn_dist**2 / kappa),
+                         values)
+    for _ in range(1, passes):
+        kappa = kappa * gamma
+        residual = values - stn
+        grid_corr = _weighted_mean(plan.grid_idx,
+                                   np.exp(-plan.grid_dist**2 / kappa),
+                                   residual)
+        stn_corr = _weighted_mean(plan.stn_idx,
+                                  np.exp(-plan.stn_dist**2 / kappa),
+                                  residual)
+        grid = np.where(np.isnan(grid_corr), grid, grid + grid_corr)
+        stn = np.where(np.isnan(stn_corr), stn, stn + stn_corr)
+
+    return grid
+
+
+def kd_grid(lon, lat, values, grd_lons, grd_lats, method='idw', params=None):
+    '''基于KD树邻近搜索的站点到格点插值
+
+    输入参数
+    -------
+    lon : `ndarray`
+        站点经度
+    lat : `ndarray`
+        站点纬度
+    values : `ndarray`
+        站点数据，形状为(nstation,)或(nstation, m)，缺测为np.nan
+    grd_lons : `ndarray`
+        二维格点经度
+    grd_lats : `ndarray`
+        二维格点纬度
+    method : `str`
+        插值方法，可选'idw','barnes'
+    params : `dict`
+        插值参数，未给出的项采用`DEFAULTS`中的默认值
+
+    返回值
+    -----
+    `ndarray` : 格点数据，形状为grd_lons.shape或grd_lons.shape+(m,)
+    '''
+    p = dict(DEFAULTS)
+    if params:
+        p.update(params)
+
+    values = np.asarray(values, dtype=np.float64)
+    squeeze = values.ndim == 1
+    if squeeze:
+        values = values[:, np.newaxis]
+    shape = np.shape(grd_lons) + values.shape[1:]
+
+    if len(lon) == 0:
+        result = np.full(shape, np.nan)
+    else:
+        plan = neighbour_plan(lon, lat, grd_lons, grd_lats, p['k'],
+                              p['radius'])
+        if method == 'idw':
+            result = idw(values, plan, p['power'])
+        elif method == 'barnes':
+            result = barnes(values, plan, p['kappa'], p['gamma'],
+                            int(p['passes']))
+        else:
+            raise ValueError('Unkown method: {}'.format(method))
+        result = result.reshape(shape)
+
+    if squeeze:
+        result = result[..., 0]
+
+    return result
+
+
+def leave_one_out(lon, lat, values, tlon, tlat, own, params=None):
+    '''留一法反距离加权：以目标点的邻近站点（不含目标站点自身）估计目标点的值
+
+    输入参数
+    -------
+    lon, lat : `ndarray`
+        参与估计的站点经纬度
+    values : `ndarray`
+        参与估计的站点数据，形状为(nstation, m)，缺测为np.nan
+    tlon, tlat : `ndarray`
+        目标点经纬度
+    own : `ndarray`
+        各目标点自身在参与估计站点中的索引，不在其中时为-1
+    params : `dict`
+        插值参数，取其中的'k','radius','power'，未给出的项采用`DEFAULTS`
+
+    返回值
+    -----
+    `ndarray` : 目标点数据，形状为(目标点数, m)
+    '''
+    p = dict(DEFAULTS)
+    if params:
+        p.update(params)
+
+    values = np.asarray(values, dtype=np.float64)
+    nstation = len(lon)
+    if nstation == 0:
+        return np.full((len(tlon), values.shape[1]), np.nan)
+
+    tree = cKDTree(np.column_stack((lon, lat)).astype(np.float64))
+    k = min(int(p['k']) + 1, nstation)
+    dist, idx = NeighbourPlan._query(tree, np.column_stack((tlon, tlat)), k,
+                                     p['radius'])
+    # 按索引剔除目标站点自身（坐标重合的其他站点仍参与）
+    self_mask = idx == np.asarray(own)[:, np.newaxis]
+    idx = np.where(self_mask, nstation, idx)
+    dist = np.where(self_mask, np.inf, dist)
+    with np.errstate(divide='ignore'):
+        weights = 1. / dist**p['power']
+    weights[dist == 0] = 1e12
+
+    return _weighted_mean(idx, weights, values)
@@ -9,11 +9,10 @@ python = 3.6
 依赖库：
     pandas        $ conda install pandas
     netCDF4       $ conda install netCDF4
+pandas与netCDF4仅在真正用到时才导入，只做json读写的进程无需加载它们。
 --------------------------------------------------------------------
 '''
 import json as js
-import pandas as pd
-import netCDF4 as nc
 import datetime
 
 
@@ -119,6 +118,8 @@ def parse_data(pfn):
     In [4]: list(data.keys())
     Out[4]: ['SH', 'HWD', 'HWS', 'VWS', 'HDR', 'VDR', 'CN2']
     '''
+    import pandas as pd
+
     data_df = pd.read_csv(pfn, sep=' ', skiprows=3, skipfooter=1,
                       names=['SH', 'HWD', 'HWS', 'VWS', 'HDR', 'VDR',
                              'CN2'], engine='python')
@@ -301,15 +302,16 @@ def save_as_json(data, path_fn, mod='single'):
         fileobj.write(result_js)
 
 
-def save_as_nc(data_dict, attr_dict, savepath):
+def save_as_nc(data_dict, attr_dict, savepath, global_attr=None):
     '''将数据字典和属性字典融合保存为netCDF4文件
 
     输入参数
     -------
     data_dict : `dict`
         数据字典，其中必须包括('lon','lat','time')三个辅助变量和至少一个数据变量，如果数据是
-          三维数组，则辅助变量还需要包含('level'), 数据变量内须为('time','lat','lon')或
-          ('time','level','lat','lon')格式数组，类型须为numpy.ndarray。
+          三维数组，则辅助变量还需要包含('level'), 数据变量内须为('lat','lon')或
+          ('level','lat','lon')格式数组，类型须为numpy.ndarray。数据变量中的np.nan
+          在写入时转换为该变量属性中的fill_value（未给出时为-9999.），输入数组不被修改。
 
     attr_dict : `dict`
         属性字典，双层嵌套型字典，顶层键为'lon','lat','time','level'等变量名，其对应值为该
@@ -319,10 +321,17 @@ def save_as_nc(data_dict, attr_dict, savepath):
     savepath : `str`
         输出nc文件保存的完整路径, 须包含文件名及后缀。例如'./output/data.nc'
 
+    global_attr : `dict`
+        全局属性字典，默认为None，例如用于标记时间插补生成的数据{'synthetic':'true'}
+
     返回值
     -----
     `bool` : 是否处理成功的标识，若顺利完成，返回True
     '''
+    import numpy as np
+    import netCDF4 as nc
+    from algom.missing import nan2num, FILL_VALUE
+
     # 判断数据是三维还是二维
     dim_num = 3
     try:
@@ -356,15 +365,32 @@ def save_as_nc(data_dict, attr_dict, savepath):
         opt_data = {}
         opt_data['lat'] = file_obj.createVariable('lat', float, ('lat',))
         opt_data['lon'] = file_obj.createVariable('lon', float, ('lon',))
-        opt_data['level'] = file_obj.createVariable('level', float, ('level',))
+        if dim_num == 3:
+            opt_data['level'] = file_obj.createVariable('level', float,
+                                                        ('level',))
         opt_data['time'] = file_obj.createVariable('time', float, ('time',))
 
+        # 二维数据变量为('lat','lon')，三维数据变量为('level','lat','lon')，
+        # 同一文件中可以同时包含两者
         for key in src_keys:
-            opt_data[key] = file_obj.createVariable(key, float,
-                                                    ('level', 'lat', 'lon'))
+            if np.ndim(data_dict[key]) == 3:
+                dims = ('level', 'lat', 'lon')
+            else:
+                dims = ('lat', 'lon')
+            opt_data[key] = file_obj.createVariable(key, float, dims)
+
+        if global_attr:
+            file_obj.setncatts(global_attr)
 
         for key in data_dict:
-            opt_data[key][:] = data_dict[key]
+            values = data_dict[key]
+            if key in src_keys and isinstance(values, np.ndarray) and \
+                    not np.ma.isMaskedArray(values) and \
+                    values.dtype.kind == 'f':
+                fill_value = attr_dict.get(key, {}).get('fill_value',
+                                                        FILL_VALUE)
+                values = nan2num(values, fill_value)
+            opt_data[key][:] = values
             try:
                 opt_data[key].setncatts(attr_dict[key])
             except KeyError:
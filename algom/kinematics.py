@@ -0,0 +1,200 @@
+# coding:utf-8
+'''
+--------------------------------------------------------------------
+项目名：rwp
+模块名：algom.kinematics
+本模块用于计算水平风场的运动学量
+
+对(level, lat, lon)的U、V数据立方体一次性计算全部层次的：
+    DIV   : 散度             du/dx + dv/dy - v*tan(lat)/R
+    VOR   : 相对涡度         dv/dx - du/dy + u*tan(lat)/R
+    STR   : 伸缩变形         du/dx - dv/dy - v*tan(lat)/R
+    SHD   : 切变变形         dv/dx + du/dy + u*tan(lat)/R
+    DEF   : 总变形           sqrt(STR**2 + SHD**2)
+    HSHR  : 水平风切变       风矢量水平梯度张量的模
+各量均由球面上风矢量的水平梯度张量
+    [[du/dx - v*tan(lat)/R, du/dy], [dv/dx + u*tan(lat)/R, dv/dy]]
+组合得到（散度为迹，涡度与切变变形为非对角元之差与和，伸缩变形为对角元之差，
+HSHR为张量的Frobenius范数），因此都计入相同的球面度量项。例如固体旋转
+u = ωR*cos(lat), v = 0时，VOR = 2ω*sin(lat)，DIV、SHD、DEF均为0。
+四个偏导数只计算一次，各量共用；经纬度网格的格距按纬度换算为米，单位均为s-1。差分采用中心差分，边界格点及相邻格点缺测的格点为缺测。
+U、V须为风的去向（格点产品的约定）。
+--------------------------------------------------------------------
+python = 3.6
+依赖库：
+    numpy         $ conda install numpy
+    netCDF4       $ conda install netCDF4
+--------------------------------------------------------------------
+'''
+import numpy as np
+
+from algom.io import save_as_nc
+from algom.missing import to_nan
+
+
+EARTH_RADIUS = 6371000.
+VARIABLES = ('DIV', 'VOR', 'STR', 'SHD', 'DEF', 'HSHR')
+
+
+def get_attr_dict():
+    attr_dict = {'DIV':{'long_name':'Horizontal divergence',
+                        'units':'s-1',
+                        'fill_value':-9999.},
+                 'VOR':{'long_name':'Relative vorticity',
+                        'units':'s-1',
+                        'fill_value':-9999.},
+                 'STR':{'long_name':'Stretching deformation',
+                        'units':'s-1',
+                        'fill_value':-9999.},
+                 'SHD':{'long_name':'Shearing deformation',
+                        'units':'s-1',
+                        'fill_value':-9999.},
+                 'DEF':{'long_name':'Total deformation',
+                        'units':'s-1',
+                        'fill_value':-9999.},
+                 'HSHR':{'long_name':'Horizontal wind shear',
+                        'units':'s-1',
+                        'fill_value':-9999.,
+                        'note':'Frobenius norm of the horizontal velocity '\
+                        'gradient tensor, including the spherical metric '\
+                        'terms.'},
+                 'level':{'long_name':'Sampling height level',
+                        'units':'m'},
+                 'lon':{'long_name':'longitudes','units':'degree_east'},
+                 'lat':{'long_name':'latitudes','units':'degree_north'},
+                 'time':{'long_name':'datetime'}}
+    return attr_dict
+
+
+def grid_spacing(lon, lat):
+    '''经纬度网格的格距（米）
+
+    返回值
+    -----
+    `tuple` : (dx, dy, metric)，dx为各纬度上的纬向格距，形状为(lat, 1)；
+              dy为经向格距（标量）；metric为tan(lat)/R，形状为(lat, 1)
+    '''
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    rad = np.deg2rad(lat)[:, None]
+    dx = EARTH_RADIUS * np.cos(rad) * np.deg2rad(lon[1] - lon[0])
+    dy = EARTH_RADIUS * np.deg2rad(lat[1] - lat[0])
+    metric = np.tan(rad) / EARTH_RADIUS
+    return dx, dy, metric
+
+
+def centered_x(field, dx):
+    '''沿最后一维（经度）的中心差分，边界为np.nan'''
+    result = np.full(field.shape, np.nan)
+    result[..., 1:-1] = (field[..., 2:] - field[..., :-2]) / (2 * dx)
+    return result
+
+
+def centered_y(field, dy):
+    '''沿倒数第二维（纬度）的中心差分，边界为np.nan'''
+    result = np.full(field.shape, np.nan)
+    result[..., 1:-1, :] = (field[..., 2:, :] - field[..., :-2, :]) / (2 * dy)
+    return result
+
+
+def derivatives(u, v, lon, lat):
+    '''U、V的水平偏导数，缺测为np.nan
+
+    返回值
+    -----
+    `tuple` : (du/dx, du/dy, dv/dx, dv/dy)
+    '''
+    dx, dy, _ = grid_spacing(lon, lat)
+    return (centered_x(u, dx), centered_y(u, dy),
+            centered_x(v, dx), centered_y(v, dy))
+
+
+def divergence(u, v, lon, lat):
+    '''仅计算散度（du/dx + dv/dy - v*tan(lat)/R），输入输出的缺测均为np.nan'''
+    dx, dy, metric = grid_spacing(lon, lat)
+    return centered_x(u, dx) + centered_y(v, dy) - v * metric
+
+
+def kinematics(u, v, lon, lat, fill_value=-9999., out=None,
+               dtype=np.float64):
+    '''一次计算全部运动学量
+
+    输入参数
+    -------
+    u, v : `ndarray`
+        风的去向分量，形状为(level, lat, lon)或(lat, lon)，可以是掩码数组，
+        等于fill_value的数据视为缺测
+    lon, lat : `ndarray`
+        一维等间隔经纬度
+    fill_value : `float`
+        输入数据的缺省值
+    out : `ndarray`
+        预先分配的输出数组，形状为(6,)+u.shape，依次为VARIABLES中的各量
+    dtype : `numpy.dtype`
+        新建输出数组的类型
+
+    返回值
+    -----
+    `dict` : 变量名对应的数组（out的视图），缺测为np.nan（保存文件时由
+             save_as_nc转换为缺省值）
+    '''
+    u = to_nan(u, fill_value)
+    v = to_nan(v, fill_value)
+    shape = (len(VARIABLES),) + u.shape
+    if out is None:
+        out = np.empty(shape, dtype=dtype)
+    elif out.shape != shape:
+        raise ValueError('out must have shape {}'.format(shape))
+
+    _, _, metric = grid_spacing(lon, lat)
+    dudx, dudy, dvdx, dvdy = derivatives(u, v, lon, lat)
+    div, vor, stretch, shear, total, hshr = out
+
+    # 梯度张量中含度量项的两个分量
+    dudx = dudx - v * metric
+    dvdx = dvdx + u * metric
+
+    np.copyto(div, dudx + dvdy)
+    np.copyto(vor, dvdx - dudy)
+    np.copyto(stretch, dudx - dvdy)
+    np.copyto(shear, dvdx + dudy)
+    np.hypot(stretch, shear, out=total)
+    np.copyto(hshr, np.sqrt(dudx**2 + dudy**2 + dvdx**2 + dvdy**2))
+
+    return dict(zip(VARIABLES, out))
+
+
+def full_kinematics(pfn, savepath=None):
+    '''对一个时次的拼图产品计算全部运动学量
+
+    输入参数
+    -------
+    pfn : `str`
+        输入文件路径，须包含文件名，且文件格式只支持nc
+    savepath : `str`
+        文件保存路径，须包含文件名，文件格式只支持nc
+
+    返回值
+    -----
+    `None` | `tuple` : 若savepath为None，则返回(数据字典, 属性字典)，否则保存
+                       文件并返回None
+    '''
+    import netCDF4 as nc
+
+    with nc.Dataset(pfn) as file_obj:
+        lon = np.array(file_obj.variables['lon'][:])
+        lat = np.array(file_obj.variables['lat'][:])
+        level = np.array(file_obj.variables['level'][:])
+        time = np.array(file_obj.variables['time'][:])
+        u = file_obj.variables['U'][:]
+        v = file_obj.variables['V'][:]
+
+    data_dict = kinematics(u, v, lon, lat)
+    data_dict.update({'lon':lon, 'lat':lat, 'level':level, 'time':time})
+    attr_dict = get_attr_dict()
+
+    if savepath:
+        save_as_nc(data_dict, attr_dict, savepath)
+        return None
+    else:
+        return data_dict, attr_dict
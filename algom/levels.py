@@ -0,0 +1,177 @@
+# coding:utf-8
+'''
+--------------------------------------------------------------------
+项目名：rwp
+模块名：algom.levels
+本模块定义垂直插值的目标高度层及逐站插值索引方案
+
+目标高度层可以是任意单调的高度序列，参考面可选：
+    'agl' : 与原始采样高度相同，即相对于雷达天线的高度
+    'asl' : 海拔高度，站点采样高度加上站点海拔高度后再插值
+同一部雷达各时次的采样高度几乎总是相同的，因此由采样高度（和海拔高度）到
+目标高度层的searchsorted索引及权重只计算一次，按采样高度缓存，在各要素、
+各时次之间复用。
+--------------------------------------------------------------------
+python = 3.6
+依赖库：
+    numpy         $ conda install numpy
+--------------------------------------------------------------------
+'''
+from functools import lru_cache
+
+import numpy as np
+
+from algom.errors import InputError
+
+
+def standard_heights():
+    '''标准采样高度层（100~9000m，40层）'''
+    sh1 = range(100,2000,100)
+    sh2 = range(2000,5000,250)
+    sh3 = range(5000,9500,500)
+    return list(sh1)+list(sh2)+list(sh3)
+
+
+class IndexPlan(object):
+    '''由原始采样高度到目标高度层的线性插值方案
+
+    目标高度在原始高度范围(最低, 最高]之外的为缺测；相邻两个原始高度中任一
+    缺测时，二者之间的目标高度也为缺测。
+
+    属性
+    ---
+    order : `ndarray`
+        原始高度的升序排列索引
+    left, right : `ndarray`
+        各目标高度在升序原始高度中的左右相邻索引
+    wl, wr : `ndarray`
+        左右相邻值的权重
+    valid : `ndarray`
+        目标高度是否在原始高度范围内
+    '''
+    __slots__ = ('order', 'left', 'right', 'wl', 'wr', 'valid')
+
+    def __init__(self, raw, target):
+        n = len(raw)
+        if n < 2:
+            raise ValueError('At least two sampling heights are required.')
+        self.order = np.argsort(raw, kind='mergesort')
+        raw = raw[self.order]
+        right = np.clip(np.searchsorted(raw, target, side='right'), 1, n - 1)
+        left = right - 1
+        with np.errstate(invalid='ignore', divide='ignore'):
+            span = raw[right] - raw[left]
+            self.wl = (raw[right] - target) / span
+            self.wr = (target - raw[left]) / span
+        self.left = left
+        self.right = right
+        self.valid = (target > raw[0]) & (target <= raw[-1])
+
+    def apply(self, values):
+        '''插值
+
+        输入参数
+        -------
+        values : `ndarray`
+            原始高度上的数据，最后一维与原始高度对应，可以是多个要素堆叠的
+            二维数组
+
+        返回值
+        -----
+        `ndarray` : 目标高度层上的数据，缺测为np.nan
+        '''
+        values = np.asarray(values, dtype=np.float64)[..., self.order]
+        result = values[..., self.left] * self.wl + \
+                 values[..., self.right] * self.wr
+        result[..., ~self.valid] = np.nan
+        return result
+
+
+@lru_cache(maxsize=4096)
+def _index_plan(raw_key, target_key):
+    raw = np.frombuffer(raw_key, dtype=np.float64)
+    target = np.frombuffer(target_key, dtype=np.float64)
+    return IndexPlan(raw, target)
+
+
+class LevelSet(object):
+    '''垂直插值的目标高度层
+
+    输入参数
+    -------
+    heights : `list` | `ndarray`
+        目标高度（m），须严格单调
+    reference : `str`
+        参考面，'agl'（相对雷达高度，与采样高度一致）或'asl'（海拔高度）
+    '''
+    __slots__ = ('heights', 'reference', '_key')
+
+    def __init__(self, heights, reference='agl'):
+        heights = np.array(heights, dtype=np.float64)
+        if heights.ndim != 1 or len(heights) < 1:
+            raise InputError('Level heights must be a 1-D sequence.')
+        diff = np.diff(heights)
+        if not ((diff > 0).all() or (diff < 0).all()):
+            raise InputError('Level heights must be strictly monotonic.')
+        if reference not in ('agl', 'asl'):
+            raise InputError('Unknown level reference: {}'.format(reference))
+        heights.setflags(write=False)
+        self.heights = heights
+        self.reference = reference
+        self._key = heights.tobytes()
+
+    @classmethod
+    def standard(cls):
+        '''标准高度层（100~9000m，40层）'''
+        return cls(standard_heights())
+
+    @classmethod
+    def from_config(cls, levels_config=None):
+        '''由配置中的'levels'项构建，例如{"heights":[...],"reference":"asl"}，
+        未配置时为标准高度层'''
+        if not levels_config:
+            return cls.standard()
+        return cls(levels_config['heights'],
+                   levels_config.get('reference', 'agl'))
+
+    def __len__(self):
+        return len(self.heights)
+
+    def plan(self, sh, altitude=None):
+        '''单站的插值方案，按采样高度（海拔参考面时还按站点海拔）缓存
+
+        输入参数
+        -------
+        sh : `ndarray`
+            站点采样高度
+        altitude : `float`
+            站点海拔高度，仅在参考面为'asl'时使用
+
+        错误
+        ---
+        InputError : 参考面为'asl'而站点海拔高度缺测时抛出
+        '''
+        raw = np.asarray(sh, dtype=np.float64)
+        if self.reference == 'asl':
+            if altitude is None or not np.isfinite(altitude):
+                raise InputError('Station altitude is required for ASL '
+                                 'levels.')
+            raw = raw + altitude
+        return _index_plan(raw.tobytes(), self._key)
+
+    def attrs(self):
+        '''高度层变量的属性'''
+        attrs = {'long_name': 'Sampling height level', 'units': 'm'}
+        if self.reference == 'asl':
+            attrs['note'] = 'Height above sea level.'
+        return attrs
+
+    def __eq__(self, other):
+        return isinstance(other, LevelSet) and \
+               self.reference == other.reference and self._key == other._key
+
+    def __hash__(self):
+        return hash((self.reference, self._key))
+
+    def __repr__(self):
+        return '<LevelSet {0} levels {1}>'.format(len(self), self.reference)
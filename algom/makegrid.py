@@ -16,26 +16,26 @@ import sys
 sys.path.append('..')
 
 import json as js
+import logging
 import numpy as np
 import netCDF4 as nc
-from scipy.interpolate import griddata, interp1d
+from functools import lru_cache
+from scipy.interpolate import griddata, LinearNDInterpolator, \
+                              CloughTocher2DInterpolator
+from scipy.spatial import Delaunay
 from algom.io import save_as_nc, load_js
-from algom.errors import OutputError
+from algom.errors import OutputError, InputError
+# to_nan仍可由本模块导入，以兼容原有调用
+from algom.missing import to_nan, nan2num
+from algom.config import get_config
+from algom import wind
+from algom.levels import LevelSet, standard_heights
+from algom.profile import StationProfile, ProfileBatch, LEVEL_VARS, \
+                          as_batch
 import datetime
 
+logger = logging.getLogger('root')
 
-with open('../config.json') as f:
-    config = js.load(f)
-
-# 排除部分不可靠站点
-exclude = config['exclude']
-
-
-def nan2num(arr,fill_value):
-    '''将np.nan转化为特定数字'''
-    where_is_nan = np.isnan(arr)
-    arr[where_is_nan] = fill_value
-    return arr
 
 def get_attr_dict():
     attr_dict = {'U':{'long_name':'U component of wind.',
@@ -69,96 +69,236 @@ def get_attr_dict():
     return attr_dict
 
 
-def sd2uv(ws,wd):
-    '''风速风向转化为uv场'''
-    u = ws * np.sin(np.deg2rad(wd))
-    v = ws * np.cos(np.deg2rad(wd))
+@lru_cache(maxsize=8)
+def grid_geometry(min_lon=85, max_lon=125, min_lat=14, max_lat=45,
+                  interval=0.5):
+    '''获取格点坐标（带缓存）
 
-    return u,v
+    常驻进程中同一网格只构建一次，返回的数组为只读数组，调用方不得修改。
 
+    返回值
+    -----
+    `tuple` : (grd_lon, grd_lat, grd_lons, grd_lats)，分别为一维经度、一维纬度
+              以及二维经度网格、二维纬度网格
+    '''
+    grd_lon = np.arange(min_lon,max_lon,interval)
+    grd_lat = np.arange(min_lat,max_lat,interval)
+    grd_lons, grd_lats = np.meshgrid(grd_lon,grd_lat)
+    for arr in (grd_lon, grd_lat, grd_lons, grd_lats):
+        arr.setflags(write=False)
 
-def std_sh():
-    '''获取标准采样高度层'''
-    sh1 = range(100,2000,100)
-    sh2 = range(2000,5000,250)
-    sh3 = range(5000,9500,500)
-    sh = list(sh1)+list(sh2)+list(sh3)
+    return grd_lon, grd_lat, grd_lons, grd_lats
 
-    return sh
 
+@lru_cache(maxsize=256)
+def _delaunay(points_key):
+    '''按站点坐标缓存Delaunay三角剖分，站点组合重复时无需重新剖分'''
+    points = np.frombuffer(points_key,dtype=np.float64).reshape(-1,2)
+    return Delaunay(points)
 
-def v_interp(single_ds):
-    '''垂直插值单站数据集
+
+def grid_points(lon, lat, values, grd_lons, grd_lats, method='linear'):
+    '''将站点数据插值到格点
+
+    与`scipy.interpolate.griddata`结果一致，但'linear'和'cubic'方法会复用缓存的
+    三角剖分，且values可以是多列（例如U、V同时插值），共用同一次剖分。
 
     输入参数
     -------
-    single_ds : `dict`
-        单站数据字典，包含有高度、站点信息及需插值变量等变量。
+    lon : `ndarray`
+        站点经度，一维数组
+    lat : `ndarray`
+        站点纬度，一维数组
+    values : `ndarray`
+        站点数据，形状为(n,)或(n,k)
+    grd_lons : `ndarray`
+        二维格点经度
+    grd_lats : `ndarray`
+        二维格点纬度
+    method : `str`
+        插值方法，可选'linear','nearest','cubic'
 
     返回值
     -----
-    new_single_ds : `dict`
-        经过垂直插值处理后的单站数据集，经处理后其高度层为统一结构（100~9000,40层），
-        缺省值为np.nan。
+    `ndarray` : 格点数据，形状为grd_lons.shape或grd_lons.shape+(k,)
     '''
-    # 制作标准高度层
-    sh = std_sh()
+    points = np.column_stack((lon,lat)).astype(np.float64)
+    if method == 'linear':
+        tri = _delaunay(points.tobytes())
+        return LinearNDInterpolator(tri,values)((grd_lons,grd_lats))
+    elif method == 'cubic':
+        tri = _delaunay(points.tobytes())
+        return CloughTocher2DInterpolator(tri,values)((grd_lons,grd_lats))
+    else:
+        return griddata(points,values,(grd_lons,grd_lats),method=method)
 
-    raw_sh = single_ds['SH']
 
-    # 获取上下边界索引
-    raw_top = max(raw_sh)
-    raw_bottom = min(raw_sh)
+def kd_cubes(dataset, grd_lons, grd_lats, method='idw', params=None):
+    '''以KD树邻近搜索方法一次性插值全部层次的U、V、VWS
 
-    for n, height in enumerate(sh):
-        if height > raw_top:
-            top_index = n
-            break
-    else:
-        top_index = len(sh)
+    邻近站点搜索基于数据集的全部站点，按站点组合缓存；各层缺测的站点以np.nan
+    参与计算（权重置零），因此所有层次、所有变量共用同一次搜索。
 
-    for n, height in enumerate(sh):
-        if height > raw_bottom:
-            bottom_index = n
-            break
+    输入参数
+    -------
+    dataset : `algom.profile.ProfileBatch` | `list`
+        经垂直插值处理后的多站数据
+    grd_lons : `ndarray`
+        二维格点经度
+    grd_lats : `ndarray`
+        二维格点纬度
+    method : `str`
+        插值方法，可选'idw','barnes'
+    params : `dict`
+        插值参数，见`algom.hinterp.DEFAULTS`
 
-    nsh = sh[bottom_index:top_index]
-    headcount = len(sh[:bottom_index])
-    tailcount = len(sh[top_index:])
+    返回值
+    -----
+    `ndarray` : 形状为grd_lons.shape+(level, 3)的数组，最后一维依次为U、V、VWS，
+                U、V为风的去向
+    '''
+    from algom.hinterp import kd_grid
+
+    dataset = as_batch(dataset,std_sh())
+    nlevel = len(dataset.SH)
+    if not len(dataset):
+        return np.full(np.shape(grd_lons)+(nlevel,3),np.nan)
+
+    lon = dataset.lon
+    lat = dataset.lat
+    hwd = dataset.HWD
+    hws = dataset.HWS
+    vws = dataset.VWS
+
+    # 水平风缺测的站点垂直速度仍参与插值
+    h_valid = np.isfinite(hwd) & np.isfinite(hws)
+    u,v = wind.sd2uv(hws,hwd,convention='to')
+    u[~h_valid] = np.nan
+    v[~h_valid] = np.nan
 
-    intp_vars = ['HWD', 'HWS', 'VWS', 'HDR', 'VDR', 'CN2']
-    attr_vars = ['station', 'lon', 'lat', 'altitude', 'wave', 'time']
+    values = np.stack((u,v,vws),axis=-1).reshape(len(dataset),-1)
+    grds = kd_grid(lon,lat,values,grd_lons,grd_lats,method=method,
+                   params=params)
 
-    new_single_ds = {}
-    new_single_ds['SH'] = sh
-    for av in attr_vars:
-        new_single_ds[av] = single_ds[av]
+    return grds.reshape(np.shape(grd_lons)+(nlevel,3))
 
-    for var in intp_vars:
-        intp_func = interp1d(raw_sh, single_ds[var], kind='slinear')
-        new_single_ds[var] = [np.nan] * headcount + list(intp_func(nsh)) +\
-            [np.nan] * tailcount
 
-    return new_single_ds
+def sd2uv(ws,wd):
+    '''风速风向转化为uv场（U、V指向风的来向）
+
+    保留原有接口，新代码请使用`algom.wind.sd2uv`并显式给出方向约定
+    '''
+    return wind.sd2uv(ws,wd,convention='from')
 
 
-def multi_v_interp(raw_dataset):
+def std_sh():
+    '''获取标准采样高度层'''
+    return standard_heights()
+
+
+def v_interp(single_ds, levels=None):
+    '''垂直插值单站数据集
+
+    输入参数
+    -------
+    single_ds : `dict` | `algom.profile.StationProfile`
+        单站数据，包含有高度、站点信息及需插值变量等变量。
+    levels : `algom.levels.LevelSet`
+        目标高度层，默认为None，即标准高度层（100~9000,40层）
+
+    返回值
+    -----
+    new_single_ds : `algom.profile.StationProfile`
+        经过垂直插值处理后的单站廓线，其高度层为levels，缺省值为np.nan。
+    '''
+    if levels is None:
+        levels = LevelSet.standard()
+
+    single_ds = StationProfile.from_record(single_ds)
+    plan = levels.plan(single_ds.SH,single_ds.altitude)
+
+    # 各要素共用同一插值方案，一次完成
+    columns = plan.apply(np.stack([single_ds[var] for var in LEVEL_VARS]))
+
+    return StationProfile(single_ds.station, single_ds.lon, single_ds.lat,
+                          levels.heights, single_ds.altitude, single_ds.wave,
+                          single_ds.time, **dict(zip(LEVEL_VARS,columns)))
+
+
+def multi_v_interp(raw_dataset, levels=None):
     '''多站（全数据集）垂直积分
 
+    无法插值的站点（例如海拔高度参考面下海拔高度缺测的站点）记录日志后剔除，
+    不影响其他站点。
+
     输入参数
     -------
     raw_dataset : `list`
         多站数据列表，单行是单站数据（字典格式）
+    levels : `algom.levels.LevelSet`
+        目标高度层，默认为None，即标准高度层
+
+    返回值
+    -----
+    `algom.profile.ProfileBatch`
+        经插值处理后的多站廓线批，各要素为(站点, 高度层)数组
+    '''
+    if levels is None:
+        levels = LevelSet.standard()
+    profiles = []
+    for line in raw_dataset:
+        try:
+            profiles.append(v_interp(line,levels))
+        except (ValueError, TypeError, InputError) as e:
+            logger.warning(' station {0} dropped: {1}'.format(
+                line.get('station'), getattr(e, 'message', e)))
+    return ProfileBatch.from_profiles(profiles,levels.heights)
+
+
+def prepare_batch(pfn, config=None, qc=False, stats=None, levels=None):
+    '''读取单个时次的解码文件，完成垂直插值、站点剔除与质量控制
+
+    即full_interp水平插值之前的全部步骤。业务程序可先调用本函数，再将结果同时
+    用于站点产品与格点化（full_interp的batch参数），解码文件只读取和插值一次。
+
+    输入参数
+    -------
+    pfn : `str`
+        解码输出的json文件路径
+    config, qc, stats, levels :
+        同`full_interp`
 
     返回值
     -----
-    `list`
-        经插值处理后的多站数据列表
+    `tuple` : (all_dataset, dataset)，均为`algom.profile.ProfileBatch`。
+              all_dataset为配置剔除后的全部站点（用于计算新息），dataset为再经
+              动态剔除与质量控制、参与水平插值的站点；stats为None时二者相同
     '''
-    return [v_interp(line) for line in raw_dataset]
+    if config is None:
+        config = get_config()
 
+    # 排除部分不可靠站点
+    if levels is None:
+        levels = LevelSet.from_config(config.get('levels'))
+    dataset = multi_v_interp(load_js(pfn,config.exclude),levels)
+    all_dataset = dataset
 
-def full_interp(pfn, method='linear', attr=False, savepath=None):
+    if stats is not None:
+        # 被动态剔除的站点不参与插值，但仍计算其新息，以便其恢复后重新启用
+        dynamic_exclude = stats.excluded()
+        dataset = dataset.select(~np.isin(dataset.station,
+                                          list(dynamic_exclude)))
+
+    if qc:
+        from algom.qc import apply_qc
+        dataset = apply_qc(dataset,levels.heights,config.get('qc'))
+
+    return all_dataset, dataset
+
+
+def full_interp(pfn, method='linear', attr=False, savepath=None, config=None,
+                qc=False, stats=None, dtype=np.float64, out=None, levels=None,
+                update_stats=True, batch=None):
     '''在单个站点垂直插值的基础上对所有站点所有层次进行插值处理
 
     输入参数
@@ -166,20 +306,47 @@ def full_interp(pfn, method='linear', attr=False, savepath=None):
     pfn : `str`
         多站数据列表，单行是单站数据（字典格式）
     method : `str`
-        插值方法选择，可供选择的选项有'linear','nearest','cubic'，默认为'cubic'
+        插值方法选择，可供选择的选项有'linear','nearest','cubic'，以及基于KD树邻近搜索
+        的'idw'（反距离加权）和'barnes'（Barnes客观分析），默认为'linear'。
+        'idw'与'barnes'的参数取自配置中的'hinterp'项（见`algom.hinterp`）
     attr : `bool`
         在保存文件为json格式时生效的判断参数，该参数指示是否保存变量属性，若了False则输出文件
         只保存数据而不保存属性，若为True则也保存属性
     savepath : `str`
         保存路径，默认为None，若为None则返回数据字典和属性字典，若不为None则保存文件且函数
         无返回值。
+    config : `algom.config.Config`
+        配置对象，用于获取剔除站点列表，默认为None，即使用`get_config()`惰性加载的
+        默认配置。
+    qc : `bool`
+        是否在水平插值前进行质量控制（见`algom.qc`），阈值取自配置中的'qc'项，
+        默认为False
+    stats : `algom.stnstat.StationStats`
+        站点可靠性统计库，默认为None。若给出，则在配置的剔除列表之外再剔除统计库
+        给出的动态剔除站点，并以本时次的到报情况和新息更新统计库
+    dtype : `numpy.dtype`
+        输出数据立方体的类型，默认为np.float64，可设为np.float32以减少内存占用
+    out : `ndarray`
+        预先分配的输出数组，形状为(5, level, lat, lon)，依次存放U、V、VWS、HWS、
+        HWD；调用方可逐时次复用同一块内存（此时上一时次返回的数组会被覆盖）。
+        默认为None，即新建数组
+    levels : `algom.levels.LevelSet`
+        垂直插值的目标高度层，默认为None，即取配置中的'levels'项，未配置时为
+        标准高度层
+    update_stats : `bool`
+        是否以本时次更新统计库，默认为True。重新插值（迟到文件）的时次已计入过
+        统计库，应设为False，此时只做动态剔除
+    batch : `tuple`
+        `prepare_batch`的返回值，须以相同的config、qc、stats、levels得到。
+        默认为None，即由pfn读取
 
     返回值
     -----
     `None` | 'tuple' : 如果设置了savepath参数，则函数根据savepath保存文件并返回None，
                        如果savepath参数为None，则函数返回一个由两个字典组成的元组，其结构
                        为(data_dict,attr_dict)，其中data_dict是数据字典，attr_dict是
-                       属性字典
+                       属性字典。数据字典中各数据立方体的缺测为np.nan，保存为文件
+                       时才转换为缺省值-9999.
 
     错误
     ---
@@ -239,121 +406,95 @@ def full_interp(pfn, method='linear', attr=False, savepath=None):
             f.write(js_str)
 
 
-    dataset = multi_v_interp(load_js(pfn,exclude))
-    sh = std_sh()
-
-    min_lon = 85
-    max_lon = 125
-    min_lat = 14
-    max_lat = 45
-    grd_lon = np.arange(min_lon,max_lon,0.5)
-    grd_lat = np.arange(min_lat,max_lat,0.5)
-    grd_lons, grd_lats = np.meshgrid(grd_lon,grd_lat)
+    if config is None:
+        config = get_config()
+    if levels is None:
+        levels = LevelSet.from_config(config.get('levels'))
+    if batch is None:
+        batch = prepare_batch(pfn,config,qc,stats,levels)
+    all_dataset, dataset = batch
+    sh = levels.heights
+
+    grd_lon, grd_lat, grd_lons, grd_lats = grid_geometry()
+
+    # 所有输出变量共用一块预先分配的内存，逐层直接写入
+    shape = (5,len(sh)) + grd_lons.shape
+    if out is None:
+        out = np.empty(shape,dtype=dtype)
+    elif out.shape != shape:
+        raise ValueError('out must have shape {}'.format(shape))
+    cube_u, cube_v, cube_vws, cube_hws, cube_hwd = out
+
+    kd_grds = None
+    if method in ('idw','barnes'):
+        kd_grds = kd_cubes(dataset,grd_lons,grd_lats,method,
+                           config.get('hinterp'))
+    else:
+        # 水平分量与垂直分量分别判断缺测，水平风缺测不影响该站垂直速度参与插值
+        h_valid = np.isfinite(dataset.HWD) & np.isfinite(dataset.HWS)
+        v_valid = np.isfinite(dataset.VWS)
+        obs_u, obs_v = wind.sd2uv(dataset.HWS,dataset.HWD,convention='to')
+
+    for sh_index in range(len(sh)):
+        if kd_grds is not None:
+            u_grds = kd_grds[...,sh_index,0]
+            v_grds = kd_grds[...,sh_index,1]
+            vws_grds = kd_grds[...,sh_index,2]
+        else:
+            hz = h_valid[:,sh_index]
+            vt = v_valid[:,sh_index]
 
-    data_dict = {}
-    multi_u_grds = []
-    multi_v_grds = []
-    multi_hws_grds = []
-    multi_hwd_grds = []
-    multi_vws_grds = []
-    for height in sh:
-        sh_index = sh.index(height)
-
-        hwd = []
-        hws = []
-        hz_lon = []
-        hz_lat = []
-
-        vws = []
-        vt_lon = []
-        vt_lat = []
-
-        for line in dataset:
             try:
-                int(line['HWD'][sh_index])
-                int(line['HWS'][sh_index])
-            except ValueError:
-                continue
+                uv_grds = grid_points(dataset.lon[hz],dataset.lat[hz],
+                                      np.column_stack((obs_u[hz,sh_index],
+                                                       obs_v[hz,sh_index])),
+                                      grd_lons,grd_lats,method=method)
+            except:
+                u_grds = np.full(grd_lons.shape,np.nan)
+                v_grds = np.full(grd_lons.shape,np.nan)
             else:
-                hws.append(line['HWS'][sh_index])
-                hwd.append(line['HWD'][sh_index])
-                hz_lon.append(line['lon'])
-                hz_lat.append(line['lat'])
-
+                u_grds = uv_grds[...,0]
+                v_grds = uv_grds[...,1]
             try:
-                int(line['VWS'][sh_index])
-            except ValueError:
-                continue
-            else:
-                vws.append(line['VWS'][sh_index])
-                vt_lon.append(line['lon'])
-                vt_lat.append(line['lat'])
-
-        hz_lon = np.array(hz_lon)
-        hz_lat = np.array(hz_lat)
-
-        vt_lon = np.array(vt_lon)
-        vt_lat = np.array(vt_lat)
-
-        hwd = np.array(hwd,dtype=np.float64)
-        hws = np.array(hws,dtype=np.float64)
-        vws = np.array(vws,dtype=np.float64)
-
-        u,v = sd2uv(hws,hwd)
-
-        try:
-            u_grds = griddata((hz_lon,hz_lat),u,(grd_lons,grd_lats),
-                            method=method)
-        except:
-            u_grds = np.full(grd_lons.shape,np.nan)
-        try:
-            v_grds = griddata((hz_lon,hz_lat),v,(grd_lons,grd_lats),
-                            method=method)
-        except:
-            v_grds = np.full(grd_lons.shape,np.nan)
-        try:
-            vws_grds = griddata((vt_lon,vt_lat),vws,(grd_lons,grd_lats),
-                            method=method)
-        except:
-            vws_grds = np.full(grd_lons.shape,np.nan)
-
-        hws_grds = np.sqrt(u_grds**2 + v_grds**2)
-        hwd_grds = np.rad2deg(np.arcsin(u_grds/hws_grds))
-
-        # 风的来向与去向转换
-        u_grds = -u_grds
-        v_grds = -v_grds
-
-        # 把nan转化为缺省值-9999.
-        u_grds = nan2num(u_grds,-9999)
-        v_grds = nan2num(v_grds,-9999)
-        hws_grds = nan2num(hws_grds,-9999)
-        hwd_grds = nan2num(hwd_grds,-9999)
-        vws_grds = nan2num(vws_grds,-9999)
-
-        multi_u_grds.append(u_grds)
-        multi_v_grds.append(v_grds)
-        multi_vws_grds.append(vws_grds)
-        multi_hws_grds.append(hws_grds)
-        multi_hwd_grds.append(hwd_grds)
-
-    data_dict['U'] = np.array(multi_u_grds,dtype=np.float64)
-    data_dict['V'] = np.array(multi_v_grds,dtype=np.float64)
-    data_dict['VWS'] = np.array(multi_vws_grds,dtype=np.float64)
-    data_dict['HWS'] = np.array(multi_hws_grds,dtype=np.float64)
-    data_dict['HWD'] = np.array(multi_hwd_grds,dtype=np.float64)
-    data_dict['lon'] = grd_lon
-    data_dict['lat'] = grd_lat
+                vws_grds = grid_points(dataset.lon[vt],dataset.lat[vt],
+                                       dataset.VWS[vt,sh_index],
+                                       grd_lons,grd_lats,method=method)
+            except:
+                vws_grds = np.full(grd_lons.shape,np.nan)
+
+        cube_u[sh_index] = u_grds
+        cube_v[sh_index] = v_grds
+        cube_vws[sh_index] = vws_grds
+        # U、V为风的去向，风向为来向
+        wind.uv2sd(cube_u[sh_index],cube_v[sh_index],convention='to',
+                   out=(cube_hws[sh_index],cube_hwd[sh_index]))
+
+    # 内存中的数据立方体缺测保持为np.nan，只在保存文件时转换为缺省值
+
+    data_dict = {'U':cube_u, 'V':cube_v, 'VWS':cube_vws, 'HWS':cube_hws,
+                 'HWD':cube_hwd}
+    data_dict['lon'] = np.array(grd_lon)
+    data_dict['lat'] = np.array(grd_lat)
     data_dict['level'] = np.array(sh)
     data_dict['time'] = get_datetime(pfn)
 
     attr_dict = get_attr_dict()
+    attr_dict['level'] = levels.attrs()
+
+    if stats is not None and update_stats:
+        from algom.stnstat import slot_innovations
+        stations, innovations = slot_innovations(all_dataset,dataset,
+                                                 config.get('hinterp'))
+        stats.update_arrivals(stations)
+        stats.update_innovations(stations,innovations)
 
     if savepath:
         if savepath.endswith('.nc'):
             save_as_nc(data_dict,attr_dict,savepath)
             return None
         elif savepath.endswith('.json'):
+            for key in ('U','V','VWS','HWS','HWD'):
+                data_dict[key] = nan2num(data_dict[key])
             save2json(data_dict,attr_dict,attr,savepath)
             return None
         else:
@@ -0,0 +1,50 @@
+# coding:utf-8
+'''
+--------------------------------------------------------------------
+项目名：rwp
+模块名：algom.missing
+本模块用于缺测值的表示转换
+
+算法内部及内存中的数据统一以np.nan表示缺测，只在输出文件时再转换为缺省值
+FILL_VALUE；读入的文件数据（缺省值或掩码数组）先由to_nan转换。
+本模块只依赖numpy，各算法模块可直接导入，无需加载格点化模块。
+--------------------------------------------------------------------
+python = 3.6
+依赖库：
+    numpy         $ conda install numpy
+--------------------------------------------------------------------
+'''
+import numpy as np
+
+
+FILL_VALUE = -9999.
+
+
+def nan2num(arr,fill_value=FILL_VALUE,out=None):
+    '''将np.nan转化为特定数字
+
+    默认返回新数组，输入数组不被修改；out为输入数组本身时原地转换。
+    '''
+    if out is None:
+        out = np.array(arr,dtype=np.result_type(arr,np.float16))
+    elif out is not arr:
+        np.copyto(out,arr)
+    np.copyto(out,fill_value,where=np.isnan(out))
+    return out
+
+
+def to_nan(arr,fill_value=FILL_VALUE,dtype=None):
+    '''将缺省值或掩码数组（例如netCDF4读出的数据）统一转换为以np.nan表示缺测的数组
+
+    返回新数组，输入数组不被修改。
+    '''
+    if dtype is None:
+        dtype = np.result_type(arr,np.float16)
+    if np.ma.isMaskedArray(arr):
+        out = np.ma.getdata(arr).astype(dtype)
+        out[np.ma.getmaskarray(arr)] = np.nan
+    else:
+        out = np.array(arr,dtype=dtype)
+    if fill_value is not None:
+        out[out == fill_value] = np.nan
+    return out
@@ -0,0 +1,241 @@
+# coding:utf-8
+'''
+--------------------------------------------------------------------
+项目名：rwp
+模块名：algom.profile
+本模块定义单站廓线与多站廓线批的紧凑容器
+
+解码输出的每个站点为一个字典，各要素为Python列表，缺测为None。垂直插值后
+改用以下容器：
+    StationProfile : 单站廓线，各要素为float64数组，缺测为np.nan
+    ProfileBatch   : 统一高度层的多站廓线，各要素为(站点, 高度层)二维数组，
+                     站号、经纬度等为一维数组
+两者都支持按键取值（profile['HWS']、batch['lon']），ProfileBatch还可按序号
+取单站（batch[0]）和逐站迭代，原先接受字典列表的函数可直接使用。
+--------------------------------------------------------------------
+python = 3.6
+依赖库：
+    numpy         $ conda install numpy
+--------------------------------------------------------------------
+'''
+import numpy as np
+
+from algom.errors import InputError
+
+
+LEVEL_VARS = ('HWD', 'HWS', 'VWS', 'HDR', 'VDR', 'CN2')
+ATTR_VARS = ('station', 'lon', 'lat', 'altitude', 'wave', 'time')
+
+
+def _column(values):
+    '''转换为float64数组，None转为np.nan'''
+    return np.array(values, dtype=np.float64)
+
+
+def _float(value):
+    return np.nan if value is None else float(value)
+
+
+class StationProfile(object):
+    '''单站廓线
+
+    属性
+    ---
+    station, wave, time : `str`
+        站号、波段、时间
+    lon, lat, altitude : `float`
+        经度、纬度、海拔高度
+    SH : `ndarray`
+        采样高度
+    HWD, HWS, VWS, HDR, VDR, CN2 : `ndarray`
+        各要素廓线，与SH等长，缺测为np.nan
+    '''
+    __slots__ = ATTR_VARS + ('SH',) + LEVEL_VARS
+
+    def __init__(self, station, lon, lat, SH, altitude=np.nan, wave=None,
+                 time=None, **columns):
+        self.station = station
+        self.lon = _float(lon)
+        self.lat = _float(lat)
+        self.altitude = _float(altitude)
+        self.wave = wave
+        self.time = time
+        self.SH = _column(SH)
+        for var in LEVEL_VARS:
+            if var in columns:
+                values = _column(columns[var])
+            else:
+                values = np.full(self.SH.shape, np.nan)
+            setattr(self, var, values)
+
+    @classmethod
+    def from_record(cls, record):
+        '''由解码输出的单站字典构建'''
+        if isinstance(record, cls):
+            return record
+        columns = {var: record[var] for var in LEVEL_VARS if var in record}
+        return cls(record['station'], record['lon'], record['lat'],
+                   record['SH'], record.get('altitude'), record.get('wave'),
+                   record.get('time'), **columns)
+
+    def to_record(self):
+        '''转换为可直接输出为json的单站字典，缺测为None'''
+        record = {var: getattr(self, var) for var in ATTR_VARS}
+        for var in ('lon', 'lat', 'altitude'):
+            if np.isnan(record[var]):
+                record[var] = None
+        for var in ('SH',) + LEVEL_VARS:
+            values = getattr(self, var)
+            record[var] = np.where(np.isnan(values), None, values).tolist()
+        return record
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return self.__slots__
+
+    def __repr__(self):
+        return '<StationProfile {0} ({1} levels)>'.format(self.station,
+                                                          len(self.SH))
+
+
+class ProfileBatch(object):
+    '''统一高度层的多站廓线批
+
+    属性
+    ---
+    station : `ndarray`
+        站号，形状为(站点,)的字符串数组
+    lon, lat, altitude : `ndarray`
+        形状为(站点,)的float64数组
+    wave, time : `ndarray`
+        形状为(站点,)的object数组
+    SH : `ndarray`
+        公共高度层，形状为(高度层,)
+    HWD, HWS, VWS, HDR, VDR, CN2 : `ndarray`
+        形状为(站点, 高度层)的float64数组，缺测为np.nan
+    '''
+    __slots__ = ATTR_VARS + ('SH',) + LEVEL_VARS
+
+    def __init__(self, station, lon, lat, SH, altitude=None, wave=None,
+                 time=None, **columns):
+        self.station = np.array(station, dtype=str)
+        n = len(self.station)
+        self.lon = _column(lon)
+        self.lat = _column(lat)
+        self.altitude = _column(altitude) if altitude is not None else \
+                        np.full(n, np.nan)
+        self.wave = np.array(wave if wave is not None else [None] * n,
+                             dtype=object)
+        self.time = np.array(time if time is not None else [None] * n,
+                             dtype=object)
+        self.SH = _column(SH)
+        for var in LEVEL_VARS:
+            if var in columns:
+                values = _column(columns[var]).reshape(n, len(self.SH))
+            else:
+                values = np.full((n, len(self.SH)), np.nan)
+            setattr(self, var, values)
+
+    @classmethod
+    def from_profiles(cls, profiles, SH=None):
+        '''由单站廓线或单站字典构建，所有站点的高度层须一致
+
+        输入参数
+        -------
+        profiles : `iterable`
+            `StationProfile`或单站字典
+        SH : `list`
+            公共高度层，默认取首个站点的高度层；站点为空时须给出
+
+        错误
+        ---
+        InputError : 当站点的高度层不一致时抛出
+        '''
+        profiles = [StationProfile.from_record(line) for line in profiles]
+        if SH is None:
+            SH = profiles[0].SH if profiles else []
+        SH = _column(SH)
+        for line in profiles:
+            if not np.array_equal(line.SH, SH):
+                raise InputError('Station {} does not share the batch '
+                                 'levels.'.format(line.station))
+        columns = {}
+        for var in LEVEL_VARS:
+            columns[var] = np.array([line[var] for line in profiles],
+                                    dtype=np.float64).reshape(-1, len(SH))
+        return cls([line.station for line in profiles],
+                   [line.lon for line in profiles],
+                   [line.lat for line in profiles], SH,
+                   [line.altitude for line in profiles],
+                   [line.wave for line in profiles],
+                   [line.time for line in profiles], **columns)
+
+    def __len__(self):
+        return len(self.station)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        n = range(len(self))[key]
+        return StationProfile(self.station[n], self.lon[n], self.lat[n],
+                              self.SH, self.altitude[n], self.wave[n],
+                              self.time[n], **{var: getattr(self, var)[n]
+                                               for var in LEVEL_VARS})
+
+    def __iter__(self):
+        for n in range(len(self)):
+            yield self[n]
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def select(self, index):
+        '''按布尔掩码或序号数组选取站点，返回新的ProfileBatch'''
+        index = np.asarray(index)
+        return self.replace(index)
+
+    def replace(self, index=slice(None), **columns):
+        '''选取站点并替换部分要素，返回新的ProfileBatch（原批不被修改）'''
+        values = {var: columns.get(var, getattr(self, var)[index])
+                  for var in LEVEL_VARS}
+        return ProfileBatch(self.station[index], self.lon[index],
+                            self.lat[index], self.SH, self.altitude[index],
+                            self.wave[index], self.time[index], **values)
+
+    def to_records(self):
+        '''转换为单站字典列表'''
+        return [line.to_record() for line in self]
+
+    def __repr__(self):
+        return '<ProfileBatch {0} stations x {1} levels>'.format(
+                                                    len(self), len(self.SH))
+
+
+def as_batch(dataset, SH=None):
+    '''将多站数据（ProfileBatch、单站廓线或单站字典列表）统一为ProfileBatch'''
+    if isinstance(dataset, ProfileBatch):
+        return dataset
+    return ProfileBatch.from_profiles(dataset, SH)
@@ -0,0 +1,218 @@
+# coding:utf-8
+'''
+--------------------------------------------------------------------
+项目名：rwp
+模块名：algom.qc
+本模块用于在格点化之前对多站廓线数据进行质量控制
+
+全部检查均在(站点, 高度层)二维数组上一次完成，包括：
+    可信度检查：HDR/VDR低于阈值时分别标记水平、垂直分量
+    范围检查：风速、风向、垂直速度超出合理范围
+    尖峰检查：某层与上下相邻层的均值偏差远大于相邻层之间的差异
+    垂直一致性检查：某层风矢量与上下两层的矢量差均超过阈值
+    邻站检查：以KD树查找邻近站点，与邻站同层风矢量中值差异过大
+检查结果以位标记的形式给出，同一数据点可以同时被多个检查标记。
+--------------------------------------------------------------------
+python = 3.6
+依赖库：
+    numpy         $ conda install numpy
+    scipy         $ conda install scipy
+--------------------------------------------------------------------
+'''
+import warnings
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from algom.profile import as_batch
+from algom.wind import sd2uv
+
+
+# 质控标记位
+QC_RELIABILITY = 1
+QC_RANGE = 2
+QC_SPIKE = 4
+QC_CONSISTENCY = 8
+QC_BUDDY = 16
+
+# 默认阈值，可通过配置文件中的'qc'项覆盖
+DEFAULTS = {
+    'hdr_min': 60.,          # 水平可信度下限（%）
+    'vdr_min': 60.,          # 垂直可信度下限（%）
+    'hws_max': 80.,          # 水平风速上限（m/s）
+    'vws_max': 20.,          # 垂直速度绝对值上限（m/s）
+    'hws_spike': 10.,        # 水平风速尖峰阈值（m/s）
+    'vws_spike': 5.,         # 垂直速度尖峰阈值（m/s）
+    'shear_max': 0.1,        # 相邻层风矢量差上限（(m/s)/m）
+    'buddy_radius': 3.,      # 邻站搜索半径（°）
+    'buddy_count': 6,        # 最多邻站个数
+    'buddy_min': 2,          # 进行邻站检查所需的最少有效邻站数
+    'buddy_max': 15.,        # 与邻站中值风矢量差上限（m/s）
+}
+
+
+def profile_arrays(dataset, variables=('HWD', 'HWS', 'VWS', 'HDR', 'VDR')):
+    '''将经垂直插值后的多站数据集整理为(站点, 高度层)二维数组
+
+    输入参数
+    -------
+    dataset : `algom.profile.ProfileBatch` | `list`
+        经`multi_v_interp`处理后的多站数据
+    variables : `tuple`
+        需要整理的变量
+
+    返回值
+    -----
+    `dict` : 变量名对应二维数组，缺测为np.nan，另含'lon','lat'一维数组
+    '''
+    dataset = as_batch(dataset)
+    arrays = {var: dataset[var] for var in variables}
+    arrays['lon'] = dataset.lon
+    arrays['lat'] = dataset.lat
+
+    return arrays
+
+
+def spike_test(array, threshold):
+    '''尖峰检查，返回与输入同形状的布尔数组（首末层不做检查）'''
+    flags = np.zeros(array.shape, dtype=bool)
+    below = array[:, :-2]
+    middle = array[:, 1:-1]
+    above = array[:, 2:]
+    with np.errstate(invalid='ignore'):
+        spike = np.abs(middle - (below + above) / 2.) - \
+                np.abs(above - below) / 2.
+        flags[:, 1:-1] = spike > threshold
+
+    return flags
+
+
+def consistency_test(u, v, heights, threshold):
+    '''垂直一致性检查，某层与上下两层的风矢量差（按层距归一）均超过阈值时标记'''
+    flags = np.zeros(u.shape, dtype=bool)
+    dz = np.diff(np.asarray(heights, dtype=np.float64))
+    with np.errstate(invalid='ignore'):
+        shear = np.hypot(np.diff(u, axis=1), np.diff(v, axis=1)) / dz
+        flags[:, 1:-1] = (shear[:, :-1] > threshold) & \
+                         (shear[:, 1:] > threshold)
+
+    return flags
+
+
+def buddy_test(lon, lat, u, v, radius, count, min_count, threshold):
+    '''邻站检查，与邻站同层风矢量中值之差超过阈值时标记'''
+    nstation = len(lon)
+    flags = np.zeros(u.shape, dtype=bool)
+    if nstation < min_count + 1:
+        return flags
+
+    tree = cKDTree(np.column_stack((lon, lat)))
+    k = min(count + 1, nstation)
+    dist, idx = tree.query(np.column_stack((lon, lat)), k=k,
+                           distance_upper_bound=radius)
+    dist = dist.reshape(nstation, k)
+    idx = idx.reshape(nstation, k)
+    # 超出半径的邻站索引为nstation，对应追加的一行nan；站点自身同样置为
+    # nstation。坐标重合时自身不一定在第一列，因此按索引而不是按列剔除，
+    # 再按距离取最近的count个邻站
+    own = idx == np.arange(nstation)[:, None]
+    idx[own] = nstation
+    dist[own] = np.inf
+    order = np.argsort(dist, axis=1, kind='mergesort')[:, :k - 1]
+    idx = np.take_along_axis(idx, order, axis=1)
+    pad = np.full((1, u.shape[1]), np.nan)
+    u_nb = np.concatenate((u, pad))[idx]
+    v_nb = np.concatenate((v, pad))[idx]
+
+    valid = np.isfinite(u_nb) & np.isfinite(v_nb)
+    enough = valid.sum(axis=1) >= min_count
+    with np.errstate(invalid='ignore'), warnings.catch_warnings():
+        # 无有效邻站时nanmedian会给出全nan切片警告
+        warnings.simplefilter('ignore', RuntimeWarning)
+        u_med = np.nanmedian(u_nb, axis=1)
+        v_med = np.nanmedian(v_nb, axis=1)
+        diff = np.hypot(u - u_med, v - v_med)
+        flags = enough & (diff > threshold)
+
+    return flags
+
+
+def quality_control(dataset, heights, params=None):
+    '''对多站廓线数据做质量控制
+
+    输入参数
+    -------
+    dataset : `algom.profile.ProfileBatch` | `list`
+        经`multi_v_interp`处理后的多站数据
+    heights : `list` | `ndarray`
+        数据集对应的高度层
+    params : `dict`
+        阈值参数，未给出的项采用`DEFAULTS`中的默认值
+
+    返回值
+    -----
+    `tuple` : (h_valid, v_valid, flags)
+        h_valid : 水平分量（HWD,HWS）可用标识，形状为(站点, 高度层)的布尔数组
+        v_valid : 垂直分量（VWS）可用标识，形状同上
+        flags : 质控标记，形状同上的uint8数组，各位含义见QC_*常量
+    '''
+    p = dict(DEFAULTS)
+    if params:
+        p.update(params)
+
+    arrays = profile_arrays(dataset)
+    hwd = arrays['HWD']
+    hws = arrays['HWS']
+    vws = arrays['VWS']
+    h_flags = np.zeros(hws.shape, dtype=np.uint8)
+    v_flags = np.zeros(hws.shape, dtype=np.uint8)
+
+    with np.errstate(invalid='ignore'):
+        # 可信度检查（可信度缺测时不做判断）
+        h_flags[arrays['HDR'] < p['hdr_min']] |= QC_RELIABILITY
+        v_flags[arrays['VDR'] < p['vdr_min']] |= QC_RELIABILITY
+
+        # 范围检查
+        h_flags[(hws < 0) | (hws > p['hws_max']) |
+                (hwd < 0) | (hwd > 360)] |= QC_RANGE
+        v_flags[np.abs(vws) > p['vws_max']] |= QC_RANGE
+
+    # 尖峰检查
+    h_flags[spike_test(hws, p['hws_spike'])] |= QC_SPIKE
+    v_flags[spike_test(vws, p['vws_spike'])] |= QC_SPIKE
+
+    # 垂直一致性与邻站检查基于风矢量
+    u, v = sd2uv(hws, hwd, convention='to')
+    h_flags[consistency_test(u, v, heights, p['shear_max'])] |= \
+        QC_CONSISTENCY
+    u[h_flags > 0] = np.nan
+    v[h_flags > 0] = np.nan
+    h_flags[buddy_test(arrays['lon'], arrays['lat'], u, v,
+                       p['buddy_radius'], int(p['buddy_count']),
+                       int(p['buddy_min']), p['buddy_max'])] |= QC_BUDDY
+
+    h_valid = (h_flags == 0) & np.isfinite(hws) & np.isfinite(hwd)
+    v_valid = (v_flags == 0) & np.isfinite(vws)
+    flags = h_flags | v_flags
+
+    return h_valid, v_valid, flags
+
+
+def apply_qc(dataset, heights, params=None):
+    '''对多站数据集做质量控制，并将未通过检查的数据置为np.nan
+
+    输入参数与`quality_control`相同
+
+    返回值
+    -----
+    `algom.profile.ProfileBatch` : 质控后的多站廓线批（原数据集不会被修改）
+    '''
+    dataset = as_batch(dataset, heights)
+    if not len(dataset):
+        return dataset
+
+    h_valid, v_valid, _ = quality_control(dataset, heights, params)
+
+    return dataset.replace(HWD=np.where(h_valid, dataset.HWD, np.nan),
+                           HWS=np.where(h_valid, dataset.HWS, np.nan),
+                           VWS=np.where(v_valid, dataset.VWS, np.nan))
@@ -0,0 +1,208 @@
+# coding:utf-8
+'''
+--------------------------------------------------------------------
+项目名：rwp
+模块名：algom.series
+本模块用于从解码输出目录中提取单站的时间-高度序列
+
+解码输出目录按日期分文件夹，每个时次一个json lines文件，每行为一个站点。
+本模块为每个日期目录建立站点偏移索引（站号 -> 时次文件、行偏移、行长度），
+索引只需扫描每行中的站号字段，不必解码整行；提取序列时按索引直接定位到目标
+站点的记录，其他站点的记录不会被解码。输出数组在提取前按时次数预先分配，
+内存占用只与所提取的时次数和层数相关。
+索引在进程内缓存并可能被多个线程（如查询服务的请求线程）同时使用，索引的
+增量更新与查找均在该索引的锁内进行。
+--------------------------------------------------------------------
+python = 3.6
+依赖库：
+    numpy         $ conda install numpy
+    scipy         $ conda install scipy
+--------------------------------------------------------------------
+'''
+import os
+import re
+import json as js
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from algom.errors import InputError
+
+
+STATION_PATTERN = re.compile(rb'"station":\s*"([^"]*)"')
+
+
+class DayIndex(object):
+    '''单个日期目录的站点偏移索引
+
+    属性
+    ---
+    daypath : `str`
+        日期目录路径
+    stations : `dict`
+        {站号: {时次: (偏移, 长度)}}
+    '''
+    __slots__ = ('daypath', 'stations', '_scanned', '_lock')
+
+    def __init__(self, daypath):
+        self.daypath = daypath
+        self.stations = {}
+        # 已扫描的文件及其(修改时间, 大小)，用于增量更新
+        self._scanned = {}
+        self._lock = threading.Lock()
+
+    def _scan(self, fn):
+        slot = fn.split('.')[0]
+        # 重写的文件先清除其原有记录，新版本中不再出现的站点不会留下过期偏移
+        for slots in self.stations.values():
+            slots.pop(slot, None)
+        with open(os.path.join(self.daypath, fn), 'rb') as f:
+            offset = 0
+            for line in f:
+                match = STATION_PATTERN.search(line)
+                if match:
+                    station = match.group(1).decode()
+                    self.stations.setdefault(station, {})[slot] = \
+                        (offset, len(line))
+                offset += len(line)
+
+    def update(self):
+        '''增量更新索引，只扫描新增或发生变化的时次文件
+
+        返回值
+        -----
+        `int` : 本次扫描的文件数
+        '''
+        try:
+            entries = list(os.scandir(self.daypath))
+        except FileNotFoundError:
+            return 0
+
+        count = 0
+        with self._lock:
+            for entry in entries:
+                if not entry.name.endswith('.json'):
+                    continue
+                stat = entry.stat()
+                stamp = (stat.st_mtime_ns, stat.st_size)
+                if self._scanned.get(entry.name) == stamp:
+                    continue
+                self._scan(entry.name)
+                self._scanned[entry.name] = stamp
+                count += 1
+
+        return count
+
+    def locate(self, station, slot):
+        '''获取站点记录位置，若不存在则返回None'''
+        with self._lock:
+            return self.stations.get(station, {}).get(slot)
+
+    def read(self, station, slot):
+        '''读取并解码单站单时次的记录，若不存在则返回None'''
+        location = self.locate(station, slot)
+        if location is None:
+            return None
+        offset, length = location
+        with open(os.path.join(self.daypath, slot + '.json'), 'rb') as f:
+            f.seek(offset)
+            line = f.read(length)
+
+        return js.loads(line.decode())
+
+
+_day_indexes = {}
+_day_indexes_lock = threading.Lock()
+
+
+def get_day_index(rootpath, day):
+    '''获取（进程内缓存的）日期目录索引，并做增量更新
+
+    输入参数
+    -------
+    rootpath : `str`
+        解码输出根路径，其末尾不带日期文件夹路径
+    day : `str`
+        日期字符串，例如'20181001'
+
+    返回值
+    -----
+    `DayIndex` : 该日期目录的站点偏移索引
+    '''
+    daypath = os.path.join(rootpath, day)
+    with _day_indexes_lock:
+        try:
+            index = _day_indexes[daypath]
+        except KeyError:
+            index = _day_indexes[daypath] = DayIndex(daypath)
+    index.update()
+
+    return index
+
+
+def slot_range(start, end, interval=6):
+    '''生成起止时次（含）之间的逐6分钟时次字符串'''
+    dt = datetime.strptime(start, '%Y%m%d%H%M')
+    dt_end = datetime.strptime(end, '%Y%m%d%H%M')
+    delt = timedelta(minutes=interval)
+    slots = []
+    while dt <= dt_end:
+        slots.append(dt.strftime('%Y%m%d%H%M'))
+        dt += delt
+
+    return slots
+
+
+def station_series(rootpath, station, start, end,
+                   variables=('HWS', 'HWD', 'VWS'), levels=None):
+    '''提取单站的时间-高度序列
+
+    输入参数
+    -------
+    rootpath : `str`
+        解码输出根路径，其末尾不带日期文件夹路径
+    station : `str`
+        站号
+    start : `str`
+        起始时次，例如'201810010000'
+    end : `str`
+        结束时次（含），例如'201810012354'
+    variables : `tuple`
+        需要提取的变量，可选'HWD','HWS','VWS','HDR','VDR','CN2'
+    levels : `algom.levels.LevelSet`
+        目标高度层，默认为None，即标准高度层
+
+    返回值
+    -----
+    `dict` : {'time': 时次字符串列表, 'level': 高度层数组,
+              变量名: 形状为(time, level)的数组，缺测为np.nan}
+    '''
+    from algom.makegrid import v_interp
+    from algom.levels import LevelSet
+
+    if levels is None:
+        levels = LevelSet.standard()
+    slots = slot_range(start, end)
+    sh = np.array(levels.heights)
+
+    result = {'time': slots, 'level': sh}
+    for var in variables:
+        result[var] = np.full((len(slots), len(sh)), np.nan)
+
+    index = None
+    for n, slot in enumerate(slots):
+        day = slot[:8]
+        if index is None or index.daypath != os.path.join(rootpath, day):
+            index = get_day_index(rootpath, day)
+        record = index.read(station, slot)
+        if record is None:
+            continue
+        try:
+            profile = v_interp(record, levels)
+        except (ValueError, TypeError, InputError):
+            continue
+        for var in variables:
+            result[var][n] = np.array(profile[var], dtype=np.float64)
+
+    return result
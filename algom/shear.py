@@ -21,6 +21,8 @@ import netCDF4 as nc
 from scipy.interpolate import interp1d
 from algom.io import save_as_nc
 from algom.errors import InputError
+from algom.wind import unwrap_direction, wrap_direction
+from algom.missing import to_nan
 
 
 def get_attr_dict():
@@ -66,18 +68,25 @@ def single_shear(index,array,delt=100,mod='normal'):
         变量索引值
     array : `list` | `ndarray`
         变量数据值，其长度应与index对应相同
+    delt : `float`
+        切变计算的间隔
+    mod : `str`
+        'normal'或'direction'，后者用于风向，按风向的周期性处理
 
     返回值
     -----
-    `ndarray` : 垂直切变值
+    `ndarray` : 垂直切变值，缺测为np.nan
     '''
 
-    new_index = []
-    new_array = []
-    for i in range(len(index)):
-        if array[i] and not np.isnan(array[i]):
-            new_index.append(index[i])
-            new_array.append(array[i])
+    index = np.asarray(index, dtype=np.float64)
+    array = np.asarray(array, dtype=np.float64)
+    valid = np.isfinite(array)
+    new_index = index[valid]
+    new_array = array[valid]
+
+    if mod == 'direction':
+        # 风向在0/360处不连续，先展开为连续廓线再拟合
+        new_array = unwrap_direction(new_array)
 
     try:
         model = interp1d(new_index,new_array,kind='quadratic',
@@ -95,16 +104,16 @@ def single_shear(index,array,delt=100,mod='normal'):
 
     # 上边界处理
     shr.append(model(index[-1]) - model(index[-1]-delt))
-    if mod == 'direction':
-        for n,dirc in enumerate(shr):
-            if abs(dirc) > 180:
-                shr[n] = dirc - 360
     result = np.array(shr)
+    if mod == 'direction':
+        # 风向切变折算到[-180,180)
+        result = wrap_direction(result)
 
     return result
 
 
-def multi_shear(index,array,axis='height',mod='normal'):
+def multi_shear(index,array,axis='height',mod='normal',out=None,
+                dtype=np.float64):
     '''计算3维切变
 
     输入参数
@@ -112,33 +121,42 @@ def multi_shear(index,array,axis='height',mod='normal'):
     index : `ndarray` | `list`
         切变轴上的相应变量值，例如高度轴上的高度值。该变量为1维数组。
     array : `ndarray`
-        待计算的三维数组，该数组第1维(最左端)必须为高度
+        待计算的三维数组，该数组第1维(最左端)必须为高度，缺测为np.nan（文件
+        读出的数据先用`algom.missing.to_nan`转换）；输入数组不会被修改
     axis : `str`
         切变轴选择，可以选择沿高度:'height'，沿经向（纬圈）:'lon'，
         沿纬向（经圈）:'lat'
+    mod : `str`
+        'normal'或'direction'，见`single_shear`
+    out : `ndarray`
+        预先分配的输出数组，形状须与array相同，默认为None，即新建数组
+    dtype : `numpy.dtype`
+        新建输出数组的类型，默认为np.float64
+
+    返回值
+    -----
+    `ndarray` : 切变数组，缺测为np.nan（保存文件时由save_as_nc转换为缺省值）
     '''
-    if type(array) != np.ndarray:
-        array = np.array(array)
-    if type(index) != np.ndarray:
-        index = np.array(index)
+    array = np.asarray(array)
+    index = np.asarray(index)
     if len(array.shape) != 3:
         raise ValueError('array is not 3-Dimensions')
     if len(index.shape) != 1:
         raise ValueError('index is not 1-Dimension')
 
     shape = array.shape
-    np.place(array,array==-9999,np.nan)
-    shear_array = np.full(shape,np.nan,dtype=np.float64)
+    if out is None:
+        out = np.empty(shape,dtype=dtype)
+    elif out.shape != shape:
+        raise ValueError('out must have shape {}'.format(shape))
     for r in range(shape[1]):
         for c in range(shape[2]):
-            shear_array[:,r,c] = single_shear(index,array[:,r,c],
-                                              mod=mod)
+            out[:,r,c] = single_shear(index,array[:,r,c],mod=mod)
 
-    np.place(shear_array,np.isnan(shear_array),-9999)
-    return shear_array
+    return out
 
 
-def full_wind_shear(readpfn,savepfn):
+def full_wind_shear(readpfn,savepfn,dtype=np.float64):
     '''处理整个时次的风切变
 
     输入参数
@@ -147,32 +165,29 @@ def full_wind_shear(readpfn,savepfn):
         输入文件路径，文件须为.nc文件
     savepfn : `str`
         输出文件路径，文件须为.nc文件
+    dtype : `numpy.dtype`
+        读入数据与切变结果的类型，默认为np.float64，可设为np.float32以减少内存占用
 
     '''
     if not readpfn.endswith('.nc'):
         raise InputError('Input file is not the type of netCDF.')
 
-    file_obj = nc.Dataset(readpfn)
-    lat = file_obj.variables['lat'][:]
-    lon = file_obj.variables['lon'][:]
-    time = file_obj.variables['time'][:]
-    height = file_obj.variables['level'][:]
-
-    u = file_obj.variables['U'][:]
-    v = file_obj.variables['V'][:]
-    hws = file_obj.variables['HWS'][:]
-    hwd = file_obj.variables['HWD'][:]
-    vws = file_obj.variables['VWS'][:]
-
-    sh_u = multi_shear(height,u)
-    sh_v = multi_shear(height,v)
-    sh_hws = multi_shear(height,hws)
-    sh_hwd = multi_shear(height,hwd, mod='direction')
-    sh_vws = multi_shear(height,vws,)
-
-    data_dict = {'lon':lon, 'lat':lat, 'level':height, 'time':time,
-                 'SHR_U':sh_u, 'SHR_V':sh_v, 'SHR_HWS':sh_hws,
-                 'SHR_HWD':sh_hwd,'SHR_VWS':sh_vws}
+    variables = ('U', 'V', 'HWS', 'HWD', 'VWS')
+    with nc.Dataset(readpfn) as file_obj:
+        lat = np.array(file_obj.variables['lat'][:])
+        lon = np.array(file_obj.variables['lon'][:])
+        time = np.array(file_obj.variables['time'][:])
+        height = np.array(file_obj.variables['level'][:])
+        cubes = {var: to_nan(file_obj.variables[var][:],dtype=dtype)
+                 for var in variables}
+
+    # 所有切变结果共用一块预先分配的内存
+    shears = np.empty((len(variables),) + cubes['U'].shape,dtype=dtype)
+    data_dict = {'lon':lon, 'lat':lat, 'level':height, 'time':time}
+    for n, var in enumerate(variables):
+        mod = 'direction' if var == 'HWD' else 'normal'
+        data_dict['SHR_' + var] = multi_shear(height,cubes[var],mod=mod,
+                                              out=shears[n])
 
     attr_dict = get_attr_dict()
 
@@ -0,0 +1,182 @@
+# coding:utf-8
+'''
+--------------------------------------------------------------------
+项目名：rwp
+模块名：algom.slices
+本模块用于导出前端使用的逐层二进制切片
+
+前端每次只显示一个高度层，无需读取整个时次的json。每个时次每层输出一个切片
+文件，内容为量化后的int16 U、V两个(lat,lon)数组（小端序，先U后V），
+实际值 = 存储值 × scale，缺测为MISSING。目录结构：
+    <path>/index.json                  索引：格点信息、时次列表与最新时次
+    <path>/<时次>/manifest.json        时次清单：各层的文件与ETag，及该时次
+                                       的高度层与网格形状
+    <path>/<时次>/<层序号>.bin          切片文件
+索引只列出时次（及是否为插补时次），体积不随层数增长；各层的文件与ETag记录
+在时次清单中，每个时次只写入本时次的清单。清单先于索引写入，索引中出现的
+时次其清单总是完整的。索引中的格点信息（高度层、网格）随每次导出更新，
+与最新时次一致；高度层配置变更前导出的时次以其清单中的高度层为准。
+ETag为切片内容的sha1，内容不变时文件不会被重写，便于HTTP缓存。
+--------------------------------------------------------------------
+python = 3.6
+依赖库：
+    numpy         $ conda install numpy
+--------------------------------------------------------------------
+'''
+import os
+import shutil
+import hashlib
+import json as js
+
+import numpy as np
+
+
+MISSING = -32768
+SCALE = 0.01
+MANIFEST = 'manifest.json'
+
+
+def quantize(values, scale=SCALE, fill_value=-9999.):
+    '''将风速分量量化为int16，缺测为MISSING'''
+    values = np.asarray(values, dtype=np.float64)
+    missing = np.isnan(values) | (values == fill_value)
+    result = np.clip(np.round(np.where(missing, 0, values) / scale),
+                     MISSING + 1, 32767).astype('<i2')
+    result[missing] = MISSING
+    return result
+
+
+def dequantize(data, scale=SCALE):
+    '''由int16还原为浮点数组，缺测为np.nan'''
+    data = np.asarray(data)
+    result = data.astype(np.float32) * np.float32(scale)
+    result[data == MISSING] = np.nan
+    return result
+
+
+def level_slice(data_dict, level, scale=SCALE, fill_value=-9999.):
+    '''单层切片的二进制内容'''
+    return (quantize(data_dict['U'][level], scale, fill_value).tobytes() +
+            quantize(data_dict['V'][level], scale, fill_value).tobytes())
+
+
+def read_slice(content, shape, scale=SCALE):
+    '''解析切片内容
+
+    返回值
+    -----
+    `tuple` : (u, v)，均为(lat,lon)浮点数组
+    '''
+    data = np.frombuffer(content, dtype='<i2').reshape((2,) + tuple(shape))
+    return dequantize(data[0], scale), dequantize(data[1], scale)
+
+
+def _write(pfn, content):
+    with open(pfn + '.tmp', 'wb') as f:
+        f.write(content)
+    os.replace(pfn + '.tmp', pfn)
+
+
+class SliceExporter(object):
+    '''逐层切片导出
+
+    输入参数
+    -------
+    path : `str`
+        导出根目录
+    keep : `int`
+        保留的时次数，超出的最早时次目录会被删除
+    scale : `float`
+        量化步长（m/s）
+    '''
+    def __init__(self, path, keep=240, scale=SCALE):
+        self.path = path
+        self.keep = keep
+        self.scale = scale
+        self.index_pfn = os.path.join(path, 'index.json')
+        try:
+            with open(self.index_pfn) as f:
+                self.index = js.load(f)
+        except FileNotFoundError:
+            self.index = None
+
+    def _grid_info(self, data_dict):
+        lon = np.asarray(data_dict['lon'])
+        lat = np.asarray(data_dict['lat'])
+        return {'shape': [len(lat), len(lon)],
+                'lon0': float(lon[0]), 'dlon': float(lon[1] - lon[0]),
+                'lat0': float(lat[0]), 'dlat': float(lat[1] - lat[0]),
+                'level': [float(h) for h in data_dict['level']],
+                'dtype': 'int16', 'byteorder': 'little',
+                'variables': ['U', 'V'], 'scale': self.scale,
+                'missing': MISSING}
+
+    def _manifest(self, timestr):
+        '''读取时次清单，不存在时为None'''
+        try:
+            with open(os.path.join(self.path, timestr, MANIFEST)) as f:
+                return js.load(f)
+        except FileNotFoundError:
+            return None
+
+    def export(self, data_dict, timestr, synthetic=False):
+        '''导出一个时次并更新清单与索引
+
+        只重写内容发生变化的切片，同一时次重复导出（如迟到文件重新插值）时
+        未变化的层保持原ETag。
+
+        输入参数
+        -------
+        data_dict : `dict`
+            数据字典（`full_interp`返回的格式）
+        timestr : `str`
+            时次字符串
+        synthetic : `bool`
+            是否为由相邻时次插补的时次，记入清单与索引
+
+        返回值
+        -----
+        `int` : 实际写入的切片数
+        '''
+        if self.index is None:
+            self.index = {'slots': []}
+        # 高度层或网格可随配置变化，索引中的格点信息始终与最新导出的时次一致
+        self.index.update(self._grid_info(data_dict))
+        slots = {item['time']: item for item in self.index['slots']}
+        manifest = self._manifest(timestr) if timestr in slots else None
+        old = {item['file']: item['etag']
+               for item in (manifest or {}).get('levels', [])}
+
+        slotpath = os.path.join(self.path, timestr)
+        if not os.path.exists(slotpath):
+            os.makedirs(slotpath)
+
+        entries = []
+        written = 0
+        for k in range(len(data_dict['level'])):
+            content = level_slice(data_dict, k, self.scale)
+            etag = hashlib.sha1(content).hexdigest()
+            name = '{0}/{1}.bin'.format(timestr, k)
+            if old.get(name) != etag:
+                _write(os.path.join(self.path, name), content)
+                written += 1
+            entries.append({'file': name, 'etag': etag,
+                            'bytes': len(content)})
+        synthetic = bool(synthetic)
+        _write(os.path.join(slotpath, MANIFEST),
+               js.dumps({'time': timestr, 'synthetic': synthetic,
+                         'level': self.index['level'],
+                         'shape': self.index['shape'],
+                         'levels': entries}).encode())
+        slots[timestr] = {'time': timestr, 'synthetic': synthetic}
+
+        for expired in sorted(slots)[:-self.keep]:
+            del slots[expired]
+            shutil.rmtree(os.path.join(self.path, expired),
+                          ignore_errors=True)
+
+        self.index['slots'] = [slots[key] for key in sorted(slots)]
+        self.index['latest'] = max(slots)
+        _write(self.index_pfn, js.dumps(self.index).encode())
+
+        return written
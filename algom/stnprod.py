@@ -0,0 +1,197 @@
+# coding:utf-8
+'''
+--------------------------------------------------------------------
+项目名：rwp
+模块名：algom.stnprod
+本模块由解码后的单站廓线直接计算站点垂直产品，无需格点化
+
+每个时次所有站点的廓线先垂直插值为统一高度层的ProfileBatch，此后全部计算
+均为(站点, 高度层)数组上的向量化运算，输出每站一行的紧凑表：
+    SHR1  : 0~1km整层风矢量切变（上下两端风矢量差的模），m s-1
+    SHR3  : 0~3km整层风矢量切变，m s-1
+    LLJ, LLJS, LLJH, LLJF : 低空急流标识、核风速、核高度、核以上风速减小量，
+                            判据同`algom.diagnose.low_level_jet`
+    BLH   : 边界层高度，取CN2在[bottom, top]范围内最大值所在高度，m
+各气层（0~1km、0~3km、BLH搜索范围及急流判据中的高度）均为离地高度：目标
+高度层以海拔高度为参考面时，先减去站点海拔高度再计算。
+业务程序由格点化使用的同一个廓线批计算（见`makegrid.prepare_batch`），
+解码文件只读取和插值一次；`full_station_products`用于单独处理一个时次。
+表格以json行格式保存（与解码输出相同，一行一站），缺测为null。
+--------------------------------------------------------------------
+python = 3.6
+依赖库：
+    numpy         $ conda install numpy
+--------------------------------------------------------------------
+'''
+import sys
+sys.path.append('..')
+
+import numpy as np
+
+from algom import wind
+from algom.io import load_js, save_as_json
+from algom.config import get_config
+from algom.levels import LevelSet
+from algom.diagnose import low_level_jet, DEFAULTS as JET_DEFAULTS
+
+
+COLUMNS = ('station', 'lon', 'lat', 'altitude', 'time', 'SHR1', 'SHR3',
+           'LLJ', 'LLJS', 'LLJH', 'LLJF', 'BLH')
+DEFAULTS = {'blh_bottom': 200., 'blh_top': 3000., 'min_depth': 0.5}
+DEFAULTS.update({key: JET_DEFAULTS[key] for key in ('jet_top', 'falloff_top',
+                                                    'min_speed',
+                                                    'min_falloff')})
+
+
+def bulk_shear(u, v, level, top, bottom=0., min_depth=0.5):
+    '''整层风矢量切变
+
+    取气层内最高与最低的有效高度层，计算二者风矢量差的模；两层间距不足气层
+    厚度的min_depth时为缺测。
+
+    输入参数
+    -------
+    u, v : `ndarray`
+        (站点, 高度层)风矢量分量，缺测为np.nan
+    level : `ndarray`
+        高度层（m），升序，一维或与u形状相同（各站离地高度不同时）
+    top, bottom : `float`
+        气层上、下界（m）
+    min_depth : `float`
+        有效层间距占气层厚度的最小比例
+
+    返回值
+    -----
+    `ndarray` : (站点,)数组，缺测为np.nan
+    '''
+    level = np.broadcast_to(np.asarray(level, dtype=np.float64), u.shape)
+    nlevel = level.shape[1]
+    valid = np.isfinite(u) & np.isfinite(v) & (level >= bottom) & \
+            (level <= top)
+    rows = np.arange(len(u))
+    lo = np.argmax(valid, axis=1)
+    hi = nlevel - 1 - np.argmax(valid[:, ::-1], axis=1)
+    shear = np.hypot(u[rows, hi] - u[rows, lo], v[rows, hi] - v[rows, lo])
+    depth = level[rows, hi] - level[rows, lo]
+    shear[~valid.any(axis=1) | (depth < min_depth * (top - bottom))] = np.nan
+    return shear
+
+
+def mixing_height(cn2, level, bottom=200., top=3000.):
+    '''由CN2廓线估计边界层高度
+
+    夹卷层的折射率结构常数最大，取[bottom, top]范围内CN2最大值所在高度。
+
+    输入参数
+    -------
+    cn2 : `ndarray`
+        (站点, 高度层)CN2，缺测为np.nan
+    level : `ndarray`
+        高度层（m），一维或与cn2形状相同
+    bottom, top : `float`
+        搜索范围（m）
+
+    返回值
+    -----
+    `ndarray` : (站点,)数组，缺测为np.nan
+    '''
+    level = np.broadcast_to(np.asarray(level, dtype=np.float64), cn2.shape)
+    valid = np.isfinite(cn2) & (level >= bottom) & (level <= top)
+    peak = np.argmax(np.where(valid, cn2, -np.inf), axis=1)
+    height = level[np.arange(len(cn2)), peak]
+    height[~valid.any(axis=1)] = np.nan
+    return height
+
+
+def station_products(dataset, prod_config=None, reference='agl'):
+    '''计算一个时次所有站点的垂直产品
+
+    输入参数
+    -------
+    dataset : `algom.profile.ProfileBatch`
+        垂直插值后的多站廓线批
+    prod_config : `dict`
+        配置中的'stnprod'项，可覆盖DEFAULTS中的参数
+    reference : `str`
+        廓线批高度层的参考面（`LevelSet.reference`），'asl'时按站点海拔
+        换算为离地高度
+
+    返回值
+    -----
+    `dict` : 表格各列，键为COLUMNS，值为(站点,)数组，缺测为np.nan
+    '''
+    options = dict(DEFAULTS)
+    options.update(prod_config or {})
+    level = np.asarray(dataset.SH, dtype=np.float64)
+    if reference == 'asl':
+        level = level[None, :] - np.asarray(dataset.altitude,
+                                            dtype=np.float64)[:, None]
+    u, v = wind.sd2uv(dataset.HWS, dataset.HWD, convention='to')
+
+    table = {'station': dataset.station, 'lon': dataset.lon,
+             'lat': dataset.lat, 'altitude': dataset.altitude,
+             'time': dataset.time}
+    for key, top in (('SHR1', 1000.), ('SHR3', 3000.)):
+        table[key] = bulk_shear(u, v, level, top,
+                                min_depth=options['min_depth'])
+    jet = low_level_jet(dataset.HWS.T, level.T, options['jet_top'],
+                        options['falloff_top'], options['min_speed'],
+                        options['min_falloff'])
+    for key, values in zip(('LLJ', 'LLJS', 'LLJH', 'LLJF'), jet):
+        table[key] = values
+    table['BLH'] = mixing_height(dataset.CN2, level, options['blh_bottom'],
+                                 options['blh_top'])
+    return table
+
+
+def to_records(table):
+    '''将表格各列转换为每站一行的字典列表，缺测为None'''
+    columns = []
+    for key in COLUMNS:
+        values = np.asarray(table[key])
+        if values.dtype.kind == 'f':
+            values = np.where(np.isnan(values), None, np.round(values, 4))
+        columns.append(values.tolist())
+    return [dict(zip(COLUMNS, row)) for row in zip(*columns)]
+
+
+def full_station_products(pfn, savepath=None, config=None, qc=False,
+                          levels=None):
+    '''由单个时次的解码文件计算所有站点的垂直产品
+
+    输入参数
+    -------
+    pfn : `str`
+        解码输出的json文件路径
+    savepath : `str`
+        表格保存路径，默认为None，即返回每站一行的字典列表
+    config : `algom.config.Config`
+        配置对象，默认为None，即使用`get_config()`
+    qc : `bool`
+        是否先做质量控制，质控参数取自配置中的'qc'项
+    levels : `algom.levels.LevelSet`
+        垂直插值的目标高度层，默认取配置中的'levels'项
+
+    返回值
+    -----
+    `None` | `list` : 若savepath为None，则返回字典列表，否则保存文件并返回None
+    '''
+    from algom.makegrid import multi_v_interp
+
+    if config is None:
+        config = get_config()
+    if levels is None:
+        levels = LevelSet.from_config(config.get('levels'))
+
+    dataset = multi_v_interp(load_js(pfn, config.exclude), levels)
+    if qc:
+        from algom.qc import apply_qc
+        dataset = apply_qc(dataset, levels.heights, config.get('qc'))
+
+    records = to_records(station_products(dataset, config.get('stnprod'),
+                                          levels.reference))
+    if savepath:
+        save_as_json(records, savepath, mod='multi')
+        return None
+    else:
+        return records
@@ -0,0 +1,213 @@
+# coding:utf-8
+'''
+--------------------------------------------------------------------
+项目名：rwp
+模块名：algom.stnstat
+本模块用于逐时次滚动统计各站点的可靠性，并据此自动生成剔除站点集合
+
+统计量均采用指数滑动方式在线更新，每个时次的更新量与站点数成正比：
+    到报率：站点在各时次是否到报
+    重复率：站点在各时次是否有重复文件
+    新息：站点观测与邻近站点（不含自身）反距离加权估计的风矢量差的
+          均方根，统计其滑动均值与方差
+--------------------------------------------------------------------
+python = 3.6
+依赖库：
+    numpy         $ conda install numpy
+--------------------------------------------------------------------
+'''
+import pickle as pk
+
+import numpy as np
+
+from algom.profile import as_batch
+from algom.wind import sd2uv
+
+
+# 默认阈值，可通过配置文件中的'stnstat'项覆盖
+DEFAULTS = {
+    'alpha': 0.02,           # 指数滑动系数，约对应最近50个时次
+    'min_slots': 30,         # 参与判断所需的最少时次数
+    'min_avail': 0.5,        # 到报率下限
+    'max_dup': 0.5,          # 重复率上限
+    'max_innov': 8.,         # 新息滑动均值上限（m/s）
+}
+
+
+class StationStats(object):
+    '''站点可靠性统计库
+
+    属性
+    ---
+    stations : `list`
+        站号列表，与各统计数组按位置一一对应
+    '''
+    _fields = ('n_slots', 'avail', 'dup', 'n_innov', 'innov_mean',
+               'innov_var')
+
+    def __init__(self, params=None):
+        self.params = dict(DEFAULTS)
+        if params:
+            self.params.update(params)
+        self.stations = []
+        self._index = {}
+        for field in self._fields:
+            setattr(self, field, np.zeros(0))
+
+    def _locate(self, stations):
+        '''获取站号对应的数组位置，新站点追加到数组末尾'''
+        new = [stn for stn in stations if stn not in self._index]
+        if new:
+            for stn in new:
+                self._index[stn] = len(self.stations)
+                self.stations.append(stn)
+            for field in self._fields:
+                old = getattr(self, field)
+                setattr(self, field,
+                        np.concatenate((old, np.zeros(len(new)))))
+        return np.array([self._index[stn] for stn in stations], dtype=int)
+
+    def update_arrivals(self, present, duplicates=()):
+        '''以一个时次的到报情况更新到报率和重复率
+
+        输入参数
+        -------
+        present : `iterable`
+            该时次到报的站号（含被剔除的站点）
+        duplicates : `iterable`
+            该时次存在重复文件的站号
+        '''
+        present = set(present)
+        duplicates = set(duplicates)
+        self._locate(sorted(present | duplicates))
+        alpha = self.params['alpha']
+
+        is_present = np.zeros(len(self.stations))
+        is_present[self._locate(list(present))] = 1.
+        is_dup = np.zeros(len(self.stations))
+        is_dup[self._locate(list(duplicates))] = 1.
+
+        self.n_slots += 1
+        self.avail += alpha * (is_present - self.avail)
+        self.dup += alpha * (is_dup - self.dup)
+        # 新站点首个时次直接以当次值初始化
+        first = self.n_slots == 1
+        self.avail[first] = is_present[first]
+        self.dup[first] = is_dup[first]
+
+    def update_innovations(self, stations, innovations):
+        '''以一个时次的新息更新新息的滑动均值与方差
+
+        输入参数
+        -------
+        stations : `list`
+            站号列表
+        innovations : `ndarray`
+            各站新息（m/s），缺测为np.nan
+        '''
+        innovations = np.asarray(innovations, dtype=np.float64)
+        valid = np.isfinite(innovations)
+        idx = self._locate(list(stations))[valid]
+        x = innovations[valid]
+        alpha = self.params['alpha']
+
+        first = self.n_innov[idx] == 0
+        delta = x - self.innov_mean[idx]
+        mean = np.where(first, x, self.innov_mean[idx] + alpha * delta)
+        var = np.where(first, 0.,
+                       (1 - alpha) * (self.innov_var[idx] + alpha * delta**2))
+        self.innov_mean[idx] = mean
+        self.innov_var[idx] = var
+        self.n_innov[idx] += 1
+
+    def excluded(self):
+        '''根据当前统计量计算动态剔除站点集合
+
+        返回值
+        -----
+        `set` : 需剔除的站号集合
+        '''
+        p = self.params
+        bad = ((self.n_slots >= p['min_slots']) &
+               ((self.avail < p['min_avail']) | (self.dup > p['max_dup'])))
+        bad |= ((self.n_innov >= p['min_slots']) &
+                (self.innov_mean > p['max_innov']))
+
+        return set(stn for stn, flag in zip(self.stations, bad) if flag)
+
+    def summary(self):
+        '''各站统计量汇总，便于写日志或输出报告'''
+        result = {}
+        for n, stn in enumerate(self.stations):
+            result[stn] = {field: float(getattr(self, field)[n])
+                           for field in self._fields}
+        return result
+
+    def save(self, pfn):
+        '''保存统计库'''
+        with open(pfn, 'wb') as file_obj:
+            pk.dump(self, file_obj)
+
+    @classmethod
+    def load(cls, pfn, params=None):
+        '''加载统计库，若文件不存在则新建'''
+        try:
+            with open(pfn, 'rb') as file_obj:
+                stats = pk.load(file_obj)
+        except (FileNotFoundError, EOFError):
+            stats = cls()
+        if params:
+            stats.params.update(params)
+        return stats
+
+
+def slot_innovations(dataset, analysis, params=None):
+    '''计算一个时次各站观测的留一法新息
+
+    以参与格点化的其他站点对该站的反距离加权估计作为背景（不含该站自身，
+    否则插值场几乎复现该站观测，新息失去判别能力），计算各层观测风矢量与
+    背景之差的均方根。
+
+    输入参数
+    -------
+    dataset : `algom.profile.ProfileBatch` | `list`
+        需要统计的多站数据（经`multi_v_interp`处理），通常包括被动态剔除的站点
+    analysis : `algom.profile.ProfileBatch` | `list`
+        参与格点化的多站数据（剔除与质控之后），高度层须与dataset一致
+    params : `dict`
+        反距离加权参数，即配置中的'hinterp'项，见`algom.hinterp.leave_one_out`
+
+    返回值
+    -----
+    `tuple` : (站号列表, 新息数组)
+    '''
+    from algom.hinterp import leave_one_out
+
+    if not len(dataset):
+        return [], np.zeros(0)
+
+    dataset = as_batch(dataset)
+    analysis = as_batch(analysis, dataset.SH)
+    stations = dataset.station.tolist()
+    nlevel = len(dataset.SH)
+
+    # 观测风向为来向，U、V取去向以与格点场一致
+    u_obs, v_obs = sd2uv(dataset.HWS, dataset.HWD, convention='to')
+    u_ana, v_ana = sd2uv(analysis.HWS, analysis.HWD, convention='to')
+
+    position = {stn: n for n, stn in enumerate(analysis.station.tolist())}
+    own = np.array([position.get(stn, -1) for stn in stations], dtype=int)
+    background = leave_one_out(analysis.lon, analysis.lat,
+                               np.hstack((u_ana, v_ana)), dataset.lon,
+                               dataset.lat, own, params)
+    u_bg = background[:, :nlevel]
+    v_bg = background[:, nlevel:]
+
+    sq = (u_obs - u_bg)**2 + (v_obs - v_bg)**2
+    valid = np.isfinite(sq)
+    count = valid.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        innov = np.sqrt(np.where(valid, sq, 0.).sum(axis=1) / count)
+    innov[count == 0] = np.nan
+
+    return stations, innov
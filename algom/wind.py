@@ -0,0 +1,112 @@
+# coding:utf-8
+'''
+--------------------------------------------------------------------
+项目名：rwp
+模块名：algom.wind
+本模块为风矢量转换工具
+
+风向（HWD）一律为气象风向，即风的来向，自正北顺时针计，取值[0,360)。
+U、V分量的方向约定由convention参数显式给出：
+    'to'   : 风的去向，即通常的风矢量（西风U>0，南风V>0），格点产品的U、V
+             均采用此约定
+    'from' : 指向风的来向，与'to'相差一个符号
+各函数均可通过out参数写入预先分配的数组（例如float32数据立方体），
+不产生额外的整块临时数组。
+--------------------------------------------------------------------
+python = 3.6
+依赖库：
+    numpy         $ conda install numpy
+--------------------------------------------------------------------
+'''
+import numpy as np
+
+
+CONVENTIONS = ('to', 'from')
+
+
+def _check(convention):
+    if convention not in CONVENTIONS:
+        raise ValueError('Unknown wind convention: {}'.format(convention))
+
+
+def sd2uv(ws, wd, convention='to', out=None):
+    '''风速风向转换为U、V分量
+
+    输入参数
+    -------
+    ws : `ndarray`
+        风速
+    wd : `ndarray`
+        风向（来向，度）
+    convention : `str`
+        输出U、V的方向约定，'to'或'from'
+    out : `tuple`
+        (u, v)输出数组，默认为None，即新建数组
+
+    返回值
+    -----
+    `tuple` : (u, v)
+    '''
+    _check(convention)
+    rad = np.deg2rad(wd)
+    if out is None:
+        if convention == 'to':
+            ws = -np.asarray(ws)
+        return ws * np.sin(rad), ws * np.cos(rad)
+
+    u, v = out
+    np.sin(rad, out=u)
+    np.cos(rad, out=v)
+    np.multiply(u, ws, out=u)
+    np.multiply(v, ws, out=v)
+    if convention == 'to':
+        np.negative(u, out=u)
+        np.negative(v, out=v)
+
+    return u, v
+
+
+def uv2sd(u, v, convention='to', out=None):
+    '''U、V分量转换为风速风向
+
+    输入参数
+    -------
+    u, v : `ndarray`
+        风矢量分量
+    convention : `str`
+        输入U、V的方向约定，'to'或'from'
+    out : `tuple`
+        (ws, wd)输出数组，默认为None，即新建数组
+
+    返回值
+    -----
+    `tuple` : (ws, wd)，风向为来向，取值[0,360)；缺测（np.nan）的分量对应
+              np.nan
+    '''
+    _check(convention)
+    # 去向转为来向需加180度
+    offset = 180. if convention == 'to' else 0.
+    if out is None:
+        return np.hypot(u, v), (np.rad2deg(np.arctan2(u, v)) + offset) % 360.
+
+    ws, wd = out
+    np.hypot(u, v, out=ws)
+    np.arctan2(u, v, out=wd)
+    np.rad2deg(wd, out=wd)
+    np.add(wd, offset, out=wd)
+    np.mod(wd, 360., out=wd)
+
+    return ws, wd
+
+
+def wrap_direction(delta):
+    '''将风向差值折算到[-180,180)'''
+    return (np.asarray(delta) + 180.) % 360. - 180.
+
+
+def unwrap_direction(wd):
+    '''消除风向廓线在0/360处的跳变，使相邻值之差不超过180度（忽略np.nan）'''
+    wd = np.array(wd, dtype=np.float64)
+    valid = np.isfinite(wd)
+    wd[valid] = np.rad2deg(np.unwrap(np.deg2rad(wd[valid])))
+    return wd
@@ -0,0 +1,333 @@
+# coding:utf-8
+'''
+--------------------------------------------------------------------
+项目名：rwp
+模块名：algom.zstore
+本模块用于将格点产品写入分块压缩的目录式数组存储（Zarr v2格式）
+
+与每个时次一个nc文件不同，各变量按(time, level分块, lat分块, lon分块)切分为
+独立的zlib压缩文件，下游读取单层或小区域时只需读取少量小文件。
+存储按日分区，每天一个独立的Zarr存储，目录名为日期（YYYYmmdd），与其它产品
+目录的结构相同，可直接在'retention'配置中加一条策略按天清理：
+    <path>/<YYYYmmdd>/.zgroup, .zattrs       根组元数据
+    <path>/<YYYYmmdd>/.zmetadata             合并后的全部元数据
+    <path>/<YYYYmmdd>/U/.zarray, .zattrs     数组元数据
+    <path>/<YYYYmmdd>/U/<t>/<k>/<j>/<i>      数据块（嵌套目录）
+每日存储的时间维固定为当日全部时次（自0时起算的序号），新时次只写入本时次的
+数据块；未写入的时次读取时为缺省值。数据块默认为1×1×tile×tile，读取单层时
+只解压该层的数据块；level_chunk可设为多层以减少文件数。数据块按时次、层分目录
+存放，单个目录内的文件数只有水平分块数个。
+格式遵循Zarr v2规范，可直接用zarr或xarray.open_zarr读取。
+--------------------------------------------------------------------
+python = 3.6
+依赖库：
+    numpy         $ conda install numpy
+--------------------------------------------------------------------
+'''
+import os
+import zlib
+import json as js
+from datetime import datetime
+
+import logging
+
+import numpy as np
+
+from algom.errors import OutputError
+
+logger = logging.getLogger('root')
+
+
+VARIABLES = ('U', 'V', 'VWS', 'HWS', 'HWD')
+TIME_UNITS = 'minutes since {:%Y-%m-%d %H:%M:%S}'
+
+
+def _write(pfn, content):
+    '''先写临时文件再替换，避免下游读到不完整的文件'''
+    with open(pfn + '.tmp', 'wb') as f:
+        f.write(content)
+    os.replace(pfn + '.tmp', pfn)
+
+
+def _dumps(meta):
+    return js.dumps(meta, indent=4, sort_keys=True).encode()
+
+
+def array_meta(shape, chunks, dtype, fill_value, level=5):
+    '''Zarr v2数组元数据（.zarray）'''
+    if isinstance(fill_value, float) and np.isnan(fill_value):
+        fill_value = 'NaN'
+    return {'zarr_format': 2,
+            'shape': list(shape),
+            'chunks': list(chunks),
+            'dtype': np.dtype(dtype).str,
+            'compressor': {'id': 'zlib', 'level': level},
+            'fill_value': fill_value,
+            'filters': None,
+            'order': 'C',
+            'dimension_separator': '/'}
+
+
+class ChunkStore(object):
+    '''单日格点产品的分块数组存储
+
+    输入参数
+    -------
+    path : `str`
+        当日存储目录，不存在时在首次写入时创建
+    day : `str`
+        日期字符串（YYYYmmdd），时间维自当日0时起算
+    tile : `int`
+        水平分块大小（格点数）
+    interval : `int`
+        时次间隔（分钟）
+    level : `int`
+        zlib压缩等级
+    fill_value : `float`
+        缺省值
+    level_chunk : `int`
+        每个数据块包含的高度层数，默认为1，None表示全部高度层
+    '''
+    def __init__(self, path, day, tile=32, interval=6, level=5,
+                 fill_value=-9999., level_chunk=1):
+        self.path = path
+        self.start = datetime.strptime(day, '%Y%m%d')
+        self.tile = tile
+        self.interval = interval
+        self.level = level
+        self.fill_value = fill_value
+        self.level_chunk = level_chunk
+        self.meta = None
+        if os.path.exists(os.path.join(path, '.zmetadata')):
+            with open(os.path.join(path, '.zmetadata')) as f:
+                self.meta = js.load(f)['metadata']
+            self.interval = self.meta['.zattrs']['interval']
+
+    @property
+    def nslot(self):
+        return 24 * 60 // self.interval
+
+    def time_index(self, timestr):
+        '''时次在当日时间维上的序号'''
+        delta = datetime.strptime(timestr, '%Y%m%d%H%M') - self.start
+        index, rest = divmod(int(delta.total_seconds()) // 60, self.interval)
+        if index < 0 or index >= self.nslot or rest:
+            raise OutputError('{0} is not a valid slot of store '
+                              '{1}'.format(timestr, self.path))
+        return index
+
+    def _create(self, data_dict, attr_dict, variables):
+        '''由当日首个时次创建存储结构'''
+        nlevel = len(data_dict['level'])
+        nlat = len(data_dict['lat'])
+        nlon = len(data_dict['lon'])
+        tile = self.tile
+        nk = min(self.level_chunk or nlevel, nlevel)
+
+        meta = {'.zgroup': {'zarr_format': 2},
+                '.zattrs': {'tile': tile, 'interval': self.interval,
+                            'start': self.start.strftime('%Y%m%d%H%M')}}
+        for name in variables:
+            meta[name + '/.zarray'] = array_meta(
+                    (self.nslot, nlevel, nlat, nlon), (1, nk, min(tile, nlat),
+                    min(tile, nlon)), '<f4', self.fill_value, self.level)
+            attrs = {key: value for key, value in attr_dict.get(name,
+                     {}).items() if key != 'fill_value'}
+            attrs['_ARRAY_DIMENSIONS'] = ['time', 'level', 'lat', 'lon']
+            meta[name + '/.zattrs'] = attrs
+
+        for name in ('level', 'lat', 'lon'):
+            values = np.asarray(data_dict[name], dtype='<f8')
+            meta[name + '/.zarray'] = array_meta(values.shape, values.shape,
+                                                 '<f8', None, self.level)
+            attrs = dict(attr_dict.get(name, {}))
+            attrs['_ARRAY_DIMENSIONS'] = [name]
+            meta[name + '/.zattrs'] = attrs
+            self._write_chunk(name, '0', values)
+
+        # 时间坐标为当日全部时次，只有一个数据块
+        values = np.arange(self.nslot, dtype='<i8') * self.interval
+        meta['time/.zarray'] = array_meta(values.shape, values.shape, '<i8',
+                                          None, self.level)
+        meta['time/.zattrs'] = {'_ARRAY_DIMENSIONS': ['time'],
+                                'long_name': 'time',
+                                'units': TIME_UNITS.format(self.start),
+                                'calendar': 'standard'}
+        self._write_chunk('time', '0', values)
+        self.meta = meta
+        self._write_meta()
+
+    def _write_chunk(self, name, key, values):
+        pfn = os.path.join(self.path, name, key)
+        folder = os.path.dirname(pfn)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        _write(pfn, zlib.compress(np.ascontiguousarray(values).tobytes(),
+                                  self.level))
+
+    def _write_meta(self):
+        for key, value in self.meta.items():
+            pfn = os.path.join(self.path, key)
+            folder = os.path.dirname(pfn)
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            _write(pfn, _dumps(value))
+        # 合并元数据最后写入，读取方看到的元数据与数据块始终一致
+        _write(os.path.join(self.path, '.zmetadata'),
+               _dumps({'zarr_consolidated_format': 1,
+                       'metadata': self.meta}))
+
+    def append(self, data_dict, attr_dict=None, timestr=None,
+               variables=VARIABLES):
+        '''写入一个时次
+
+        重复写入已有时次（如迟到文件重新插值）时只覆盖该时次的数据块。
+
+        输入参数
+        -------
+        data_dict : `dict`
+            数据字典（`full_interp`返回的格式）
+        attr_dict : `dict`
+            属性字典，仅在创建存储时使用
+        timestr : `str`
+            时次字符串，None时取data_dict['time']
+        variables : `tuple`
+            写入的变量
+
+        返回值
+        -----
+        `int` : 该时次在时间维上的序号
+
+        错误
+        ---
+        OutputError : 时次不属于当日或不在时次间隔上
+        '''
+        if timestr is None:
+            timestr = data_dict['time']
+        index = self.time_index(timestr)
+        if self.meta is None:
+            self._create(data_dict, attr_dict or {}, variables)
+
+        for name in variables:
+            if name + '/.zarray' not in self.meta:
+                continue
+            cube = np.asarray(data_dict[name], dtype='<f4')
+            cube = np.where(np.isnan(cube), np.float32(self.fill_value), cube)
+            _, nk, ny, nx = self.meta[name + '/.zarray']['chunks']
+            nlevel, nlat, nlon = cube.shape
+            for k in range(0, nlevel, nk):
+                for j in range(0, nlat, ny):
+                    for i in range(0, nlon, nx):
+                        block = np.full((nk, ny, nx), self.fill_value, '<f4')
+                        part = cube[k:k + nk, j:j + ny, i:i + nx]
+                        block[:part.shape[0], :part.shape[1],
+                              :part.shape[2]] = part
+                        self._write_chunk(name, '{0}/{1}/{2}/{3}'.format(
+                                    index, k // nk, j // ny, i // nx), block)
+
+        return index
+
+    def read(self, name, timestr, level=None, lat=None, lon=None):
+        '''读取一个时次的某层或某区域，只读取涉及的数据块
+
+        输入参数
+        -------
+        name : `str`
+            变量名
+        timestr : `str`
+            时次字符串
+        level : `int`
+            层序号，None表示全部层
+        lat, lon : `slice`
+            格点序号范围，None表示全部
+
+        返回值
+        -----
+        `numpy.ndarray` : level为None时为(level,lat,lon)，否则为(lat,lon)
+        '''
+        zarray = self.meta[name + '/.zarray']
+        _, nlevel, nlat, nlon = zarray['shape']
+        _, nk, ny, nx = zarray['chunks']
+        index = self.time_index(timestr)
+        levels = list(range(nlevel)) if level is None else [level]
+        lat = slice(0, nlat) if lat is None else slice(*lat.indices(nlat)[:2])
+        lon = slice(0, nlon) if lon is None else slice(*lon.indices(nlon)[:2])
+
+        result = np.full((len(levels), lat.stop - lat.start,
+                          lon.stop - lon.start), self.fill_value, '<f4')
+        for kc in sorted(set(k // nk for k in levels)):
+            rows = [n for n, k in enumerate(levels) if k // nk == kc]
+            inner = [levels[n] - kc * nk for n in rows]
+            for j in range(lat.start // ny, (lat.stop - 1) // ny + 1):
+                for i in range(lon.start // nx, (lon.stop - 1) // nx + 1):
+                    pfn = os.path.join(self.path, name, str(index), str(kc),
+                                       str(j), str(i))
+                    try:
+                        with open(pfn, 'rb') as f:
+                            block = np.frombuffer(zlib.decompress(f.read()),
+                                                  '<f4').reshape(nk, ny, nx)
+                    except FileNotFoundError:
+                        continue
+                    y0, x0 = j * ny, i * nx
+                    ys = slice(max(lat.start, y0), min(lat.stop, y0 + ny))
+                    xs = slice(max(lon.start, x0), min(lon.stop, x0 + nx))
+                    result[rows, ys.start - lat.start:ys.stop - lat.start,
+                              xs.start - lon.start:xs.stop - lon.start] = \
+                        block[inner, ys.start - y0:ys.stop - y0,
+                              xs.start - x0:xs.stop - x0]
+
+        return result if level is None else result[0]
+
+
+class DailyStore(object):
+    '''按日分区的分块数组存储，每天一个ChunkStore
+
+    输入参数
+    -------
+    path : `str`
+        存储根目录，其下为按日期（YYYYmmdd）命名的每日存储
+    cache : `int`
+        保持打开的每日存储个数（迟到时次会写入前一天）
+    **kwargs :
+        传给ChunkStore的其它参数
+    '''
+    def __init__(self, path, cache=2, **kwargs):
+        self.path = path
+        self.cache = cache
+        self.kwargs = kwargs
+        self.stores = {}
+
+    def day_store(self, day):
+        '''某日的存储'''
+        if day not in self.stores:
+            self.stores[day] = ChunkStore(os.path.join(self.path, day), day,
+                                          **self.kwargs)
+            for old in sorted(self.stores)[:-self.cache]:
+                del self.stores[old]
+        return self.stores[day]
+
+    def append(self, data_dict, attr_dict=None, timestr=None,
+               variables=VARIABLES):
+        '''写入一个时次，无效时次只记录日志，不中断调用方
+
+        返回值
+        -----
+        `int` | `None` : 该时次在当日时间维上的序号，无效时次为None
+        '''
+        if timestr is None:
+            timestr = data_dict['time']
+        try:
+            return self.day_store(timestr[:8]).append(data_dict, attr_dict,
+                                                      timestr, variables)
+        except (OutputError, ValueError) as e:
+            message = getattr(e, 'message', str(e))
+            logger.warning('store skipped {0}: {1}'.format(timestr, message))
+            return None
+
+    def read(self, name, timestr, level=None, lat=None, lon=None):
+        '''读取一个时次，参数与ChunkStore.read相同'''
+        store = self.day_store(timestr[:8])
+        if store.meta is None:
+            raise OutputError('No store for {0} in {1}'.format(timestr,
+                                                                self.path))
+        return store.read(name, timestr, level, lat, lon)
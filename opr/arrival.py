@@ -0,0 +1,118 @@
+# coding : utf-8
+'''
+--------------------------------------------------------------------
+项目名：rwp
+模块名：opr.arrival
+本模块用于统计各站点文件的到报时延，并据此给出自适应的时次截止时间
+
+到报时延为文件修改时间与其所属标准时次的时间差。每个站点保留最近若干个时延
+样本（环形缓存），以其分位数作为该站的到报期限。时次的截止策略为：
+    1. 期望站点（近期稳定到报的站点）全部到齐，且已过最短等待时间，则立即截止
+    2. 否则等待至尚未到报的期望站点中最大的p95期限，且不超过最长等待时间
+--------------------------------------------------------------------
+python = 3.6
+--------------------------------------------------------------------
+'''
+import pickle as pk
+from collections import deque
+from datetime import timedelta
+
+
+# 默认参数，可通过配置文件中的'arrival'项覆盖
+DEFAULTS = {
+    'samples': 100,          # 每站保留的时延样本数
+    'min_samples': 10,       # 成为期望站点所需的最少样本数
+    'recent': 10,            # 成为期望站点须在最近多少个时次内到报过
+    'quantile': 95,          # 期限分位数
+    'min_wait': 180,         # 最短等待时间（秒）
+    'max_wait': 600,         # 最长等待时间（秒）
+    'default_wait': 360,     # 无统计样本时的等待时间（秒）
+}
+
+
+class ArrivalStats(object):
+    '''各站到报时延统计'''
+    def __init__(self, params=None):
+        self.params = dict(DEFAULTS)
+        if params:
+            self.params.update(params)
+        self.latency = {}
+        self.last_slot = {}
+        self.nslot = 0
+
+    def add(self, station, latency):
+        '''记录一个到报时延样本（秒）'''
+        try:
+            samples = self.latency[station]
+        except KeyError:
+            samples = self.latency[station] = deque(
+                                            maxlen=int(self.params['samples']))
+        samples.append(latency)
+        self.last_slot[station] = self.nslot
+
+    def close_slot(self):
+        '''一个时次结束'''
+        self.nslot += 1
+
+    def quantile(self, station, q=None):
+        '''站点时延的分位数（秒），无样本时返回None'''
+        samples = self.latency.get(station)
+        if not samples:
+            return None
+        if q is None:
+            q = self.params['quantile']
+        ordered = sorted(samples)
+        n = min(len(ordered) - 1, int(round(q / 100. * (len(ordered) - 1))))
+        return ordered[n]
+
+    def expected(self, exclude=()):
+        '''期望站点集合：样本充足且近期到报过的站点'''
+        p = self.params
+        return set(stn for stn, samples in self.latency.items()
+                   if len(samples) >= p['min_samples'] and
+                   self.nslot - self.last_slot[stn] <= p['recent'] and
+                   stn not in exclude)
+
+    def cutoff(self, arrived, exclude=()):
+        '''当前时次的截止时长
+
+        输入参数
+        -------
+        arrived : `set`
+            已到报的站号
+        exclude : `set`
+            剔除站号
+
+        返回值
+        -----
+        `datetime.timedelta` : 自标准时次起算的截止时长
+        '''
+        p = self.params
+        expected = self.expected(exclude)
+        if not expected:
+            return timedelta(seconds=p['default_wait'])
+
+        waiting = expected - set(arrived)
+        if not waiting:
+            return timedelta(seconds=p['min_wait'])
+
+        deadline = max(self.quantile(stn) for stn in waiting)
+        deadline = min(max(deadline, p['min_wait']), p['max_wait'])
+        return timedelta(seconds=deadline)
+
+    def save(self, pfn):
+        '''保存统计'''
+        with open(pfn, 'wb') as file_obj:
+            pk.dump(self, file_obj)
+
+    @classmethod
+    def load(cls, pfn, params=None):
+        '''加载统计，若文件不存在则新建'''
+        try:
+            with open(pfn, 'rb') as file_obj:
+                stats = pk.load(file_obj)
+        except (FileNotFoundError, EOFError):
+            stats = cls()
+        if params:
+            stats.params.update(params)
+        return stats
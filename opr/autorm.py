@@ -4,6 +4,11 @@
 项目名：rwp
 模块名：opr.autorm
 本模块用于自动删除历史格点数据
+
+保留逻辑已统一到`opr.retention`，本模块保留原有的命令行用法，
+即以单个目录、保留3天的策略运行：
+    $ python autorm.py <target_path> <log_name>
+新部署建议直接运行`opr.retention`，在一个进程中管理所有产品目录。
 --------------------------------------------------------------------
 python = 3.6
 --------------------------------------------------------------------
@@ -11,16 +16,13 @@ python = 3.6
 import sys
 sys.path.append('..')
 
-import shutil as st
-from datetime import datetime, timedelta
-import json as js
-import time
 import os
+from algom.config import get_config
+from opr.retention import Policy, run
 
 target_path, log_name = sys.argv[1], sys.argv[2]
 
-with open('../config.json') as f:
-    config = js.load(f)
+config = get_config('../config.json')
 
 log_path = config['remove']['log_path']+log_name+'/'
 
@@ -28,36 +30,14 @@ if not os.path.exists(log_path):
     os.makedirs(log_path)
 
 import opr.log as log
-logger = log.setup_custom_logger(log_path+'rm','root')
+# 日志选项见log.setup_custom_logger，默认同时输出到标准输出
+log_options = {'console': True}
+log_options.update(config.get('log', {}))
+logger = log.setup_custom_logger(log_path+'rm','root',**log_options)
+
 
 def main(target_path):
-    while True:
-        loop = True
-        dt = datetime.utcnow() - timedelta(days=3)
-        while loop:
-            dt_str = dt.strftime('%Y%m%d')
-            rmpath = target_path + dt_str
-            if os.path.exists(rmpath):
-                try:
-                    st.rmtree(target_path + dt_str)
-                except OSError as e:
-                    print('{0}: failed to remove {1}, '\
-                          'error: OSError, reason: {2}'.format(datetime.utcnow(),
-                                                          dt_str, e))
-                    logger.error(' failed to remove {0}, '\
-                                 'error: OSError, reason: {1}'.format(dt_str, e))
-                else:
-                    print('{0}: successfully removed {1} dir'.format(
-                                                    datetime.utcnow(),dt_str))
-                    logger.info(' successfully removed {} dir'.format(dt_str))
-            else:
-                print('{0}: no dir to remove'.format(datetime.utcnow()))
-                logger.info(' no dir to remove')
-                loop = False
-            dt = dt - timedelta(days=1)
-        print('{0}: sleep for 1 hour'.format(datetime.utcnow()))
-        logger.info(' sleep for 1 hour')
-        time.sleep(3600)
+    run([Policy(target_path, max_age_days=3)])
 
 
 if __name__ == '__main__':
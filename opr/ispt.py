@@ -3,6 +3,13 @@
 项目名：rwp
 模块名：opr.ispt
 本模块用于检查文件情况
+
+解码输出目录每个时次一个json lines文件，每行为一个站点。本模块以增量方式
+跟踪每日240个时次的到报情况：按(修改时间, 大小)识别新出现或被重写的文件
+（解码程序原地写入，迟到文件会重写已有时次，二者都不改变目录的修改时间），
+只处理这些文件。每个文件在逐时次位图和逐站位图中置位，并增量更新到报数、
+缺失时次和逐站到报数；文件被重写时先减去其原有站点再重新计入。状态变化时
+才重写状态文件，且重写频率有上限。
 --------------------------------------------------------------------
 python = 3.6
 --------------------------------------------------------------------
@@ -15,22 +22,189 @@ import time
 import json as js
 from datetime import datetime
 from opr.optools import check_dir, get_today_date
-from opr.optools import standard_time_index
+from algom.config import get_config
+from algom.series import STATION_PATTERN
+from opr.memail import Alerter
 
-with open('../config.json') as f:
-    config = js.load(f)
+config = get_config('../config.json')
 
 ROOT_PATH = config['parse']['oper']['save_path']
-REPORT_PATH = '/mnt/data14/liwt/opr/parse/missing/'
+REPORT_PATH = config['parse']['oper'].get('report_path',
+                                          '/mnt/data14/liwt/opr/parse/missing/')
 check_dir(REPORT_PATH)
 
-def report(missing_set,pfn):
+SLOTS_PER_DAY = 240
+# 状态文件的最短重写间隔（秒）
+STATUS_INTERVAL = config['parse']['oper'].get('status_interval', 30)
+
+
+def slot_number(timestr):
+    '''时次字符串在当日240个时次中的序号'''
+    return (int(timestr[8:10]) * 60 + int(timestr[10:12])) // 6
+
+
+def slot_string(day, number):
+    '''由日期和时次序号得到时次字符串'''
+    minutes = number * 6
+    return '{0}{1:02d}{2:02d}'.format(day, minutes // 60, minutes % 60)
+
+
+class SlotTracker(object):
+    '''单日时次完整性跟踪器
+
+    到报时次数、缺失时次集合和逐站到报数均为随文件事件增量更新的计数，
+    每个文件的处理量只与该文件的站点数有关。
+
+    属性
+    ---
+    day : `str`
+        日期字符串
+    received : `bytearray`
+        逐时次到报位图，长度240
+    counts : `list`
+        逐时次到报站点数
+    stations : `dict`
+        {站号: 逐时次到报位图}
+    totals : `dict`
+        {站号: 到报时次数}
+    '''
+    def __init__(self, day):
+        self.day = day
+        self.received = bytearray(SLOTS_PER_DAY)
+        self.counts = [0] * SLOTS_PER_DAY
+        self.stations = {}
+        self.totals = {}
+        self.n_received = 0
+        self.latest = -1
+        # 已处理的文件及其(修改时间, 大小)
+        self.scanned = {}
+        # 各时次已计入逐站位图的站点，文件重写时据此减去原有计数
+        self.contents = {}
+        self._missing = set([])
+        self._new_missing = []
+        # 缺失时次集合每次变化时加1
+        self.missing_version = 0
+
+    def consume(self, timestr, stations):
+        '''处理一个新文件或重写文件事件
+
+        同一时次再次处理时，先撤销上次计入的站点，再按新的站点列表计入。
+
+        输入参数
+        -------
+        timestr : `str`
+            文件对应的时次字符串
+        stations : `iterable`
+            文件中的站号
+
+        返回值
+        -----
+        `bool` : 状态是否发生变化
+        '''
+        if not timestr.startswith(self.day):
+            return False
+        n = slot_number(timestr)
+        stations = list(stations)
+        if n > self.latest:
+            # 最新时次之前未到报的时次记为缺失
+            for gap in range(self.latest + 1, n):
+                if not self.received[gap]:
+                    self._missing.add(gap)
+                    self._new_missing.append(slot_string(self.day, gap))
+                    self.missing_version += 1
+            self.latest = n
+        if not self.received[n]:
+            self.received[n] = 1
+            self.n_received += 1
+            if n in self._missing:
+                self._missing.discard(n)
+                self.missing_version += 1
+        self.counts[n] = len(stations)
+        for stn in self.contents.get(n, ()):
+            self.stations[stn][n] = 0
+            self.totals[stn] -= 1
+        stations = set(stations)
+        self.contents[n] = stations
+        for stn in stations:
+            try:
+                bitmap = self.stations[stn]
+            except KeyError:
+                bitmap = self.stations[stn] = bytearray(SLOTS_PER_DAY)
+                self.totals[stn] = 0
+            if not bitmap[n]:
+                bitmap[n] = 1
+                self.totals[stn] += 1
+
+        return True
+
+    def missing(self):
+        '''截至最新到报时次，缺失的时次列表'''
+        return [slot_string(self.day, n) for n in sorted(self._missing)]
+
+    def new_missing(self):
+        '''自上次调用以来新出现的缺失时次列表'''
+        new, self._new_missing = self._new_missing, []
+        return [slot for slot in new
+                if slot_number(slot) in self._missing]
+
+    def station_missing(self, station):
+        '''截至最新到报时次，指定站点缺失的时次列表'''
+        bitmap = self.stations.get(station, bytearray(SLOTS_PER_DAY))
+        return [slot_string(self.day, n) for n in range(self.latest + 1)
+                if self.received[n] and not bitmap[n]]
+
+    def status(self):
+        '''完整性状态，可直接输出为json'''
+        expected = self.latest + 1
+        return {
+            'day': self.day,
+            'updated': datetime.utcnow().strftime('%Y%m%d%H%M%S'),
+            'latest': slot_string(self.day, self.latest)
+                      if self.latest >= 0 else None,
+            'received': self.n_received,
+            'missing': self.missing(),
+            'counts': self.counts[:expected],
+            'stations': dict(self.totals),
+        }
+
+
+def changed_files(path, tracker):
+    '''目录中新出现或发生变化的时次文件（按名称排序），并记录其状态
+
+    文件按(修改时间, 大小)判断是否变化，与`algom.series.DayIndex.update`
+    相同；写入中途被读到的文件在写完后会再次返回。
+    '''
+    try:
+        entries = list(os.scandir(path))
+    except FileNotFoundError:
+        return []
+    changed = []
+    for entry in entries:
+        if not entry.name.endswith('.json'):
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if tracker.scanned.get(entry.name) != stamp:
+            tracker.scanned[entry.name] = stamp
+            changed.append(entry.name)
+    return sorted(changed)
+
+
+def read_stations(pfn):
+    '''读取时次文件中的站号，只匹配站号字段而不解码整行'''
+    with open(pfn, 'rb') as f:
+        return [match.group(1).decode() for match in
+                (STATION_PATTERN.search(line) for line in f) if match]
+
+
+def report(missing_list,pfn):
     '''生成缺失文件报告'''
     now = datetime.utcnow().strftime('%Y%m%d%H%M%S')
     content = ['record\'s utc time:\n\n    {}\n\n'.format(now),
                'missing files are as follow:\n\n']
-    missing_list = list(missing_set)
-    missing_list.sort()
     for m in missing_list:
         content.append('    {}\n'.format(m))
     content.append('\n')
@@ -41,35 +215,47 @@ def report(missing_set,pfn):
     return True
 
 
+def write_status(tracker, pfn):
+    '''写入json状态文件（先写临时文件再替换，避免读到不完整的文件）'''
+    with open(pfn + '.tmp', 'w') as f:
+        js.dump(tracker.status(), f)
+    os.replace(pfn + '.tmp', pfn)
+
+
 def main():
-    missing_set = set([])
+    # 配置了'email'项时，新出现的缺失时次通过异步告警汇总发送
+    alerter = Alerter.from_config(config) if 'email' in config else None
+    tracker = None
+    dirty = False
+    last_write = 0.
+    reported = 0
     while True:
-
-        std_index = standard_time_index()
         today = get_today_date()
+        if tracker is None or tracker.day != today:
+            if tracker is not None and dirty:
+                write_status(tracker, REPORT_PATH + '%s.json' % tracker.day)
+            tracker = SlotTracker(today)
+            dirty = False
+            reported = 0
 
-        fold = today
-        path = ROOT_PATH + fold + '/'
+        path = ROOT_PATH + today + '/'
+        for fn in changed_files(path, tracker):
+            stations = read_stations(path + fn)
+            dirty |= tracker.consume(fn.split('.')[0], stations)
 
-        try:
-            filenames = os.listdir(path)
-        except FileNotFoundError:
-            time.sleep(5)
-            continue
-        else:
-            indexs = sorted([fn.split('.')[0] for fn in filenames])
-            last_time = indexs[-1]
-
-        dampoint = std_index.index(last_time)
-        if dampoint < len(std_index)-1:
-            std_set = set(std_index[:dampoint+1])
-        else:
-            std_set = set(std_index)
-        opr_set = set(indexs)
-        diff_set = std_set - opr_set
-        if diff_set:
-            missing_set.update(diff_set)
-            report(missing_set,REPORT_PATH+'%s.txt' % today)
+        if tracker.missing_version != reported:
+            report(tracker.missing(), REPORT_PATH + '%s.txt' % today)
+            reported = tracker.missing_version
+        new_missing = tracker.new_missing()
+        if alerter is not None:
+            for slot in new_missing:
+                alerter.alert('missing', slot)
+
+        # 状态文件只在计数变化时重写，且写入频率不超过STATUS_INTERVAL
+        if dirty and time.time() - last_write >= STATUS_INTERVAL:
+            write_status(tracker, REPORT_PATH + '%s.json' % today)
+            last_write = time.time()
+            dirty = False
 
         time.sleep(5)
 
@@ -4,24 +4,171 @@
 项目名：wpr
 模块名：log
 日志模块
+
+默认为同步写文件。异步模式下，日志记录经QueueHandler放入队列后立即返回，
+由后台线程成批取出写入文件（每批只写一次、刷新一次），业务循环不会因写日志
+而阻塞。
+结构化字段：logger.info(' finished', extra=kv(slot='201810011200', n=52))
+    输出为 "... finished slot=201810011200 n=52"
+抽样：带有extra=sample()的逐文件日志只保留每sample_rate条中的1条。
 --------------------------------------------------------------------
 python = 3.6
 --------------------------------------------------------------------
 '''
-import logging
+import sys
 import time
-from logging.handlers import TimedRotatingFileHandler
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import TimedRotatingFileHandler, QueueHandler
+
+
+def kv(**fields):
+    '''构造结构化字段，作为日志调用的extra参数'''
+    return {'kv': fields}
+
+
+def sample(**fields):
+    '''构造可抽样的日志的extra参数，可同时附带结构化字段'''
+    return {'sample': True, 'kv': fields}
+
+
+class KeyValueFormatter(logging.Formatter):
+    '''在日志消息之后追加key=value形式的结构化字段'''
+    def format(self, record):
+        message = super(KeyValueFormatter, self).format(record)
+        fields = getattr(record, 'kv', None)
+        if fields:
+            message += ' ' + ' '.join('{0}={1}'.format(key, value)
+                                      for key, value in fields.items())
+        return message
+
+
+class SampleFilter(logging.Filter):
+    '''对标记为可抽样的日志每rate条只保留1条，未标记的日志不受影响'''
+    def __init__(self, rate):
+        super(SampleFilter, self).__init__()
+        self.rate = max(int(rate), 1)
+        self.count = 0
+
+    def filter(self, record):
+        if not getattr(record, 'sample', False):
+            return True
+        self.count += 1
+        return (self.count - 1) % self.rate == 0
 
-def setup_custom_logger(log_path,name):
 
-    formatter = logging.Formatter(fmt='%(asctime)s:%(levelname)s:%(message)s')
+class BatchFileHandler(TimedRotatingFileHandler):
+    '''支持成批写入的按日滚动文件处理器'''
+    def handle_batch(self, records):
+        records = [record for record in records
+                   if record.levelno >= self.level and self.filter(record)]
+        if not records:
+            return
+        self.acquire()
+        try:
+            if self.shouldRollover(records[0]):
+                self.doRollover()
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(''.join(self.format(record) + self.terminator
+                                      for record in records))
+            self.flush()
+        finally:
+            self.release()
+
+
+class BatchQueueListener(object):
+    '''后台线程，成批取出队列中的日志记录交给各处理器'''
+    _sentinel = None
+
+    def __init__(self, record_queue, handlers, batch=100):
+        self.queue = record_queue
+        self.handlers = handlers
+        self.batch = batch
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self.queue.put_nowait(self._sentinel)
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        stop = False
+        while not stop:
+            records = [self.queue.get()]
+            while len(records) < self.batch:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = self._sentinel in records
+            records = [record for record in records
+                       if record is not self._sentinel]
+            for handler in self.handlers:
+                if hasattr(handler, 'handle_batch'):
+                    handler.handle_batch(records)
+                else:
+                    for record in records:
+                        if record.levelno >= handler.level:
+                            handler.handle(record)
+
+
+def setup_custom_logger(log_path,name,async_mode=False,console=False,
+                        sample_rate=1,batch=100):
+    '''配置日志
+
+    输入参数
+    -------
+    log_path : `str`
+        日志文件路径（不含日期后缀）
+    name : `str`
+        日志名称
+    async_mode : `bool`
+        是否使用异步队列写日志，默认为False
+    console : `bool`
+        是否同时输出到标准输出，默认为False
+    sample_rate : `int`
+        可抽样日志（extra=sample()）的抽样间隔，默认为1，即不抽样
+    batch : `int`
+        异步模式下每批最多写入的记录数
+
+    返回值
+    -----
+    `logging.Logger`
+    '''
+    formatter = KeyValueFormatter(fmt='%(asctime)s:%(levelname)s:%(message)s')
     formatter.converter = time.gmtime
-    handler = TimedRotatingFileHandler(log_path, utc=True,
-                                       when='midnight')
+    handler = BatchFileHandler(log_path, utc=True, when='midnight')
     handler.suffix = '%Y%m%d.log'
     handler.setFormatter(formatter)
+    handlers = [handler]
+    if console:
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(formatter)
+        handlers.append(console_handler)
+
     logger = logging.getLogger(name)
     logger.setLevel(logging.INFO)
-    logger.addHandler(handler)
+
+    if async_mode:
+        record_queue = queue.Queue(-1)
+        queue_handler = QueueHandler(record_queue)
+        queue_handler.addFilter(SampleFilter(sample_rate))
+        logger.addHandler(queue_handler)
+        listener = BatchQueueListener(record_queue, handlers, batch)
+        listener.start()
+        # 进程退出前写完队列中剩余的日志
+        atexit.register(listener.stop)
+    else:
+        for hdl in handlers:
+            hdl.addFilter(SampleFilter(sample_rate))
+            logger.addHandler(hdl)
 
     return logger
@@ -3,17 +3,41 @@
 项目名：rwp
 模块名：opr.memail
 本模块主要用于邮件发送
+
+send_email为同步发送单封邮件。业务程序中的告警应使用Alerter：告警调用只把
+告警放入队列后立即返回，由后台线程按固定间隔将期间的全部告警汇总为一封邮件
+发送，同一告警键在同一间隔内重复出现只计数不重复发送，SMTP连接在各次发送之间
+复用。
 --------------------------------------------------------------------
 python = 3.6
 --------------------------------------------------------------------
 '''
 import sys
+import time
+import queue
+import logging
 import smtplib
+import threading
+from collections import OrderedDict
+from datetime import datetime
 from email.mime.text import MIMEText
 from email.header import Header
 import json as js
 
 
+logger = logging.getLogger('root')
+
+
+def build_message(title, content, sender_name='preskymonitor',
+                  receiver_name='debugger'):
+    '''构造邮件'''
+    message = MIMEText(content, 'plain', 'utf-8')
+    message['From'] = Header(sender_name, 'utf-8')
+    message['To'] =  Header(receiver_name, 'utf-8')
+    message['Subject'] = Header(title, 'utf-8')
+    return message
+
+
 # 第三方 SMTP 服务
 def send_email(title,content,configpath):
     '''发送邮件
@@ -31,40 +55,191 @@ def send_email(title,content,configpath):
     -----
     `bool` 若发送成功则返回True，否则返回False
     '''
-
-    receiver_name = 'debugger'
-    sender_name = 'preskymonitor'
-
     with open(configpath) as f:
         config = js.load(f)
 
     mail_host=config['email']['send_host']  # 设置服务器
     mail_user=config['email']['account']    # 用户名
     mail_pass=config['email']['password']   # 密码
+    mail_port=config['email'].get('port', 25)
 
     sender = config['email']['account']
     receivers = [config['email']['receive_address']]
 
-    message = MIMEText(content, 'plain', 'utf-8')
-    message['From'] = Header(sender_name, 'utf-8')
-    message['To'] =  Header(receiver_name, 'utf-8')
-
-    subject = title
-    message['Subject'] = Header(subject, 'utf-8')
-
+    message = build_message(title, content)
 
     try:
         smtpObj = smtplib.SMTP()
-        smtpObj.connect(mail_host, 25)    # 25 为 SMTP 端口号
+        smtpObj.connect(mail_host, mail_port)    # 默认25为 SMTP 端口号
         smtpObj.login(mail_user,mail_pass)
         smtpObj.sendmail(sender, receivers, message.as_string())
-        print("邮件发送成功")
+        logger.info(' email sent: {}'.format(title))
         return True
 
-    except smtplib.SMTPException:
-        print("Error: 无法发送邮件")
+    except smtplib.SMTPException as e:
+        logger.error(' failed to send email {0}: {1}'.format(title, e))
         return False
 
+
+class Alerter(object):
+    '''异步告警发送器
+
+    输入参数
+    -------
+    host : `str`
+        SMTP服务器
+    port : `int`
+        SMTP端口
+    sender : `str`
+        发件地址
+    receivers : `list`
+        收件地址列表
+    user : `str`
+        登录用户名，None表示不登录（例如本地测试用的SMTP服务）
+    password : `str`
+        登录密码
+    interval : `float`
+        汇总发送间隔（秒），每个间隔最多发送一封邮件
+    subject : `str`
+        汇总邮件标题前缀
+    '''
+    def __init__(self, host, port, sender, receivers, user=None,
+                 password=None, interval=600, subject='rwp alerts'):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.receivers = list(receivers)
+        self.user = user
+        self.password = password
+        self.interval = interval
+        self.subject = subject
+        self.sent = 0
+        self._queue = queue.Queue()
+        self._pending = OrderedDict()
+        self._smtp = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_config(cls, config):
+        '''由配置中的'email'项构建告警发送器'''
+        email = config['email']
+        return cls(email['send_host'], email.get('port', 25),
+                   email['account'], [email['receive_address']],
+                   email.get('account') if email.get('login', True) else None,
+                   email.get('password'), email.get('interval', 600),
+                   email.get('subject', 'rwp alerts'))
+
+    def alert(self, key, content):
+        '''提交告警，立即返回
+
+        输入参数
+        -------
+        key : `str`
+            告警键，同一间隔内相同键的告警合并计数，例如'missing'
+        content : `str`
+            告警内容
+        '''
+        self._queue.put((key, content, datetime.utcnow()))
+
+    def _collect(self, timeout):
+        '''在timeout秒内从队列收集告警，按告警键去重合并'''
+        deadline = time.time() + timeout
+        while True:
+            remain = deadline - time.time()
+            if remain <= 0 or self._stop.is_set():
+                break
+            try:
+                key, content, dt = self._queue.get(timeout=min(remain, 1.))
+            except queue.Empty:
+                continue
+            self._merge(key, content, dt)
+        # 停止时把队列中剩余的告警也并入
+        while True:
+            try:
+                self._merge(*self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+    def _merge(self, key, content, dt):
+        try:
+            item = self._pending[key]
+        except KeyError:
+            self._pending[key] = {'first': dt, 'last': dt, 'count': 1,
+                                  'contents': [content]}
+        else:
+            item['last'] = dt
+            item['count'] += 1
+            if content not in item['contents']:
+                item['contents'].append(content)
+
+    def digest(self):
+        '''将当前累计的告警汇总为邮件正文'''
+        lines = []
+        for key, item in self._pending.items():
+            lines.append('[{0}] x{1}, {2} ~ {3} (UTC)'.format(
+                key, item['count'],
+                item['first'].strftime('%Y-%m-%d %H:%M:%S'),
+                item['last'].strftime('%Y-%m-%d %H:%M:%S')))
+            for content in item['contents']:
+                lines.append('    {}'.format(content))
+            lines.append('')
+        return '\n'.join(lines)
+
+    def _connect(self):
+        '''获取SMTP连接，已有连接可用时直接复用'''
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except smtplib.SMTPException:
+                pass
+            except OSError:
+                pass
+            self._close_smtp()
+        smtp = smtplib.SMTP(self.host, self.port, timeout=30)
+        if self.user:
+            smtp.login(self.user, self.password)
+        self._smtp = smtp
+        return smtp
+
+    def _close_smtp(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
+
+    def _send_digest(self):
+        if not self._pending:
+            return
+        title = '{0}: {1}'.format(self.subject, ', '.join(self._pending))
+        message = build_message(title, self.digest())
+        try:
+            smtp = self._connect()
+            smtp.sendmail(self.sender, self.receivers, message.as_string())
+        except (smtplib.SMTPException, OSError) as e:
+            # 发送失败时保留告警，下一间隔重试
+            logger.error(' failed to send alert email: {}'.format(e))
+            self._close_smtp()
+        else:
+            self.sent += 1
+            self._pending.clear()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._collect(self.interval)
+            self._send_digest()
+        self._close_smtp()
+
+    def close(self):
+        '''发送剩余告警并停止后台线程'''
+        self._stop.set()
+        self._thread.join()
+
+
 if __name__ == '__main__':
     title, content = sys.argv[1], sys.argv[2]
-    send_email(title,content)
+    send_email(title,content,'../config.json')
@@ -13,17 +13,24 @@ sys.path.append('..')
 
 import os
 import time
-import json as js
 import traceback
 import shutil as st
-from datetime import datetime, timedelta
 import optools as opt
 import algom.makegrid as mkg
+import algom.aggregate as agg
+import algom.diagnose as dgn
+import algom.stnprod as stp
+from algom.gapfill import SlotBuffer, SYNTHETIC_ATTR
+from algom.io import save_as_nc, save_as_json
+from algom.zstore import DailyStore
+from algom.slices import SliceExporter
+from algom.stnstat import StationStats
+from algom.levels import LevelSet
+from algom.config import get_config
 
 
 # 加载配置文件
-with open('../config.json') as f:
-    config = js.load(f)
+config = get_config('../config.json')
 
 
 # 判断测试模式还是业务模式
@@ -35,6 +42,12 @@ except IndexError:
     SAVE_PATH = config['mkgrd']['oper']['save_path']
     PRESET_PATH = config['mkgrd']['oper']['preset_path']
     BUFFER_PATH = config['mkgrd']['oper']['buffer_path']
+    AGG_PATH = config['mkgrd']['oper'].get('aggregate_path')
+    STORE_PATH = config['mkgrd']['oper'].get('store_path')
+    STORE_LEVEL_CHUNK = config['mkgrd']['oper'].get('store_level_chunk', 1)
+    SLICE_PATH = config['mkgrd']['oper'].get('slice_path')
+    DIAG_PATH = config['mkgrd']['oper'].get('diag_path')
+    STATION_PATH = config['mkgrd']['oper'].get('station_path')
 else:
     if test_flag == 'test1':
         ROOT_PATH = config['parse']['oper']['save_path']
@@ -42,12 +55,26 @@ else:
         SAVE_PATH = config['mkgrd']['test']['save_path']
         PRESET_PATH = config['mkgrd']['test']['preset_path']
         BUFFER_PATH = config['mkgrd']['test']['buffer_path']
+        AGG_PATH = config['mkgrd']['test'].get('aggregate_path')
+        STORE_PATH = config['mkgrd']['test'].get('store_path')
+        STORE_LEVEL_CHUNK = config['mkgrd']['test'].get('store_level_chunk',
+                                                          1)
+        SLICE_PATH = config['mkgrd']['test'].get('slice_path')
+        DIAG_PATH = config['mkgrd']['test'].get('diag_path')
+        STATION_PATH = config['mkgrd']['test'].get('station_path')
     elif test_flag == 'test2':
         ROOT_PATH = config['parse']['test']['save_path']
         LOG_PATH = config['mkgrd']['test']['log_path']
         SAVE_PATH = config['mkgrd']['test']['save_path']
         PRESET_PATH = config['mkgrd']['test']['preset_path']
         BUFFER_PATH = config['mkgrd']['test']['buffer_path']
+        AGG_PATH = config['mkgrd']['test'].get('aggregate_path')
+        STORE_PATH = config['mkgrd']['test'].get('store_path')
+        STORE_LEVEL_CHUNK = config['mkgrd']['test'].get('store_level_chunk',
+                                                          1)
+        SLICE_PATH = config['mkgrd']['test'].get('slice_path')
+        DIAG_PATH = config['mkgrd']['test'].get('diag_path')
+        STATION_PATH = config['mkgrd']['test'].get('station_path')
     else:
         raise ValueError('Unkown flag')
 
@@ -57,16 +84,48 @@ opt.check_dir(LOG_PATH)
 opt.check_dir(PRESET_PATH)
 opt.check_dir(SAVE_PATH)
 opt.check_dir(BUFFER_PATH)
+if AGG_PATH:
+    opt.check_dir(AGG_PATH)
+if DIAG_PATH:
+    opt.check_dir(DIAG_PATH)
+if STATION_PATH:
+    opt.check_dir(STATION_PATH)
 
 
 # 配置日志信息
 import log
-logger = log.setup_custom_logger(LOG_PATH+'wprd','root')
+# 日志选项见log.setup_custom_logger，默认同时输出到标准输出
+log_options = {'console': True}
+log_options.update(config.get('log', {}))
+logger = log.setup_custom_logger(LOG_PATH+'wprd','root',**log_options)
 
 
-def main(rootpath, bufferpath, outpath):
+def publish(data_dict, attr_dict, bufferpfn, savepfn, global_attr=None):
+    '''保存nc文件
+
+    为防止nc文件在写入的时候被下游程序读取并造成未知错误，
+      因此先将输出的文件保存到缓存文件夹，
+      在输出完成以后再将文件复制到目标文件夹，并清除缓存中的文件，
+      经过测试，shutil的复制时间在0.015s的时间量级，
+      因此下游程序程序在本程序复制文件期间读取数据的可能性微乎其微。
+    '''
+    save_as_nc(data_dict, attr_dict, bufferpfn, global_attr)
+    st.copy(bufferpfn,savepfn)
+    os.remove(bufferpfn)
+
+
+def publish_stations(dataset, levels, config, bufferpfn, savepfn):
+    '''由廓线批计算站点垂直产品并保存，与publish相同先写入缓存文件夹'''
+    table = stp.station_products(dataset, config.get('stnprod'),
+                                 levels.reference)
+    save_as_json(stp.to_records(table), bufferpfn, mod='multi')
+    opt.check_dir(os.path.dirname(savepfn) + '/')
+    st.copy(bufferpfn, savepfn)
+    os.remove(bufferpfn)
+
+
+def main(rootpath, bufferpath, outpath, config):
     try:
-        print('Initial')
         logger.info(' Initial')
 
         folds = os.listdir(rootpath)
@@ -74,41 +133,142 @@ def main(rootpath, bufferpath, outpath):
         fold = folds[-1]
         opt.init_preset(PRESET_PATH+'mg.pk')
 
+        # 站点可靠性统计库，用于动态剔除不可靠站点
+        stats_pfn = PRESET_PATH + 'stnstat.pk'
+        stats = StationStats.load(stats_pfn, config.get('stnstat'))
+
+        # 最近时次格点产品的环形缓存，用于插补缺失时次
+        slot_buffer = SlotBuffer()
+
+        # 半小时、一小时平均产品的滚动累计器
+        aggregators = {}
+        if AGG_PATH:
+            aggregators = {30: agg.SlotAggregator(30),
+                           60: agg.SlotAggregator(60)}
+
+        # 按日分区的分块数组存储，供按层、按区域读取的下游使用
+        store = DailyStore(STORE_PATH, level_chunk=STORE_LEVEL_CHUNK) \
+                if STORE_PATH else None
+
+        # 前端使用的逐层切片
+        exporter = SliceExporter(SLICE_PATH) if SLICE_PATH else None
+
+        # 已处理的最新时次，早于它的新文件（迟到后才生成的整时次）按重新插值处理
+        latest = None
+
         while True:
+            config.reload()
             fold = sorted(os.listdir(rootpath))[-1]
-            newfiles = opt.get_new_files(fold,ROOT_PATH,PRESET_PATH,'mg.pk')
+            # 迟到文件会使解码程序重写已处理时次的文件，此类文件需重新插值
+            newfiles, updated = opt.get_changed_files(fold,ROOT_PATH,
+                                                      PRESET_PATH,'mg.pk')
+            newfiles = sorted(newfiles + updated)
             foldpath = rootpath + fold + '/'
             savepath = outpath + fold + '/'
             opt.check_dir(savepath)
             if newfiles:
-                print('dir {0} has new file:'.format(fold))
                 logger.info(' dir {0} has new file:'.format(fold))
                 for fn in newfiles:
-                    print('\t{0}'.format(fn))
-                    logger.info(' {0}'.format(fn))
-                print('processing...')
+                    logger.info(' new file', extra=log.sample(file=fn))
                 logger.info(' processing...')
                 for fn in newfiles:
-                    # 为防止nc文件在写入的时候被下游程序读取并造成未知错误，
-                    #   因此先将输出的文件保存到缓存文件夹，
-                    #   在输出完成以后再将文件复制到目标文件夹，并清除缓存中的文件，
-                    #   经过测试，shutil的复制时间在0.015s的时间量级，
-                    #   因此下游程序程序在本程序复制文件期间读取数据的可能性微乎其微。
-                    savepfn = savepath + fn.split('.')[0] + '.nc'
-                    bufferpfn = bufferpath + fn.split('.')[0] + '.nc'
-                    mkg.full_interp(foldpath + fn, savepath=bufferpfn)
-                    st.copy(bufferpfn,savepfn)
-                    os.remove(bufferpfn)
-                    print('{0} finished'.format(fn))
-                    logger.info(' {0} finished'.format(fn))
+                    timestr = fn.split('.')[0]
+                    # 重写的文件，以及早于已处理最新时次的新文件（整时次缺失后
+                    # 由迟到文件生成）均为迟到时次：只重新插值并更新输出，不再
+                    # 计入统计库，也不参与插补和时段累计，以免时次乱序
+                    regrid = fn in updated or \
+                             (latest is not None and timestr <= latest)
+                    # 解码文件只读取、垂直插值和质控一次，站点产品与格点化共用
+                    levels = LevelSet.from_config(config.get('levels'))
+                    batch = mkg.prepare_batch(foldpath + fn, config=config,
+                                              qc=True, stats=stats,
+                                              levels=levels)
+
+                    # 站点垂直产品直接由廓线批计算，不经过格点化；其失败
+                    # 不影响格点化，反之亦然
+                    if STATION_PATH:
+                        try:
+                            publish_stations(batch[1], levels, config,
+                                             bufferpath + timestr +
+                                             '_stn.json', STATION_PATH +
+                                             timestr[:8] + '/' + timestr +
+                                             '.json')
+                        except Exception:
+                            logger.error(traceback.format_exc())
+
+                    data_dict, attr_dict = mkg.full_interp(foldpath + fn,
+                                                           config=config,
+                                                           qc=True,
+                                                           stats=stats,
+                                                           update_stats=not
+                                                           regrid,
+                                                           levels=levels,
+                                                           batch=batch)
+                    if regrid:
+                        logger.info(' {} is late, regridded'.format(timestr))
+                    else:
+                        latest = timestr
+                        stats.save(stats_pfn)
+
+                    # 与上一时次之间存在缺失时，先以前后时次插补缺失时次
+                    if regrid:
+                        slots = []
+                    else:
+                        slots = slot_buffer.add(timestr, data_dict)
+                    for fill_time, fill_dict in slots:
+                        logger.info(' {0} is missing, filled by '
+                                    'interpolation'.format(fill_time))
+                    slots.append((timestr, data_dict))
+
+                    for slot_time, slot_dict in slots:
+                        synthetic = slot_dict is not data_dict
+                        slotpath = outpath + slot_time[:8] + '/'
+                        opt.check_dir(slotpath)
+                        publish(slot_dict, attr_dict,
+                                bufferpath + slot_time + '.nc',
+                                slotpath + slot_time + '.nc',
+                                SYNTHETIC_ATTR if synthetic else None)
+                        if store is not None:
+                            store.append(slot_dict, attr_dict, slot_time)
+                        if exporter is not None:
+                            exporter.export(slot_dict, slot_time, synthetic)
+                        # 诊断量的失败（如配置变更后气层内高度层不足）只记录
+                        # 日志，不影响格点产品
+                        if DIAG_PATH:
+                            try:
+                                diagpath = DIAG_PATH + slot_time[:8] + '/'
+                                opt.check_dir(diagpath)
+                                diag_dict, diag_attr = dgn.slot_diagnostics(
+                                            slot_dict, config.get('diagnose'),
+                                            levels.reference)
+                                publish(diag_dict, diag_attr,
+                                        bufferpath + slot_time + '_diag.nc',
+                                        diagpath + slot_time + '.nc',
+                                        SYNTHETIC_ATTR if synthetic else None)
+                            except Exception:
+                                logger.error(traceback.format_exc())
+                        logger.info(' {0} finished'.format(slot_time))
+
+                        if regrid:
+                            continue
+                        for window, aggregator in aggregators.items():
+                            products = aggregator.add(slot_dict, slot_time)
+                            for endstr, product in products:
+                                aggpath = AGG_PATH + '{0}min/{1}/'.format(
+                                                          window, endstr[:8])
+                                opt.check_dir(aggpath)
+                                publish(product, agg.get_attr_dict(window),
+                                        bufferpath + endstr + '.nc',
+                                        aggpath + endstr + '.nc')
+                                logger.info(' {0}min mean {1} '
+                                            'finished'.format(window, endstr))
 
             time.sleep(5)
     except:
         traceback_message = traceback.format_exc()
-        print(traceback_message)
         logger.info(traceback_message)
         exit()
 
 
 if __name__ == '__main__':
-    main(ROOT_PATH, BUFFER_PATH, SAVE_PATH)
+    main(ROOT_PATH, BUFFER_PATH, SAVE_PATH, config)
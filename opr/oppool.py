@@ -0,0 +1,163 @@
+# coding : utf-8
+'''
+--------------------------------------------------------------------
+项目名：rwp
+模块名：opr.oppool
+该模块为常驻的格点化工作进程池服务
+
+短时批处理任务每次启动都要重新导入pandas、scipy、netCDF4并构建网格，
+本服务将这些开销留在常驻的工作进程中：进程池启动时完成预热（导入重型模块、
+构建网格坐标），此后通过本地socket接收单时次任务，插值所需的三角剖分等缓存
+也在工作进程中跨任务复用。
+
+任务为字典格式：
+    {'kind': 'mkgrd' | 'shear' | 'divg' | 'kinematics', 'pfn': 输入文件, 'savepath': 输出文件}
+
+客户端调用示例：
+    from opr.oppool import submit
+    submit({'kind':'mkgrd', 'pfn':pfn, 'savepath':savepfn},
+           ('127.0.0.1', 6100), b'rwp')
+--------------------------------------------------------------------
+python = 3.6
+--------------------------------------------------------------------
+'''
+import sys
+sys.path.append('..')
+
+import threading
+import traceback
+from multiprocessing import Pool
+from multiprocessing.connection import Listener, Client
+from algom.config import get_config
+
+
+def warm_up(config_path='../config.json'):
+    '''工作进程初始化：预先导入重型模块、加载配置并构建网格坐标'''
+    import pandas
+    import netCDF4
+    import scipy.interpolate
+    import algom.makegrid as mkg
+    import algom.shear
+    import algom.diverge
+    mkg.grid_geometry()
+    get_config(config_path).content
+
+
+def run_job(job, config_path='../config.json'):
+    '''在工作进程中执行单个时次任务
+
+    输入参数
+    -------
+    job : `dict`
+        任务字典，须包含'kind','pfn','savepath'三个键
+    config_path : `str`
+        配置文件路径，配置在工作进程内只加载一次，文件变化时自动重载
+
+    返回值
+    -----
+    `dict` : 任务结果，{'status':'ok'|'error', 'message':`str`}
+    '''
+    try:
+        kind = job['kind']
+        config = get_config(config_path)
+        config.reload()
+        if kind == 'mkgrd':
+            import algom.makegrid as mkg
+            mkg.full_interp(job['pfn'], method=job.get('method','linear'),
+                            savepath=job['savepath'], config=config)
+        elif kind == 'shear':
+            import algom.shear as shr
+            shr.full_wind_shear(job['pfn'], job['savepath'])
+        elif kind == 'divg':
+            import algom.diverge as dvg
+            dvg.full_uv_divgs(job['pfn'], savepath=job['savepath'])
+        elif kind == 'kinematics':
+            import algom.kinematics as kmt
+            kmt.full_kinematics(job['pfn'], savepath=job['savepath'])
+        else:
+            raise ValueError('Unkown job kind: {}'.format(kind))
+    except:
+        return {'status':'error', 'message':traceback.format_exc()}
+    else:
+        return {'status':'ok', 'message':job['savepath']}
+
+
+def submit(job, address, authkey):
+    '''向进程池服务提交任务并等待结果
+
+    输入参数
+    -------
+    job : `dict`
+        任务字典
+    address : `tuple`
+        服务地址，例如('127.0.0.1', 6100)
+    authkey : `bytes`
+        认证密钥
+
+    返回值
+    -----
+    `dict` : 任务结果
+    '''
+    with Client(tuple(address), authkey=authkey) as conn:
+        conn.send(job)
+        result = conn.recv()
+
+    return result
+
+
+def serve(address, authkey, workers=4, config_path='../config.json'):
+    '''启动进程池服务，每个连接由单独线程转交给进程池处理
+
+    输入参数
+    -------
+    address : `tuple`
+        监听地址
+    authkey : `bytes`
+        认证密钥
+    workers : `int`
+        工作进程数
+    config_path : `str`
+        配置文件路径
+    '''
+    import logging
+    logger = logging.getLogger('root')
+
+    def handle(conn, pool):
+        with conn:
+            try:
+                job = conn.recv()
+            except EOFError:
+                return
+            result = pool.apply(run_job, (job, config_path))
+            conn.send(result)
+        logger.info(' {0} {1}: {2}'.format(job.get('kind'), job.get('pfn'),
+                                           result['status']))
+
+    with Pool(workers, initializer=warm_up, initargs=(config_path,)) as pool:
+        with Listener(tuple(address), authkey=authkey) as listener:
+            logger.info(' pool listening on {}'.format(address))
+            while True:
+                conn = listener.accept()
+                threading.Thread(target=handle, args=(conn, pool),
+                                 daemon=True).start()
+
+
+def main():
+    config = get_config('../config.json')
+    pool_config = config['pool']
+
+    import opr.log as log
+    from opr.optools import check_dir
+    check_dir(pool_config['log_path'])
+    # 日志选项见log.setup_custom_logger，默认同时输出到标准输出
+    log_options = {'console': True}
+    log_options.update(config.get('log', {}))
+    log.setup_custom_logger(pool_config['log_path']+'pool','root',
+                            **log_options)
+
+    serve(pool_config['address'], pool_config['authkey'].encode(),
+          pool_config.get('workers', 4))
+
+
+if __name__ == '__main__':
+    main()
@@ -12,15 +12,16 @@ import sys
 sys.path.append('..')
 
 import os
-import json as js
 import time
 from datetime import datetime
 import traceback
 import optools as opt
 from algom.io import parse, save_as_json
+from algom.config import get_config
+from algom.stnstat import StationStats
+from opr.arrival import ArrivalStats
 
-with open('../config.json') as f:
-    config = js.load(f)
+config = get_config('../config.json')
 
 # 根据传参选择运行模式
 try:
@@ -54,7 +55,10 @@ opt.check_dir(SAVE_PATH)
 
 # 配置日志信息
 import opr.log as log
-logger = log.setup_custom_logger(LOG_PATH+'wprd','root')
+# 日志选项见log.setup_custom_logger，默认同时输出到标准输出
+log_options = {'console': True}
+log_options.update(config.get('log', {}))
+logger = log.setup_custom_logger(LOG_PATH+'wprd','root',**log_options)
 
 
 def gather(curset, root_path):
@@ -93,7 +97,7 @@ def gather(curset, root_path):
     return result_list
 
 
-def main(rootpath, outpath):
+def main(rootpath, outpath, config):
     '''主要用于自动化处理ROBS文件
 
     输入参数
@@ -102,6 +106,8 @@ def main(rootpath, outpath):
         数据源的根路径，其末尾不带日期文件夹路径
     outpath : `str`
         数据保存路径，其末尾不带日期文件夹路径
+    config : `algom.config.Config`
+        配置对象
     '''
 
     opt.check_dir(outpath)
@@ -135,10 +141,20 @@ def main(rootpath, outpath):
     expect_time = opt.get_expect_time(PRESET_PATH)
     turn_time = False
 
+    # 站点可靠性统计库，跨日持续累计
+    stats_pfn = PRESET_PATH + 'stnstat.pk'
+    stats = StationStats.load(stats_pfn, config.get('stnstat'))
+
+    # 站点到报时延统计，用于自适应截止时次
+    arrivals_pfn = PRESET_PATH + 'arrival.pk'
+    arrivals = ArrivalStats.load(arrivals_pfn, config.get('arrival'))
+
     # 今日时间对象
     dt_today = datetime.utcnow()
 
     while True:
+        config.reload()
+
         # 如果当前日期与上次记录不一致
         if opt.get_today_date() != today and turn_day_switch == False:
             turn_day_timestamp = time.time()
@@ -175,7 +191,6 @@ def main(rootpath, outpath):
         files = os.listdir(inpath)
 
         if initial == True:
-            print('{}: initialize.'.format(datetime.utcnow()))
             logger.info(' initialize.')
             initial = False
         else:
@@ -185,20 +200,33 @@ def main(rootpath, outpath):
             expect_time = opt.get_expect_time(PRESET_PATH)
 
         curset, turn_time = opt.extract_curset(files,expect_time, dt_today,
-                                               PRESET_PATH)
+                                               PRESET_PATH, config=config,
+                                               stats=stats, arrivals=arrivals,
+                                               inpath=inpath)
+        if turn_time:
+            stats.save(stats_pfn)
+            arrivals.save(arrivals_pfn)
+
+        # 已截止时次的迟到文件，重新处理该时次，下游程序会据文件更新重新插值
+        late = opt.extract_late(files, dt_today, PRESET_PATH, arrivals, inpath,
+                                config, stats)
+        for slot in sorted(late):
+            logger.info(' reprocessing: {}'.format(slot))
+            slotset = opt.slot_files(files, slot, dt_today, config, stats)
+            result_list = gather(slotset, inpath)
+            if result_list:
+                save_as_json(result_list, savepath + slot + '.json',
+                             mod='multi')
 
         if curset:
-            print('{0}: processing: {1}'.format(datetime.utcnow(),expect_time))
             logger.info(' processing: {}'.format(expect_time))
             result_list = gather(curset, inpath)
             if result_list:
                 save_as_json(result_list,
                              savepath + expect_time + '.json',
                              mod='multi')
-                print('{}: finished.'.format(datetime.utcnow()))
                 logger.info(' finished.')
             else:
-                print('{}: parsed empty content.'.format(datetime.utcnow()))
                 logger.info(' parsed empty content.')
 
         else:
@@ -207,10 +235,9 @@ def main(rootpath, outpath):
 
 if __name__ == '__main__':
     try:
-        main(ROOT_PATH, SAVE_PATH)
+        main(ROOT_PATH, SAVE_PATH, config)
     except:
         # 若出现异常，则打印回溯信息并记入日志
         traceback_message = traceback.format_exc()
-        print(traceback_message)
         logger.error(traceback_message)
         exit()
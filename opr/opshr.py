@@ -13,17 +13,15 @@ sys.path.append('..')
 
 import os
 import time
-import json as js
 import traceback
 import shutil as st
-from datetime import datetime, timedelta
 import optools as opt
 import algom.shear as shr
+from algom.config import get_config
 
 
 # 加载配置文件
-with open('../config.json') as f:
-    config = js.load(f)
+config = get_config('../config.json')
 
 
 # 判断测试模式还是业务模式
@@ -61,12 +59,14 @@ opt.check_dir(BUFFER_PATH)
 
 # 配置日志信息
 import log
-logger = log.setup_custom_logger(LOG_PATH+'wprd','root')
+# 日志选项见log.setup_custom_logger，默认同时输出到标准输出
+log_options = {'console': True}
+log_options.update(config.get('log', {}))
+logger = log.setup_custom_logger(LOG_PATH+'wprd','root',**log_options)
 
 
 def main(rootpath, bufferpath, outpath):
     try:
-        print('Initial')
         logger.info(' Initial')
 
         folds = os.listdir(rootpath)
@@ -76,17 +76,17 @@ def main(rootpath, bufferpath, outpath):
 
         while True:
             fold = sorted(os.listdir(rootpath))[-1]
-            newfiles = opt.get_new_files(fold,ROOT_PATH,PRESET_PATH,'shr.pk')
+            # 重新插值后被更新的格点文件同样需要重新计算切变
+            newfiles, updated = opt.get_changed_files(fold,ROOT_PATH,
+                                                      PRESET_PATH,'shr.pk')
+            newfiles = sorted(newfiles + updated)
             foldpath = rootpath + fold + '/'
             savepath = outpath + fold + '/'
             opt.check_dir(savepath)
             if newfiles:
-                print('dir {0} has new file:'.format(fold))
                 logger.info(' dir {0} has new file:'.format(fold))
                 for fn in newfiles:
-                    print('\t{0}'.format(fn))
-                    logger.info(' {0}'.format(fn))
-                print('processing...')
+                    logger.info(' new file', extra=log.sample(file=fn))
                 logger.info(' processing...')
                 for fn in newfiles:
                     # 为防止nc文件在写入的时候被下游程序读取并造成未知错误，
@@ -99,13 +99,11 @@ def main(rootpath, bufferpath, outpath):
                     shr.full_wind_shear(foldpath + fn, bufferpfn)
                     st.copy(bufferpfn,savepfn)
                     os.remove(bufferpfn)
-                    print('{0} finished'.format(fn))
                     logger.info(' {0} finished'.format(fn))
 
             time.sleep(5)
     except:
         traceback_message = traceback.format_exc()
-        print(traceback_message)
         logger.info(traceback_message)
         exit()
 
@@ -8,18 +8,19 @@
 python = 3.6
 --------------------------------------------------------------------
 '''
+import sys
+sys.path.append('..')
+
 import os
 import pickle as pk
 from datetime import datetime, timedelta
 import time
 import logging
-import json as js
-
-
-with open('../config.json') as f:
-    config = js.load(f)
+from collections import Counter
+from functools import lru_cache
 
-exclued = config['exclude']
+from algom.config import get_config
+from opr.log import sample
 
 
 # 调用全局日志
@@ -150,6 +151,44 @@ def get_new_files(fold,ROOT_PATH,PRESET_PATH,preset_fn):
     return diff
 
 
+def get_changed_files(fold,ROOT_PATH,PRESET_PATH,preset_fn):
+    '''获取未处理文件集及处理后又被更新（重写）的文件集
+
+    前集以{文件名: 修改时间}的字典形式保存，`get_new_files`保存的集合形式前集中的
+    文件视为已处理且未更新。
+
+    返回值
+    -----
+    `tuple` : (新文件列表, 更新文件列表)
+    '''
+    try:
+        preset = load_preset(PRESET_PATH + preset_fn)
+    except FileNotFoundError:
+        preset = {}
+    legacy = set([])
+    if not isinstance(preset, dict):
+        legacy = set(preset)
+        preset = {}
+    path = ROOT_PATH + fold + '/'
+    new = []
+    updated = []
+    for entry in os.scandir(path):
+        stamp = entry.stat().st_mtime_ns
+        old = preset.get(entry.name)
+        if old is None and entry.name in legacy:
+            pass
+        elif old is None:
+            new.append(entry.name)
+        elif old != stamp:
+            updated.append(entry.name)
+        else:
+            continue
+        preset[entry.name] = stamp
+    if new or updated or legacy:
+        save_preset(preset, PRESET_PATH + preset_fn)
+    return sorted(new), sorted(updated)
+
+
 def get_expect_time(preset_path):
     '''获取期望时次'''
     time_preset_pfn = preset_path + 'times.pk'
@@ -175,9 +214,57 @@ def get_station_id(file_name):
     return station_id
 
 
-def extract_curset(files, expect_time, dt_today, preset_path,
-                   exclude=exclued):
-    '''收集文件源（文件名）'''
+def record_latency(arrivals, files, inpath, slot):
+    '''记录文件相对所属标准时次的到报时延'''
+    nominal = strftime_to_datetime(slot)
+    for fn in files:
+        try:
+            mtime = os.stat(inpath + fn).st_mtime
+        except OSError:
+            continue
+        latency = (datetime.utcfromtimestamp(mtime) - nominal).total_seconds()
+        arrivals.add(get_station_id(fn), latency)
+
+
+def extract_curset(files, expect_time, dt_today, preset_path, exclude=None,
+                   config=None, stats=None, arrivals=None, inpath=None):
+    '''收集文件源（文件名）
+
+    输入参数
+    -------
+    files : `list`
+        数据目录下的全部文件名
+    expect_time : `str`
+        期望时次
+    dt_today : `datetime`
+        今日时间对象
+    preset_path : `str`
+        前集存储路径
+    exclude : `list` | `set`
+        剔除站点列表，默认为None，即取配置中的剔除列表
+    config : `algom.config.Config`
+        配置对象，仅在未给出exclude时用于获取剔除站点列表，默认为None，即使用
+        `get_config()`惰性加载的默认配置
+    stats : `algom.stnstat.StationStats`
+        站点可靠性统计库，默认为None。若给出，则同时剔除统计库给出的动态剔除站点，
+        并在时次结束时以该时次的到报和重复情况更新统计库
+    arrivals : `opr.arrival.ArrivalStats`
+        到报时延统计，默认为None，即固定在标准时次6分钟后截止。若给出，则按期望站点
+        是否到齐及其p95到报期限自适应截止，并在时次结束时记录各文件的到报时延
+    inpath : `str`
+        数据目录，给出arrivals时必须给出，用于读取文件修改时间
+
+    返回值
+    -----
+    `tuple` : (当前时次的文件集合, 是否转入下一时次)
+    '''
+    if exclude is None:
+        if config is None:
+            config = get_config()
+        exclude = config.exclude
+    exclude = set(exclude)
+    if stats is not None:
+        exclude = exclude | stats.excluded()
 
     # 初始化当前处理集合，curset : current set
     curset = set([])
@@ -197,7 +284,6 @@ def extract_curset(files, expect_time, dt_today, preset_path,
     file_preset = load_preset(file_preset_pfn)
 
     # 记录期望时次
-    print('{0}: expecting: {1}'.format(datetime.utcnow(),expect_time))
     logger.info(' expecting: {}'.format(expect_time))
 
     # （未处理）新集是当前全集减去前集
@@ -205,35 +291,50 @@ def extract_curset(files, expect_time, dt_today, preset_path,
     if not newset:
         logger.debug(' newset is empty.')
 
+    # 匹配到期望时次的全部文件（含被剔除的站点），用于更新统计库
+    matched = set([])
     for file in newset:
-        # 排除部分站点
-        if get_station_id(file) not in exclued:
-            file_time = abstr_time(file, level='minute')
-            # 每一个文件匹配一个标准时间索引
-            match_time = match_standard(file_time,dt_today)
-            # 若匹配的标准时次为期望时次，则加入curset，否则忽略
-            if match_time == expect_time:
+        file_time = abstr_time(file, level='minute')
+        # 每一个文件匹配一个标准时间索引
+        match_time = match_standard(file_time,dt_today)
+        # 若匹配的标准时次为期望时次，则加入curset，否则忽略
+        if match_time == expect_time:
+            matched.add(file)
+            # 排除部分站点
+            if get_station_id(file) not in exclude:
                 curset.add(file)
-                logger.debug(' added {}'.format(file))
+                logger.debug(' added', extra=sample(file=file))
 
     # 删除该时次重复的站
     curset = drop_duplicate_station(curset)
-    print('{0}: real time received: {1}'.format(datetime.utcnow(),len(curset)))
     logger.info(' real time received: {}'.format(len(curset)))
 
     # 达到时间阈值后返回该集合
     spent = datetime.utcnow() - strftime_to_datetime(expect_time)
-    if  spent > timedelta(minutes=6):
-        print('{0}: finally received: {1}'.format(datetime.utcnow(),len(curset)))
-        logger.info(' finally received: {}'.format(len(curset)))
-        file_preset.update(curset)
+    if arrivals is not None:
+        cutoff = arrivals.cutoff(set(get_station_id(fn) for fn in curset),
+                                 exclude)
+    else:
+        cutoff = timedelta(minutes=6)
+    if  spent > cutoff:
+        logger.info(' finally received: {0}, cutoff: {1}s'.format(
+                                  len(curset), int(cutoff.total_seconds())))
+        # 该时次的全部匹配文件（含剔除和重复的文件）均记为已处理，
+        #   此后再出现的属于该时次的文件即为迟到文件
+        file_preset.update(matched)
         time_preset.add(expect_time)
         save_preset(time_preset, time_preset_pfn)
         save_preset(file_preset, file_preset_pfn)
+        if stats is not None:
+            counter = Counter(get_station_id(fn) for fn in matched)
+            stats.update_arrivals(counter.keys(),
+                                  [stn for stn in counter if counter[stn] > 1])
+        if arrivals is not None:
+            record_latency(arrivals, matched, inpath, expect_time)
+            arrivals.close_slot()
         result =  curset
         if not result:
             # 若超时但结果为空集，说明该时次缺失，缺失标志改为True
-            print('{0}: {1} is missing.'.format(datetime.utcnow(),expect_time))
             logger.info(' {} is missing.'.format(expect_time))
         turn_time = True
     else:
@@ -243,6 +344,91 @@ def extract_curset(files, expect_time, dt_today, preset_path,
     return result, turn_time
 
 
+def extract_late(files, dt_today, preset_path, arrivals=None, inpath=None,
+                 config=None, stats=None):
+    '''收集已截止时次的迟到文件
+
+    被剔除站点（配置中的剔除列表及统计库的动态剔除站点）的迟到文件只记入前集，
+    不会触发该时次的重新处理。
+
+    输入参数
+    -------
+    files : `list`
+        数据目录下的全部文件名
+    dt_today : `datetime`
+        今日时间对象
+    preset_path : `str`
+        前集存储路径
+    arrivals : `opr.arrival.ArrivalStats`
+        到报时延统计，若给出则记录迟到文件的时延
+    inpath : `str`
+        数据目录，给出arrivals时必须给出
+    config : `algom.config.Config`
+        配置对象，用于获取剔除站点列表，默认为None，即使用`get_config()`
+    stats : `algom.stnstat.StationStats`
+        站点可靠性统计库，默认为None。若给出，则同时剔除其动态剔除站点
+
+    返回值
+    -----
+    `dict` : {时次: 迟到文件集合}，迟到文件（含被剔除站点的文件）均会被记入前集
+    '''
+    time_preset_pfn = preset_path + 'times.pk'
+    file_preset_pfn = preset_path + 'files.pk'
+    if not (os.path.exists(file_preset_pfn) and
+            os.path.exists(time_preset_pfn)):
+        return {}
+
+    time_preset = load_preset(time_preset_pfn)
+    file_preset = load_preset(file_preset_pfn)
+
+    late = {}
+    for file in set(files) - file_preset:
+        file_time = abstr_time(file, level='minute')
+        match_time = match_standard(file_time,dt_today)
+        if match_time in time_preset:
+            late.setdefault(match_time, set([])).add(file)
+
+    if late:
+        for slot, lateset in late.items():
+            file_preset.update(lateset)
+            logger.info(' late files of {0}: {1}'.format(slot, len(lateset)))
+            if arrivals is not None:
+                record_latency(arrivals, lateset, inpath, slot)
+        save_preset(file_preset, file_preset_pfn)
+
+    if config is None:
+        config = get_config()
+    exclude = config.exclude
+    if stats is not None:
+        exclude = exclude | stats.excluded()
+    kept = {}
+    for slot, lateset in late.items():
+        lateset = set(file for file in lateset
+                      if get_station_id(file) not in exclude)
+        if lateset:
+            kept[slot] = lateset
+
+    return kept
+
+
+def slot_files(files, slot, dt_today, config=None, stats=None):
+    '''收集属于某一时次的全部文件（已剔除站点并去重），用于迟到文件到达后重新处理'''
+    if config is None:
+        config = get_config()
+    exclude = config.exclude
+    if stats is not None:
+        exclude = exclude | stats.excluded()
+
+    result = set([])
+    for file in files:
+        if get_station_id(file) in exclude:
+            continue
+        if match_standard(abstr_time(file, level='minute'),dt_today) == slot:
+            result.add(file)
+
+    return drop_duplicate_station(result)
+
+
 def init_preset(path):
     '''初始化前集'''
     if not os.path.exists(path):
@@ -267,6 +453,7 @@ def load_preset(path):
     return preset
 
 
+@lru_cache(maxsize=4)
 def standard_time_index(date):
     '''建立逐6分钟标准时间索引'''
     year = str(date.year)
@@ -351,8 +538,6 @@ def delay_when_today_dir_missing(rootpath):
             is_exist = True
             break
         else:
-            print('{0}: today dir: {1} dosen\'t exist.'.format(datetime.utcnow(),
-                                                               today))
             logger.info(' today dir: {} dosen\'t exist.'.format(today))
             time.sleep(10)
 
@@ -365,7 +550,6 @@ def delay_when_data_dir_empty(path):
         if files:
             break
         else:
-            print('{}: target dir is empty.'.format(datetime.utcnow()))
             logger.info(' target dir is empty.')
             time.sleep(10)
 
@@ -0,0 +1,385 @@
+# coding : utf-8
+'''
+--------------------------------------------------------------------
+项目名：rwp
+模块名：opr.query
+该模块为近期产品的只读查询服务
+
+各下游程序不再自行打开保存目录中的nc文件，而是通过本服务查询。服务在内存中
+以LRU方式缓存最近若干时次的格点、切变、散度数据，按占用字节数淘汰；后台线程
+定时扫描各产品的当日目录，新时次一经生成即预先载入缓存。
+
+接口（GET，返回json；slice可加format=bin返回小端float32原始数组）：
+    /slots?kind=grid                              可查询的时次列表
+    /profile?kind=grid&time=&lon=&lat=            最近格点的廓线
+    /slice?kind=grid&var=U&level=0&time=          单层二维场
+    /series?station=&start=&end=&var=HWS,HWD      单站时间-高度序列
+time缺省为最新时次，kind缺省为grid。/series的起止时间跨度不得超过
+max_series_days天，否则返回400。
+
+配置示例（config.json中的'query'项）：
+    {"address": ["127.0.0.1", 6200], "max_bytes": 500000000, "poll": 10,
+     "max_series_days": 7, "log_path": "...", "products": {"grid": "...", "shear": "...",
+     "divg": "..."}}
+--------------------------------------------------------------------
+python = 3.6
+--------------------------------------------------------------------
+'''
+import sys
+sys.path.append('..')
+
+import os
+import time
+import logging
+import traceback
+import threading
+import json as js
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+logger = logging.getLogger('root')
+
+
+def load_cube(pfn):
+    '''读取单个nc产品文件
+
+    返回值
+    -----
+    `dict` : {变量名: numpy.ndarray}，缺省值转为np.nan
+    '''
+    import netCDF4 as nc
+
+    cube = {}
+    with nc.Dataset(pfn) as dataset:
+        for name, var in dataset.variables.items():
+            values = var[:]
+            if np.ma.isMaskedArray(values):
+                if values.dtype.kind == 'f':
+                    values = values.filled(np.nan)
+                else:
+                    values = values.data
+            values = np.asarray(values)
+            if values.dtype.kind == 'f' and values.ndim > 1:
+                values = values.astype(np.float32)
+                values[values == -9999.] = np.nan
+            cube[name] = values
+    return cube
+
+
+def cube_size(cube):
+    return sum(values.nbytes for values in cube.values())
+
+
+class CubeCache(object):
+    '''按占用字节数淘汰的LRU缓存
+
+    输入参数
+    -------
+    max_bytes : `int`
+        缓存上限（字节）
+    loader : `callable`
+        由键载入数据的函数，返回`dict`
+    '''
+    def __init__(self, max_bytes, loader=load_cube):
+        self.max_bytes = max_bytes
+        self.loader = loader
+        self.items = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                cube = self.items[key][0]
+            except KeyError:
+                pass
+            else:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return cube
+
+        # 载入在锁外进行，不阻塞其他时次的查询
+        cube = self.loader(key)
+        with self._lock:
+            self.misses += 1
+            self._put(key, cube)
+        return cube
+
+    def _put(self, key, cube):
+        if key in self.items:
+            self.nbytes -= self.items.pop(key)[1]
+        size = cube_size(cube)
+        self.items[key] = (cube, size)
+        self.nbytes += size
+        while self.nbytes > self.max_bytes and len(self.items) > 1:
+            _, (_, size) = self.items.popitem(last=False)
+            self.nbytes -= size
+
+    def put(self, key, cube):
+        with self._lock:
+            self._put(key, cube)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self.items
+
+
+class ProductIndex(object):
+    '''各产品保存目录的时次索引
+
+    时次表只由后台扫描线程更新，且按写时复制方式整体替换：请求线程取得的
+    时次表不会再被修改，可在锁外直接遍历。
+
+    输入参数
+    -------
+    products : `dict`
+        {产品名: 保存根路径}，根路径下为日期目录，其中为<时次>.nc文件
+    '''
+    def __init__(self, products):
+        self.products = products
+        self.slots = {kind: {} for kind in products}
+        self.mtimes = {}
+        self._lock = threading.Lock()
+
+    def scan(self, days=2):
+        '''扫描各产品最近days个日期目录，返回新出现或更新的文件路径'''
+        with self._lock:
+            return self._scan(days)
+
+    def _scan(self, days):
+        changed = []
+        snapshot = dict(self.slots)
+        for kind, root in self.products.items():
+            try:
+                folds = sorted(name for name in os.listdir(root)
+                               if name.isdigit())[-days:]
+            except FileNotFoundError:
+                continue
+            slots = None
+            for fold in folds:
+                path = os.path.join(root, fold)
+                for entry in os.scandir(path):
+                    if not entry.name.endswith('.nc'):
+                        continue
+                    mtime = entry.stat().st_mtime_ns
+                    if self.mtimes.get(entry.path) != mtime:
+                        self.mtimes[entry.path] = mtime
+                        if slots is None:
+                            slots = dict(snapshot[kind])
+                        slots[entry.name[:-3]] = entry.path
+                        changed.append(entry.path)
+            if slots is not None:
+                snapshot[kind] = slots
+        self.slots = snapshot
+        return changed
+
+    def latest(self, kind):
+        slots = self.slots[kind]
+        return max(slots) if slots else None
+
+    def locate(self, kind, timestr=None):
+        '''产品文件路径，timestr为None时取最新时次'''
+        if kind not in self.products:
+            raise KeyError('unknown kind: {}'.format(kind))
+        if timestr is None:
+            timestr = self.latest(kind)
+        pfn = self.slots[kind].get(timestr)
+        if pfn is None and timestr:
+            # 不在近期目录中的时次按目录规则直接定位
+            pfn = os.path.join(self.products[kind], timestr[:8],
+                               timestr + '.nc')
+            if not os.path.exists(pfn):
+                pfn = None
+        if pfn is None:
+            raise KeyError('no {0} product at {1}'.format(kind, timestr))
+        return timestr, pfn
+
+
+def to_list(values):
+    '''数组转为json列表，np.nan输出为null'''
+    values = np.asarray(values, dtype=np.float64)
+    return np.where(np.isnan(values), None, values.round(4)).tolist()
+
+
+class QueryService(object):
+    '''查询逻辑，与HTTP处理分离以便直接调用'''
+    def __init__(self, products, max_bytes=500 * 2**20, series_root=None,
+                 preload=4, max_series_days=7):
+        self.index = ProductIndex(products)
+        self.cache = CubeCache(max_bytes)
+        self.series_root = series_root
+        self.preload = preload
+        self.max_series_days = max_series_days
+
+    def refresh(self):
+        '''扫描新时次，预先载入各产品最新的preload个时次，
+        已缓存时次的文件更新时（如迟到文件重新插值）重新载入'''
+        changed = self.index.scan()
+        newest = set()
+        for slots in self.index.slots.values():
+            newest.update(slots[slot] for slot in sorted(slots)[-self.preload:])
+        for pfn in changed:
+            if pfn not in newest and pfn not in self.cache:
+                continue
+            try:
+                self.cache.put(pfn, load_cube(pfn))
+            except (OSError, RuntimeError) as e:
+                logger.error(' failed to load {0}: {1}'.format(pfn, e))
+
+    def slots(self, kind='grid'):
+        return {'kind': kind, 'slots': sorted(self.index.slots[kind])}
+
+    def profile(self, lon, lat, kind='grid', time=None):
+        timestr, pfn = self.index.locate(kind, time)
+        cube = self.cache.get(pfn)
+        i = int(np.abs(cube['lon'] - lon).argmin())
+        j = int(np.abs(cube['lat'] - lat).argmin())
+        result = {'time': timestr, 'lon': float(cube['lon'][i]),
+                  'lat': float(cube['lat'][j])}
+        if 'level' in cube:
+            result['level'] = to_list(cube['level'])
+        for name, values in cube.items():
+            if values.ndim == 3:
+                result[name] = to_list(values[:, j, i])
+            elif values.ndim == 2:
+                result[name] = to_list(values[j, i])
+        return result
+
+    def level_slice(self, var, level=None, kind='grid', time=None):
+        '''单层二维场，返回(时次, 数组, 格点坐标)'''
+        timestr, pfn = self.index.locate(kind, time)
+        cube = self.cache.get(pfn)
+        values = cube[var]
+        if values.ndim == 3:
+            values = values[int(level or 0)]
+        return timestr, values, cube['lon'], cube['lat']
+
+    def series(self, station, start, end, variables=('HWS', 'HWD', 'VWS')):
+        from algom.series import station_series
+        span = datetime.strptime(end, '%Y%m%d%H%M') - \
+               datetime.strptime(start, '%Y%m%d%H%M')
+        if span > timedelta(days=self.max_series_days):
+            raise ValueError('series range exceeds {} days'.format(
+                                                     self.max_series_days))
+        result = station_series(self.series_root, station, start, end,
+                                variables)
+        return {key: to_list(value) if key != 'time' else value
+                for key, value in result.items()}
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    service = None
+
+    def _send(self, status, body, content_type='application/json',
+              headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, status, content):
+        self._send(status, js.dumps(content).encode())
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in
+                  parse_qs(url.query).items()}
+        kind = params.get('kind', 'grid')
+        service = self.service
+        try:
+            if url.path == '/slots':
+                self._json(200, service.slots(kind))
+            elif url.path == '/profile':
+                self._json(200, service.profile(float(params['lon']),
+                                                 float(params['lat']), kind,
+                                                 params.get('time')))
+            elif url.path == '/slice':
+                timestr, values, lon, lat = service.level_slice(
+                    params['var'], params.get('level'), kind,
+                    params.get('time'))
+                if params.get('format') == 'bin':
+                    self._send(200, values.astype('<f4').tobytes(),
+                               'application/octet-stream',
+                               {'X-Time': timestr,
+                                'X-Shape': ','.join(map(str, values.shape))})
+                else:
+                    self._json(200, {'time': timestr, 'var': params['var'],
+                                     'lon': to_list(lon), 'lat': to_list(lat),
+                                     'data': to_list(values)})
+            elif url.path == '/series':
+                variables = tuple(params.get('var', 'HWS,HWD,VWS').split(','))
+                self._json(200, service.series(params['station'],
+                                               params['start'], params['end'],
+                                               variables))
+            else:
+                self._json(404, {'error': 'unknown path: ' + url.path})
+        except KeyError as e:
+            self._json(404, {'error': 'not found: {}'.format(e)})
+        except (ValueError, IndexError) as e:
+            self._json(400, {'error': str(e)})
+        except Exception as e:
+            # 例如正在写入或不完整的nc文件，仍须给客户端返回响应
+            logger.error(traceback.format_exc())
+            self._json(500, {'error': '{0}: {1}'.format(type(e).__name__,
+                                                        e)})
+
+    def log_message(self, format, *args):
+        logger.debug(' ' + format % args)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def serve(address, service, poll=10):
+    '''启动查询服务，后台线程每poll秒扫描一次新时次'''
+    def watch():
+        while True:
+            service.refresh()
+            time.sleep(poll)
+
+    threading.Thread(target=watch, daemon=True).start()
+    handler = type('Handler', (QueryHandler,), {'service': service})
+    server = ThreadingHTTPServer(tuple(address), handler)
+    logger.info(' query service listening on {}'.format(address))
+    server.serve_forever()
+
+
+def main():
+    from algom.config import get_config
+    from opr.optools import check_dir
+    import opr.log as log
+
+    config = get_config('../config.json')
+    query_config = config['query']
+
+    check_dir(query_config['log_path'])
+    # 日志选项见log.setup_custom_logger，默认同时输出到标准输出
+    log_options = {'console': True}
+    log_options.update(config.get('log', {}))
+    log.setup_custom_logger(query_config['log_path']+'query','root',
+                            **log_options)
+
+    products = query_config.get('products') or {
+        'grid': config['mkgrd']['oper']['save_path'],
+        'shear': config['shear']['oper']['save_path']}
+    service = QueryService(products, query_config.get('max_bytes', 500*2**20),
+                           config['parse']['oper']['save_path'],
+                           max_series_days=query_config.get('max_series_days',
+                                                            7))
+    serve(query_config.get('address', ('127.0.0.1', 6200)), service,
+          query_config.get('poll', 10))
+
+
+if __name__ == '__main__':
+    main()
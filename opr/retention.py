@@ -0,0 +1,239 @@
+# coding : utf-8
+'''
+--------------------------------------------------------------------
+项目名：rwp
+模块名：opr.retention
+本模块用于统一管理各产品目录的历史数据保留
+
+所有产品目录由同一进程管理，每个目录一条保留策略：
+    max_age_days : 保留天数，早于该天数的日期目录将被清理
+    max_bytes : 目录总大小上限，超出时从最早的日期目录开始清理（当日目录除外）
+    archive_path : 若给出，则清理前先将日期目录压缩归档到该路径
+各日期目录的大小增量统计：文件原地重写（如迟到时次重新插值）不改变目录的
+修改时间，因此最近recent_days天的目录每次都重新统计，更早的目录只在目录
+修改时间变化时才重新统计。
+删除按批进行，每批之间暂停，以免大量删除时的磁盘读写影响时次处理。
+
+配置示例（config.json中的'retention'项）：
+    {"log_path": "...", "interval": 3600, "batch": 200, "pause": 1.0,
+     "policies": [{"path": "/data/mkgrd/", "max_age_days": 3,
+                   "max_bytes": 50000000000, "archive_path": null},
+                  {"path": "/data/store/", "max_age_days": 2}]}
+其中格点产品的分块数组存储（mkgrd的store_path）按日分区，同样由策略清理。
+--------------------------------------------------------------------
+python = 3.6
+--------------------------------------------------------------------
+'''
+import sys
+sys.path.append('..')
+
+import os
+import time
+import tarfile
+import logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger('root')
+
+
+class Policy(object):
+    '''单个产品目录的保留策略
+
+    输入参数
+    -------
+    path : `str`
+        产品根目录，其下为按日期（YYYYmmdd）命名的子目录
+    max_age_days : `int`
+        保留天数，None表示不按天数清理
+    max_bytes : `int`
+        目录总大小上限（字节），None表示不按大小清理
+    archive_path : `str`
+        归档路径，None表示直接删除
+    recent_days : `int`
+        仍可能被写入或重写的最近天数，这些日期目录每次都重新统计大小
+    '''
+    def __init__(self, path, max_age_days=3, max_bytes=None,
+                 archive_path=None, recent_days=2):
+        self.path = path
+        self.max_age_days = max_age_days
+        self.max_bytes = max_bytes
+        self.archive_path = archive_path
+        self.recent_days = recent_days
+        # {日期: (目录修改时间, 大小)}
+        self.usage = {}
+
+    def days(self):
+        '''当前存在的日期目录（升序）'''
+        try:
+            names = [entry.name for entry in os.scandir(self.path)
+                     if entry.is_dir() and entry.name.isdigit() and
+                     len(entry.name) == 8]
+        except FileNotFoundError:
+            return []
+        return sorted(names)
+
+    def refresh(self, now=None):
+        '''增量更新各日期目录的大小统计
+
+        返回值
+        -----
+        `int` : 目录总大小（字节）
+        '''
+        if now is None:
+            now = datetime.utcnow()
+        recent = (now - timedelta(days=self.recent_days - 1)).strftime('%Y%m%d')
+        days = self.days()
+        for day in set(self.usage) - set(days):
+            del self.usage[day]
+        for day in days:
+            daypath = os.path.join(self.path, day)
+            try:
+                mtime = os.stat(daypath).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            cached = self.usage.get(day)
+            if cached is None or cached[0] != mtime or day >= recent:
+                self.usage[day] = (mtime, dir_size(daypath))
+
+        return self.total()
+
+    def total(self):
+        return sum(size for _, size in self.usage.values())
+
+    def expired(self, now=None):
+        '''需要清理的日期目录（升序）'''
+        if now is None:
+            now = datetime.utcnow()
+        today = now.strftime('%Y%m%d')
+        days = [day for day in self.days() if day != today]
+
+        result = []
+        if self.max_age_days is not None:
+            limit = (now - timedelta(days=self.max_age_days)).strftime('%Y%m%d')
+            result = [day for day in days if day <= limit]
+
+        if self.max_bytes is not None:
+            total = self.total() - sum(self.usage.get(day, (0, 0))[1]
+                                       for day in result)
+            for day in days:
+                if total <= self.max_bytes:
+                    break
+                if day not in result:
+                    result.append(day)
+                    total -= self.usage.get(day, (0, 0))[1]
+
+        return sorted(result)
+
+
+def dir_size(path):
+    '''统计目录大小（字节）'''
+    total = 0
+    for root, _, files in os.walk(path):
+        for fn in files:
+            try:
+                total += os.lstat(os.path.join(root, fn)).st_size
+            except FileNotFoundError:
+                continue
+    return total
+
+
+def remove_tree(path, batch=200, pause=1.):
+    '''分批删除目录，每删除batch个文件暂停pause秒'''
+    count = 0
+    for root, dirs, files in os.walk(path, topdown=False):
+        for fn in files:
+            try:
+                os.remove(os.path.join(root, fn))
+            except FileNotFoundError:
+                pass
+            count += 1
+            if count % batch == 0:
+                time.sleep(pause)
+        for dn in dirs:
+            try:
+                os.rmdir(os.path.join(root, dn))
+            except OSError:
+                pass
+    os.rmdir(path)
+
+
+def archive_tree(path, archive_path):
+    '''将目录压缩归档为tar.gz文件'''
+    if not os.path.exists(archive_path):
+        os.makedirs(archive_path)
+    name = os.path.basename(os.path.normpath(path))
+    archive_pfn = os.path.join(archive_path, name + '.tar.gz')
+    with tarfile.open(archive_pfn + '.tmp', 'w:gz') as tar:
+        tar.add(path, arcname=name)
+    os.replace(archive_pfn + '.tmp', archive_pfn)
+    return archive_pfn
+
+
+def enforce(policy, batch=200, pause=1., now=None):
+    '''执行单个保留策略
+
+    返回值
+    -----
+    `list` : 被清理的日期目录
+    '''
+    policy.refresh(now)
+    removed = []
+    for day in policy.expired(now):
+        daypath = os.path.join(policy.path, day)
+        try:
+            if policy.archive_path:
+                archive_pfn = archive_tree(daypath, policy.archive_path)
+                logger.info(' archived {0} to {1}'.format(daypath,
+                                                          archive_pfn))
+            remove_tree(daypath, batch, pause)
+        except OSError as e:
+            logger.error(' failed to remove {0}, error: OSError, '
+                         'reason: {1}'.format(daypath, e))
+        else:
+            policy.usage.pop(day, None)
+            removed.append(day)
+            logger.info(' successfully removed {} dir'.format(daypath))
+
+    return removed
+
+
+def run(policies, interval=3600, batch=200, pause=1.):
+    '''保留管理主循环'''
+    while True:
+        for policy in policies:
+            enforce(policy, batch, pause)
+        logger.info(' sleep for {} seconds'.format(interval))
+        time.sleep(interval)
+
+
+def load_policies(retention_config):
+    '''由配置构建保留策略列表'''
+    return [Policy(item['path'], item.get('max_age_days', 3),
+                   item.get('max_bytes'), item.get('archive_path'),
+                   item.get('recent_days', 2))
+            for item in retention_config['policies']]
+
+
+def main():
+    from algom.config import get_config
+    from opr.optools import check_dir
+    import opr.log as log
+
+    config = get_config('../config.json')
+    retention_config = config['retention']
+
+    check_dir(retention_config['log_path'])
+    # 日志选项见log.setup_custom_logger，默认同时输出到标准输出
+    log_options = {'console': True}
+    log_options.update(config.get('log', {}))
+    log.setup_custom_logger(retention_config['log_path']+'rm','root',
+                            **log_options)
+
+    run(load_policies(retention_config),
+        retention_config.get('interval', 3600),
+        retention_config.get('batch', 200),
+        retention_config.get('pause', 1.))
+
+
+if __name__ == '__main__':
+    main()
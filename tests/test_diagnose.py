@@ -0,0 +1,45 @@
+# coding:utf-8
+'''algom.diagnose的检验：低空急流判据与气柱积分'''
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+
+from algom.diagnose import low_level_jet, column_integral
+
+
+LEVEL = np.array([250., 500., 750., 1000., 1250., 1500., 1750., 2000., 2500.,
+                  3000.])
+
+
+def test_jet():
+    hws = np.array([5., 10., 15., 20., 16., 12., 10., 9., 8., 8.])[:, None]
+    flag, speed, height, falloff = low_level_jet(hws, LEVEL)
+    assert flag[0] == 1 and speed[0] == 20 and height[0] == 1000
+    assert falloff[0] == 12
+
+
+def test_stronger_wind_above_core_is_not_a_jet():
+    # 1.5km处13 m/s、1.75km处25 m/s、2.5km处5 m/s：最大风速在1.5km以上
+    hws = np.array([4., 6., 8., 10., 12., 13., 25., 15., 5., np.nan])[:, None]
+    flag, speed, height, falloff = low_level_jet(hws, LEVEL)
+    assert flag[0] == 0 and speed[0] == 25 and height[0] == 1750
+
+
+def test_column_integral_uses_layer_depth():
+    cube = np.ones((len(LEVEL), 1, 1))
+    np.testing.assert_allclose(column_integral(cube, LEVEL, 0., 3000.),
+                               3000.)
+    # 高度层只覆盖气层的一部分时按气层厚度计算覆盖率
+    short = LEVEL[:4]
+    assert np.isnan(column_integral(cube[:4], short, 0., 3000.)[0, 0])
+
+
+def test_asl_levels_are_rejected():
+    import pytest
+    from algom.diagnose import slot_diagnostics
+    from algom.errors import InputError
+
+    with pytest.raises(InputError):
+        slot_diagnostics({}, reference='asl')
@@ -0,0 +1,48 @@
+# coding:utf-8
+'''algom.kinematics的检验：固体旋转风场的解析解'''
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+
+from algom.kinematics import kinematics, EARTH_RADIUS
+
+
+OMEGA = 7.292e-5
+
+
+def solid_body():
+    '''u = ωR*cos(lat), v = 0的固体旋转风场'''
+    lon = np.arange(100., 120.01, 0.5)
+    lat = np.arange(10., 60.01, 0.5)
+    u = np.repeat(OMEGA * EARTH_RADIUS * np.cos(np.deg2rad(lat))[:, None],
+                  len(lon), axis=1)
+    v = np.zeros_like(u)
+    return u, v, lon, lat
+
+
+def test_solid_body_rotation():
+    u, v, lon, lat = solid_body()
+    result = kinematics(u, v, lon, lat)
+    inner = (slice(1, -1), slice(1, -1))
+    sin = np.sin(np.deg2rad(lat))[1:-1, None]
+    tol = 1e-3 * OMEGA
+
+    np.testing.assert_allclose(result['VOR'][inner],
+                               np.broadcast_to(2 * OMEGA * sin,
+                                               result['VOR'][inner].shape),
+                               rtol=1e-4)
+    for name in ('DIV', 'STR', 'SHD', 'DEF'):
+        np.testing.assert_allclose(result[name][inner], 0., atol=tol)
+    # 无变形时梯度张量只剩旋转部分，其范数为|VOR|/sqrt(2)
+    np.testing.assert_allclose(result['HSHR'][inner],
+                               np.abs(result['VOR'][inner]) / np.sqrt(2),
+                               rtol=1e-4)
+
+
+def test_edges_are_missing():
+    u, v, lon, lat = solid_body()
+    result = kinematics(u, v, lon, lat)
+    for values in result.values():
+        assert np.isnan(values[0]).all() and np.isnan(values[:, -1]).all()